@@ -0,0 +1,213 @@
+# coding=utf-8
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from urllib.request import Request, urlopen
+
+try:
+    from rapidjson import loads
+except ImportError:
+    from json import loads
+
+import redis
+
+from core.cluster import split_shards, ENV_CLUSTER_ID, ENV_SHARD_IDS, ENV_SHARD_COUNT, CLUSTER_KEY, \
+                         LAUNCHER_CHANNEL, LAUNCHER_RESTART, LAUNCHER_SHUTDOWN, HEARTBEAT_TTL
+from core.confparser import get_settings_parser
+from core.serverhandler import ServerHandler
+
+#####
+# Cluster launcher
+# Runs Nano as several processes, each owning a contiguous range of shards.
+#
+# settings.ini:
+#   [Cluster]
+#   clusters = 4    (defaults to the amount of CPU cores)
+#   shards = 16     (0 or empty = use the amount Discord recommends)
+#
+# SIGHUP or nano.restart (in any cluster) does a rolling restart,
+# SIGINT/SIGTERM or nano.kill stops all clusters.
+#####
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("cluster")
+
+parser = get_settings_parser()
+
+GATEWAY_URL = "https://discord.com/api/v8/gateway/bot"
+
+# How long to wait for a restarted cluster to become ready before moving on
+READY_TIMEOUT = 180
+# How long a cluster gets to shut down gracefully
+STOP_TIMEOUT = 30
+# Crashed clusters are restarted after this many seconds
+CRASH_BACKOFF = 5
+
+
+def get_int_option(section: str, option: str) -> int:
+    value = parser.get(section, option, fallback="").strip()
+    return int(value) if value.isdigit() else 0
+
+
+def get_recommended_shards(token: str) -> int:
+    req = Request(GATEWAY_URL, headers={"Authorization": "Bot {}".format(token), "User-Agent": "Nano cluster launcher"})
+
+    with urlopen(req, timeout=15) as resp:
+        return int(loads(resp.read().decode())["shards"])
+
+
+class Worker:
+    __slots__ = ("cluster_id", "shard_ids", "shard_count", "process", "started")
+
+    def __init__(self, cluster_id: int, shard_ids: list, shard_count: int):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+
+        self.process = None
+        self.started = 0
+
+    def spawn(self):
+        env = dict(os.environ)
+        env[ENV_CLUSTER_ID] = str(self.cluster_id)
+        env[ENV_SHARD_IDS] = ",".join(str(a) for a in self.shard_ids)
+        env[ENV_SHARD_COUNT] = str(self.shard_count)
+
+        self.process = subprocess.Popen([sys.executable, "nano.py"], env=env)
+        self.started = time.time()
+
+        log.info("Started cluster {} (shards {}-{}, pid {})".format(self.cluster_id, self.shard_ids[0],
+                                                                     self.shard_ids[-1], self.process.pid))
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if not self.is_alive():
+            return
+
+        log.info("Stopping cluster {}...".format(self.cluster_id))
+        self.process.send_signal(signal.SIGTERM)
+
+        try:
+            self.process.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            log.warning("Cluster {} didn't stop in time, killing it".format(self.cluster_id))
+            self.process.kill()
+            self.process.wait()
+
+
+class Launcher:
+    def __init__(self, cluster_count: int, shard_count: int):
+        self.redis = redis.StrictRedis(connection_pool=ServerHandler.make_pool(*ServerHandler.get_redis_credentials(), db=0))
+
+        self.workers = [Worker(cluster_id, shard_ids, shard_count)
+                        for cluster_id, shard_ids in enumerate(split_shards(shard_count, cluster_count))]
+
+        self.running = True
+        self._restart_requested = threading.Event()
+
+    def is_ready(self, worker: Worker) -> bool:
+        data = self.redis.hgetall(CLUSTER_KEY.format(worker.cluster_id))
+        if not data:
+            return False
+
+        # Must be the heartbeat of the new process, not a leftover of the old one
+        return int(data[b"pid"]) == worker.process.pid and data[b"ready"] == b"1"
+
+    def wait_until_ready(self, worker: Worker) -> bool:
+        deadline = time.time() + READY_TIMEOUT
+
+        while time.time() < deadline and worker.is_alive():
+            if self.is_ready(worker):
+                return True
+
+            time.sleep(2)
+
+        return False
+
+    def rolling_restart(self):
+        """
+        Restarts clusters one by one, so only one shard range is offline at a time
+        """
+        log.info("Rolling restart of {} clusters".format(len(self.workers)))
+
+        for worker in self.workers:
+            if not self.running:
+                return
+
+            worker.stop()
+            worker.spawn()
+
+            if not self.wait_until_ready(worker):
+                log.warning("Cluster {} did not become ready in {} s, continuing".format(worker.cluster_id, READY_TIMEOUT))
+
+        log.info("Rolling restart finished")
+
+    def shutdown(self, *_):
+        self.running = False
+
+    def _listen(self):
+        # Requests from the clusters themselves (nano.restart, nano.kill)
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(LAUNCHER_CHANNEL)
+
+        for message in pubsub.listen():
+            try:
+                command = loads(message["data"].decode())["command"]
+            except (ValueError, KeyError):
+                continue
+
+            if command == LAUNCHER_RESTART:
+                self._restart_requested.set()
+            elif command == LAUNCHER_SHUTDOWN:
+                self.shutdown()
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.shutdown)
+        signal.signal(signal.SIGTERM, self.shutdown)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda *_: self._restart_requested.set())
+
+        threading.Thread(target=self._listen, daemon=True).start()
+
+        # Start clusters one by one: Discord only allows one IDENTIFY per 5 seconds anyway
+        for worker in self.workers:
+            worker.spawn()
+            self.wait_until_ready(worker)
+
+        while self.running:
+            if self._restart_requested.is_set():
+                self._restart_requested.clear()
+                self.rolling_restart()
+
+            # Restart crashed clusters
+            for worker in self.workers:
+                if self.running and not worker.is_alive() and time.time() - worker.started > CRASH_BACKOFF:
+                    log.warning("Cluster {} exited (code {}), restarting".format(worker.cluster_id, worker.process.returncode))
+                    worker.spawn()
+
+            time.sleep(1)
+
+        for worker in self.workers:
+            worker.stop()
+
+        log.info("All clusters stopped")
+
+
+def main():
+    token = parser.get("Credentials", "token")
+
+    cluster_count = get_int_option("Cluster", "clusters") or os.cpu_count() or 1
+    shard_count = get_int_option("Cluster", "shards") or get_recommended_shards(token)
+
+    log.info("Launching {} shards in {} clusters (heartbeat ttl {} s)".format(shard_count, min(cluster_count, shard_count), HEARTBEAT_TTL))
+    Launcher(cluster_count, shard_count).run()
+
+
+if __name__ == '__main__':
+    main()
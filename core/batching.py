@@ -0,0 +1,184 @@
+# coding=utf-8
+import asyncio
+import logging
+import weakref
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+#####
+# Redis request batching
+# Commands issued through a RedisBatcher during one event loop iteration are sent as one pipeline,
+# and identical reads that are already on their way share the same reply.
+#####
+
+# Commands that are safe to share between callers (read-only and deterministic)
+SHAREABLE_COMMANDS = frozenset((
+    "GET", "MGET", "EXISTS", "TTL",
+    "HGET", "HMGET", "HGETALL", "HKEYS", "HLEN", "HEXISTS",
+    "SMEMBERS", "SISMEMBER", "SCARD",
+    "ZSCORE", "ZCARD", "ZRANGE", "ZRANGEBYSCORE",
+    "LRANGE", "LLEN",
+))
+
+# Longer batches are split into several pipelines
+MAX_BATCH_SIZE = 500
+
+# All live batchers by name, for !debug
+_batchers = weakref.WeakValueDictionary()
+
+
+class BatchStats:
+    __slots__ = ("calls", "shared", "commands", "round_trips", "failed")
+
+    def __init__(self):
+        # Commands requested by callers
+        self.calls = 0
+        # Requests that got the reply of an identical in-flight read
+        self.shared = 0
+        # Commands actually sent and pipelines used to send them
+        self.commands = 0
+        self.round_trips = 0
+        self.failed = 0
+
+    @property
+    def saved(self) -> int:
+        """
+        Round trips that would have been made without batching
+        """
+        return self.calls - self.round_trips
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "round_trips": self.round_trips,
+            "saved": self.saved,
+            "failed": self.failed,
+        }
+
+
+class RedisBatcher:
+    """
+    Coalesces commands into pipelines
+
+    Usage: `await batcher.execute("HGET", key, field)` or one of the shortcuts
+    (`await batcher.hgetall(key)`). Replies are raw (not decoded), same as redis-py.
+    """
+    __slots__ = ("name", "redis", "loop", "stats", "_pending", "_inflight", "_scheduled", "__weakref__")
+
+    def __init__(self, name: str, redis, loop):
+        self.name = name
+        self.redis = redis
+        self.loop = loop
+
+        self.stats = BatchStats()
+
+        # list((command, args, future)) waiting for the next flush
+        self._pending = []
+        # (command, args): future of a shareable read that hasn't been answered yet
+        self._inflight = {}
+        self._scheduled = False
+
+        _batchers[name] = self
+
+    async def execute(self, command: str, *args):
+        self.stats.calls += 1
+        key = (command, args)
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats.shared += 1
+        else:
+            future = self.loop.create_future()
+            self._pending.append((command, args, future))
+
+            if command in SHAREABLE_COMMANDS:
+                self._inflight[key] = future
+            else:
+                # Reads issued after a write must not get a reply from before it
+                self._inflight.clear()
+
+            if not self._scheduled:
+                self._scheduled = True
+                self.loop.call_soon(self._flush)
+
+        # Shielded: a cancelled caller must not cancel the reply for everyone else
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        self._scheduled = False
+
+        batch, self._pending = self._pending, []
+        self.loop.create_task(self._send_all(batch))
+
+    async def _send_all(self, batch: list):
+        # Long batches are sent one pipeline after another, so commands still run in the order they were issued
+        for start in range(0, len(batch), MAX_BATCH_SIZE):
+            await self._send(batch[start:start + MAX_BATCH_SIZE])
+
+    async def _send(self, batch: list):
+        pipe = self.redis.pipeline(transaction=False)
+        for command, args, _ in batch:
+            pipe.execute_command(command, *args)
+
+        try:
+            replies = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            # Connection problems: every command in the batch failed
+            replies = [e] * len(batch)
+        finally:
+            self.stats.commands += len(batch)
+            self.stats.round_trips += 1
+
+            for command, args, future in batch:
+                if self._inflight.get((command, args)) is future:
+                    del self._inflight[(command, args)]
+
+        for (_, _, future), reply in zip(batch, replies):
+            if future.done():
+                continue
+
+            if isinstance(reply, Exception):
+                self.stats.failed += 1
+                future.set_exception(reply)
+            else:
+                future.set_result(reply)
+
+    # Shortcuts
+    async def get(self, name):
+        return await self.execute("GET", name)
+
+    async def exists(self, *names):
+        return await self.execute("EXISTS", *names)
+
+    async def hget(self, name, field):
+        return await self.execute("HGET", name, field)
+
+    async def hmget(self, name, *fields):
+        return await self.execute("HMGET", name, *fields)
+
+    async def hgetall(self, name):
+        return await self.execute("HGETALL", name)
+
+    async def hkeys(self, name):
+        return await self.execute("HKEYS", name)
+
+    async def hset(self, name, field, value):
+        return await self.execute("HSET", name, field, value)
+
+    async def smembers(self, name):
+        return await self.execute("SMEMBERS", name)
+
+    async def scard(self, name):
+        return await self.execute("SCARD", name)
+
+    async def delete(self, *names):
+        return await self.execute("DEL", *names)
+
+    def info(self) -> dict:
+        return dict(name=self.name, pending=len(self._pending), **self.stats.as_dict())
+
+
+def get_batch_info() -> list:
+    return [batcher.info() for batcher in list(_batchers.values())]
@@ -0,0 +1,253 @@
+# coding=utf-8
+import asyncio
+import logging
+import os
+import time
+import traceback
+
+try:
+    from rapidjson import loads, dumps
+except ImportError:
+    from json import loads, dumps
+
+from redis import asyncio as aioredis
+
+from core.utils import log_to_file
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+#####
+# Cluster coordination
+# Every Nano process ("cluster") owns a contiguous range of shards (see cluster.py in the root directory).
+# Clusters publish a heartbeat with their totals and talk to each other over Redis pub/sub.
+#####
+
+# Environment variables set by the launcher
+ENV_CLUSTER_ID = "NANO_CLUSTER_ID"
+ENV_SHARD_IDS = "NANO_SHARD_IDS"
+ENV_SHARD_COUNT = "NANO_SHARD_COUNT"
+
+# cluster:<CLUSTER_ID> => Hash (guilds, members, channels, shards, pid, ready, updated)
+CLUSTER_KEY = "cluster:{}"
+# Set of all cluster ids that have sent a heartbeat
+CLUSTER_IDS = "cluster:ids"
+
+# Cluster <-> cluster commands
+COMMAND_CHANNEL = "nano:cluster"
+# Clusters -> launcher (rolling restart, shutdown)
+LAUNCHER_CHANNEL = "nano:launcher"
+
+HEARTBEAT_INTERVAL = 10
+# A cluster that hasn't sent a heartbeat for this long is considered dead
+HEARTBEAT_TTL = 3 * HEARTBEAT_INTERVAL
+
+# Commands understood by the launcher
+LAUNCHER_RESTART = "restart"
+LAUNCHER_SHUTDOWN = "shutdown"
+
+
+def split_shards(shard_count: int, cluster_count: int) -> list:
+    """
+    Splits shards into contiguous ranges, one per cluster (first clusters get the remainder)
+    :return: list(list(shard_id, ...), ...)
+    """
+    cluster_count = max(1, min(cluster_count, shard_count))
+    per_cluster, remainder = divmod(shard_count, cluster_count)
+
+    ranges = []
+    start = 0
+    for cluster_id in range(cluster_count):
+        size = per_cluster + (1 if cluster_id < remainder else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+
+    return ranges
+
+
+def get_cluster_env():
+    """
+    Returns (cluster_id, shard_ids, shard_count) when started by the launcher, otherwise None
+    """
+    if ENV_CLUSTER_ID not in os.environ:
+        return None
+
+    cluster_id = int(os.environ[ENV_CLUSTER_ID])
+    shard_ids = [int(a) for a in os.environ[ENV_SHARD_IDS].split(",")]
+    shard_count = int(os.environ[ENV_SHARD_COUNT])
+
+    return cluster_id, shard_ids, shard_count
+
+
+class ClusterCoordinator:
+    """
+    Heartbeats, cross-cluster totals and broadcast commands
+
+    A process that wasn't started by the launcher runs as cluster 0 with all shards,
+    so plugins can always use the coordinator.
+    """
+    def __init__(self, client, handler, loop=asyncio.get_event_loop()):
+        self.client = client
+        self.loop = loop
+
+        env = get_cluster_env()
+        if env is None:
+            self.cluster_id, self.shard_ids, self.shard_count = 0, None, None
+            self.managed = False
+        else:
+            self.cluster_id, self.shard_ids, self.shard_count = env
+            self.managed = True
+
+        self.redis = aioredis.StrictRedis(connection_pool=handler.async_pool)
+
+        # command: coroutine(origin_cluster_id, *args)
+        self.commands = {}
+
+        self._tasks = []
+
+    @property
+    def is_managed(self) -> bool:
+        """
+        True if this process is supervised by the cluster launcher
+        """
+        return self.managed
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """
+        True if the guild is on one of this cluster's shards
+        """
+        if not self.managed:
+            return True
+
+        # https://discord.com/developers/docs/topics/gateway#sharding
+        return (int(guild_id) >> 22) % self.shard_count in self.shard_ids
+
+    def start(self):
+        if self._tasks:
+            return
+
+        self._tasks.append(self.loop.create_task(self._heartbeat()))
+        self._tasks.append(self.loop.create_task(self._listen()))
+
+    # Heartbeat & totals
+    def _local_stats(self) -> dict:
+        guilds = self.client.guilds
+
+        return {
+            "guilds": len(guilds),
+            "members": sum(int(g.member_count or 0) for g in guilds),
+            "channels": sum(len(g.channels) for g in guilds),
+            "shards": ",".join(str(a) for a in self.client.shards.keys()),
+            "pid": os.getpid(),
+            "ready": int(self.client.is_ready()),
+            "updated": int(time.time()),
+        }
+
+    async def send_heartbeat(self):
+        key = CLUSTER_KEY.format(self.cluster_id)
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(key, mapping=self._local_stats())
+        pipe.expire(key, HEARTBEAT_TTL)
+        pipe.sadd(CLUSTER_IDS, self.cluster_id)
+        await pipe.execute()
+
+    async def _heartbeat(self):
+        while True:
+            try:
+                await self.send_heartbeat()
+            except Exception:
+                log.warning("Could not send cluster heartbeat")
+                log_to_file(traceback.format_exc(), "bug")
+
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def get_clusters(self) -> dict:
+        """
+        Returns the last heartbeat of every live cluster
+        :return: dict(cluster_id: dict)
+        """
+        ids = sorted(int(a) for a in await self.redis.smembers(CLUSTER_IDS))
+
+        pipe = self.redis.pipeline(transaction=False)
+        for cluster_id in ids:
+            pipe.hgetall(CLUSTER_KEY.format(cluster_id))
+
+        clusters = {}
+        for cluster_id, raw in zip(ids, await pipe.execute()):
+            # Expired: not alive anymore
+            if not raw:
+                continue
+
+            clusters[cluster_id] = {k.decode(): v.decode() for k, v in raw.items()}
+
+        return clusters
+
+    async def get_totals(self) -> dict:
+        """
+        Guild, member and channel counts summed over all clusters
+        Falls back to this process' own numbers if no heartbeat is available (yet)
+        """
+        clusters = await self.get_clusters()
+        clusters[self.cluster_id] = self._local_stats()
+
+        totals = {"guilds": 0, "members": 0, "channels": 0, "clusters": len(clusters)}
+        for data in clusters.values():
+            for key in ("guilds", "members", "channels"):
+                totals[key] += int(data[key])
+
+        return totals
+
+    # Commands
+    def register(self, command: str, callback):
+        """
+        Registers a coroutine to be called when another cluster (or this one) broadcasts a command
+        :param command: command name
+        :param callback: coroutine function(origin_cluster_id, *args)
+        """
+        self.commands[command] = callback
+
+    async def broadcast(self, command: str, *args, include_self=True):
+        """
+        Runs a registered command on all clusters
+        """
+        payload = dumps({"origin": self.cluster_id, "command": command, "args": list(args), "self": include_self})
+        await self.redis.publish(COMMAND_CHANNEL, payload)
+
+        # Not subscribed yet (before on_ready), run it locally right away
+        if include_self and not self._tasks:
+            await self._run_command(self.cluster_id, command, args)
+
+    async def notify_launcher(self, command: str):
+        """
+        Asks the launcher to do something (rolling restart, shutdown)
+        :return: True if a launcher received it
+        """
+        return bool(await self.redis.publish(LAUNCHER_CHANNEL, dumps({"origin": self.cluster_id, "command": command})))
+
+    async def _run_command(self, origin: int, command: str, args):
+        callback = self.commands.get(command)
+        if callback is None:
+            log.warning("Unknown cluster command: {}".format(command))
+            return
+
+        try:
+            await callback(origin, *args)
+        except Exception:
+            log.warning("Cluster command {} failed, see bugs.txt".format(command))
+            log_to_file(traceback.format_exc(), "bug")
+
+    async def _listen(self):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(COMMAND_CHANNEL)
+
+        async for message in pubsub.listen():
+            try:
+                data = loads(message["data"].decode())
+            except ValueError:
+                continue
+
+            if data["origin"] == self.cluster_id and not data.get("self", True):
+                continue
+
+            await self._run_command(data["origin"], data["command"], data.get("args", ()))
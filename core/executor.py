@@ -0,0 +1,134 @@
+# coding=utf-8
+import functools
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Imported by the forkserver before it forks the workers (never __main__, see _hidden_main)
+WORKER_PRELOAD = ["core.executor"]
+
+
+@contextmanager
+def _hidden_main():
+    """
+    Worker processes normally re-run __main__ before they start. nano.py sets up the whole bot
+    at import time, so it is hidden while workers are started: they only import the modules
+    of the (module-level) functions they run.
+    """
+    main = sys.modules["__main__"]
+    missing = object()
+
+    main_file = getattr(main, "__file__", missing)
+    main_spec = getattr(main, "__spec__", None)
+
+    if main_file is not missing:
+        del main.__file__
+    main.__spec__ = None
+
+    try:
+        yield
+    finally:
+        if main_file is not missing:
+            main.__file__ = main_file
+        main.__spec__ = main_spec
+
+
+class PoolStats:
+    __slots__ = ("submitted", "finished", "failed", "busy_time")
+
+    def __init__(self):
+        self.submitted = 0
+        self.finished = 0
+        self.failed = 0
+        # Total seconds spent from submitting to getting the result
+        self.busy_time = 0.0
+
+    @property
+    def pending(self) -> int:
+        """
+        Queued + running jobs
+        """
+        return self.submitted - self.finished
+
+    def as_dict(self) -> dict:
+        return {
+            "pending": self.pending,
+            "submitted": self.submitted,
+            "failed": self.failed,
+            "avg_ms": round(self.busy_time / self.finished * 1000, 2) if self.finished else 0,
+        }
+
+
+class ExecutorService:
+    """
+    Runs blocking work off the event loop
+
+    run_cpu: CPU-heavy work (image rendering, fuzzy matching) in a process pool.
+             The function and its arguments must be picklable, so use module-level functions.
+    run_io: blocking I/O (sync libraries, file access) in a thread pool.
+    """
+    def __init__(self, loop, cpu_workers: int=None, io_workers: int=None):
+        self.loop = loop
+
+        self.cpu_workers = cpu_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.io_workers = io_workers or 8
+
+        # Workers come from a forkserver (or are spawned), never forked from this process:
+        # forking while the loop, redis and I/O threads are running can deadlock the child
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(WORKER_PRELOAD)
+        else:
+            context = multiprocessing.get_context("spawn")
+
+        self.cpu_pool = ProcessPoolExecutor(max_workers=self.cpu_workers, mp_context=context)
+
+        self.io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="nano-io")
+
+        self.cpu_stats = PoolStats()
+        self.io_stats = PoolStats()
+
+        log.info("Executor service: {} CPU workers, {} I/O workers".format(self.cpu_workers, self.io_workers))
+
+    async def _run(self, pool, stats: PoolStats, fn, args, kwargs):
+        if kwargs:
+            fn = functools.partial(fn, **kwargs)
+
+        stats.submitted += 1
+        start = time.monotonic()
+
+        try:
+            # The pool starts its workers when jobs are submitted
+            with _hidden_main() if pool is self.cpu_pool else nullcontext():
+                future = self.loop.run_in_executor(pool, fn, *args)
+
+            return await future
+        except Exception:
+            stats.failed += 1
+            raise
+        finally:
+            stats.finished += 1
+            stats.busy_time += time.monotonic() - start
+
+    async def run_cpu(self, fn, *args, **kwargs):
+        return await self._run(self.cpu_pool, self.cpu_stats, fn, args, kwargs)
+
+    async def run_io(self, fn, *args, **kwargs):
+        return await self._run(self.io_pool, self.io_stats, fn, args, kwargs)
+
+    def info(self) -> dict:
+        return {
+            "cpu": dict(workers=self.cpu_workers, **self.cpu_stats.as_dict()),
+            "io": dict(workers=self.io_workers, **self.io_stats.as_dict()),
+        }
+
+    def shutdown(self):
+        self.cpu_pool.shutdown(wait=False)
+        self.io_pool.shutdown(wait=False)
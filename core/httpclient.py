@@ -0,0 +1,349 @@
+# coding=utf-8
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+
+import aiohttp
+from multidict import CIMultiDict
+from yarl import URL
+
+try:
+    from rapidjson import loads
+except ImportError:
+    from json import loads
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+#####
+# Shared HTTP client
+# One pooled aiohttp session for all plugins (keep-alive, DNS cache, connection limits),
+# with timeouts, retries with backoff and a small response cache that follows Cache-Control and ETag.
+#####
+
+# Connections open at once, in total and to one host
+MAX_CONNECTIONS = 100
+MAX_PER_HOST = 10
+# Seconds
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+DEFAULT_TIMEOUT = 15
+
+# Retries of failed requests (connection errors, timeouts, RETRY_STATUSES)
+DEFAULT_RETRIES = 2
+# Backoff: BACKOFF_BASE * 2^attempt (+ jitter), never longer than BACKOFF_MAX (seconds, also caps Retry-After)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# Only these are retried unless the caller asks for retries explicitly
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+# Cached GET responses
+CACHE_SIZE = 512
+# Bigger bodies are never cached (bytes)
+MAX_CACHED_BODY = 1024 * 1024
+
+
+class HttpResponse:
+    """
+    A fully read response (the connection is already back in the pool)
+    """
+    __slots__ = ("status", "headers", "body", "url")
+
+    def __init__(self, status: int, headers, body: bytes, url: str):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.url = url
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    def text(self, encoding: str="utf-8") -> str:
+        return self.body.decode(encoding, errors="replace")
+
+    def json(self):
+        return loads(self.text())
+
+
+class HttpError(Exception):
+    def __init__(self, response: HttpResponse):
+        super().__init__("{} returned {}".format(response.url, response.status))
+        self.response = response
+        self.status = response.status
+
+
+class _CacheEntry:
+    __slots__ = ("response", "expires", "etag", "last_modified")
+
+    def __init__(self, response: HttpResponse, max_age: float, etag: str=None, last_modified: str=None):
+        self.response = response
+        self.expires = time.monotonic() + max_age
+
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires
+
+    @property
+    def can_revalidate(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+
+def _parse_cache_control(headers) -> dict:
+    directives = {}
+    for part in headers.get("Cache-Control", "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip("\"")
+
+    return directives
+
+
+def _max_age(headers):
+    """
+    :return: seconds the response stays fresh or None if it must not be stored
+    """
+    directives = _parse_cache_control(headers)
+    if "no-store" in directives:
+        return None
+
+    if "no-cache" in directives:
+        return 0
+
+    try:
+        max_age = int(directives.get("max-age", 0))
+    except ValueError:
+        max_age = 0
+
+    try:
+        age = int(headers.get("Age", 0))
+    except ValueError:
+        age = 0
+
+    return max(0, max_age - age)
+
+
+class HttpStats:
+    __slots__ = ("requests", "retries", "failed", "cache_hits", "revalidated")
+
+    def __init__(self):
+        # Requests actually sent (retries included)
+        self.requests = 0
+        self.retries = 0
+        self.failed = 0
+        # Answered from the cache without a request / with a 304
+        self.cache_hits = 0
+        self.revalidated = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failed": self.failed,
+            "cache_hits": self.cache_hits,
+            "revalidated": self.revalidated,
+        }
+
+
+class HttpService:
+    """
+    Passed to plugins as the `http` kwarg
+
+    Usage: `resp = await http.get(url, params=dict(q="abc"))`, then resp.status, resp.json(), resp.text()
+    """
+    def __init__(self, loop, max_connections: int=None, max_per_host: int=None, cache_size: int=CACHE_SIZE):
+        self.loop = loop
+
+        self.max_connections = max_connections or MAX_CONNECTIONS
+        self.max_per_host = max_per_host or MAX_PER_HOST
+        self.cache_size = cache_size
+
+        self.stats = HttpStats()
+
+        # (url, headers): _CacheEntry, least recently used first
+        self._cache = OrderedDict()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created on first use, aiohttp wants a running loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_per_host,
+                                             ttl_dns_cache=DNS_CACHE_TTL, keepalive_timeout=KEEPALIVE_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT))
+
+        return self._session
+
+    async def request(self, method: str, url: str, *, params: dict=None, headers: dict=None, data=None, json=None,
+                      timeout: float=None, retries: int=None, cache: bool=True) -> HttpResponse:
+        """
+        :param timeout: seconds for one attempt (default DEFAULT_TIMEOUT)
+        :param retries: default DEFAULT_RETRIES for idempotent methods, 0 for others
+        :param cache: use the response cache (GET only)
+        :raises aiohttp.ClientError, asyncio.TimeoutError: when the last attempt fails
+        """
+        method = method.upper()
+        url = URL(url)
+        if params:
+            url = url.update_query(params)
+
+        headers = dict(headers) if headers else {}
+
+        key = entry = None
+        if cache and method == "GET":
+            key = (str(url), tuple(sorted(headers.items())))
+            entry = self._get_cached(key)
+
+            if entry is not None:
+                if entry.fresh:
+                    self.stats.cache_hits += 1
+                    return entry.response
+
+                if entry.etag:
+                    headers["If-None-Match"] = entry.etag
+                if entry.last_modified:
+                    headers["If-Modified-Since"] = entry.last_modified
+
+        if retries is None:
+            retries = DEFAULT_RETRIES if method in IDEMPOTENT_METHODS else 0
+
+        response = await self._send(method, url, headers, data, json, timeout, retries)
+
+        if entry is not None and response.status == 304:
+            self.stats.revalidated += 1
+            self._store(key, entry.response, response.headers)
+            return entry.response
+
+        if key is not None:
+            self._store(key, response, response.headers)
+
+        return response
+
+    async def _send(self, method: str, url: URL, headers: dict, data, json, timeout, retries: int) -> HttpResponse:
+        options = {}
+        if timeout is not None:
+            options["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+        attempt = 0
+        while True:
+            self.stats.requests += 1
+
+            try:
+                async with self.session.request(method, url, headers=headers, data=data, json=json, **options) as resp:
+                    response = HttpResponse(resp.status, CIMultiDict(resp.headers), await resp.read(), str(resp.url))
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= retries:
+                    self.stats.failed += 1
+                    raise
+
+                delay = self._backoff(attempt)
+                log.debug("{} {} failed ({}), retrying in {:.1f} s".format(method, url.host, type(e).__name__, delay))
+
+            else:
+                if response.status not in RETRY_STATUSES or attempt >= retries:
+                    return response
+
+                delay = self._retry_after(response) or self._backoff(attempt)
+                log.debug("{} {} returned {}, retrying in {:.1f} s".format(method, url.host, response.status, delay))
+
+            attempt += 1
+            self.stats.retries += 1
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        delay = BACKOFF_BASE * 2 ** attempt
+        return min(BACKOFF_MAX, delay + random.uniform(0, delay / 2))
+
+    @staticmethod
+    def _retry_after(response: HttpResponse):
+        value = response.headers.get("Retry-After", "")
+        # Only the delta-seconds form, dates fall back to the normal backoff
+        if not value.isdigit():
+            return None
+
+        return min(BACKOFF_MAX, int(value))
+
+    # Response cache
+    def _get_cached(self, key: tuple):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+
+        if not entry.fresh and not entry.can_revalidate:
+            del self._cache[key]
+            return None
+
+        self._cache.move_to_end(key)
+        return entry
+
+    def _store(self, key: tuple, response: HttpResponse, headers):
+        """
+        :param headers: headers that decide the caching policy (of the 304 when revalidating)
+        """
+        if response.status != 200 or len(response.body) > MAX_CACHED_BODY:
+            self._cache.pop(key, None)
+            return
+
+        # A 304 can leave out Cache-Control and the validators, the cached response has them
+        max_age = _max_age(headers if "Cache-Control" in headers else response.headers)
+        entry = _CacheEntry(response, max_age or 0,
+                            etag=headers.get("ETag") or response.headers.get("ETag"),
+                            last_modified=headers.get("Last-Modified") or response.headers.get("Last-Modified"))
+
+        if max_age is None or (max_age == 0 and not entry.can_revalidate):
+            self._cache.pop(key, None)
+            return
+
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    # Shortcuts
+    async def get(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def get_json(self, url: str, **kwargs):
+        """
+        :raises HttpError: on non-2xx responses
+        """
+        resp = await self.get(url, **kwargs)
+        if not resp.ok:
+            raise HttpError(resp)
+
+        return resp.json()
+
+    async def get_text(self, url: str, **kwargs) -> str:
+        """
+        :raises HttpError: on non-2xx responses
+        """
+        resp = await self.get(url, **kwargs)
+        if not resp.ok:
+            raise HttpError(resp)
+
+        return resp.text()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+        self._session = None
+
+    def info(self) -> dict:
+        return dict(cached=len(self._cache), **self.stats.as_dict())
@@ -0,0 +1,98 @@
+# coding=utf-8
+import asyncio
+import logging
+import time
+import traceback
+from weakref import WeakSet
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+#####
+# Lazy plugin resources
+# Heavy things plugins need (datasets, models, ...) are created on first use or by the warm-up
+# that runs in the background after on_ready, instead of in the plugin constructor at boot.
+#####
+
+# Seconds to wait after on_ready before warming up (lets the shards settle first)
+WARM_UP_DELAY = 5
+
+# Every LazyResource that hasn't been garbage collected (plugin reloads drop the old ones)
+_resources = WeakSet()
+
+
+class LazyResource:
+    """
+    Usage (in a plugin constructor): `self.items = LazyResource("mc items", load_items, handler, executor=executor)`
+    and `items = await self.items.get()` where they are needed.
+
+    factory can be a coroutine function or a blocking function (ran in the I/O pool if an executor is passed).
+    A factory that raises is tried again on the next get().
+    """
+    def __init__(self, name: str, factory, *args, executor=None, warm_up: bool=True):
+        """
+        :param warm_up: load in the background after on_ready, otherwise only on first use
+        """
+        self.name = name
+        self.factory = factory
+        self.args = args
+        self.executor = executor
+        self.warm_up = warm_up
+
+        # Seconds the factory took
+        self.load_time = None
+
+        self._value = None
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+        _resources.add(self)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    async def get(self):
+        if self._loaded:
+            return self._value
+
+        # Only one load, everyone else waits for it
+        async with self._lock:
+            if not self._loaded:
+                started = time.monotonic()
+
+                if asyncio.iscoroutinefunction(self.factory):
+                    self._value = await self.factory(*self.args)
+                elif self.executor is not None:
+                    self._value = await self.executor.run_io(self.factory, *self.args)
+                else:
+                    self._value = self.factory(*self.args)
+
+                self.load_time = time.monotonic() - started
+                self._loaded = True
+
+                log.info("Loaded {} in {:.3f} s".format(self.name, self.load_time))
+
+        return self._value
+
+
+async def warm_up(delay: float=WARM_UP_DELAY) -> dict:
+    """
+    Loads resources that aren't loaded yet, one at a time
+    :return: dict(name: seconds or None if it failed)
+    """
+    await asyncio.sleep(delay)
+
+    times = {}
+    for resource in [r for r in _resources if r.warm_up and not r.loaded]:
+        try:
+            await resource.get()
+            times[resource.name] = resource.load_time
+        except Exception:
+            log.warning("Could not warm up {}: {}".format(resource.name, traceback.format_exc()))
+            times[resource.name] = None
+
+    if times:
+        log.info("Warmed up {} resources".format(len(times)))
+
+    return times
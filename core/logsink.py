@@ -0,0 +1,220 @@
+# coding=utf-8
+import atexit
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+#####
+# Buffered log writer
+# log_to_file() only puts the line into a queue, a background thread appends
+# the queued lines in batches and rotates the files when they get too big or too old.
+#####
+
+# Lines waiting to be written, new lines are dropped when full
+LOG_QUEUE_SIZE = 20000
+# Write at least this often (seconds) ...
+FLUSH_INTERVAL = 1
+# ... or as soon as this many lines are waiting
+FLUSH_LINES = 500
+# How long close() waits for the remaining lines to be written
+CLOSE_TIMEOUT = 5
+
+# Timestamp format of every line
+TIME_FORMAT = "%d-%m-%Y %H:%M:%S"
+# Suffix of rotated segments (log.txt -> log.txt.20240101-120000)
+ROTATED_FORMAT = "%Y%m%d-%H%M%S"
+
+_STOP = object()
+
+
+class LogSink:
+    """
+    Queue-backed file writer, safe to use from any thread (and from forked processes)
+
+    :param max_size: rotate a file when it gets bigger than this (bytes, 0 = never)
+    :param max_age: rotate a file when its first line is older than this (seconds, 0 = never)
+    :param compress: gzip rotated segments
+    """
+    def __init__(self, max_size: int=0, max_age: int=0, compress: bool=False):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.compress = compress
+
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+
+        # path: time the current segment was started
+        self._started = {}
+
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_running(self):
+        # Threads don't survive fork(), workers get their own
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            self._queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            self._thread = threading.Thread(target=self._run, name="nano-log", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def write(self, path: str, content, truncate: bool=False):
+        """
+        Queues a line (the timestamp is added here)
+        :param truncate: empty the file first (like opening it with "w")
+        """
+        self._ensure_running()
+
+        line = "{} - {}\n".format(datetime.now().strftime(TIME_FORMAT), content)
+
+        try:
+            self._queue.put_nowait((path, line, truncate))
+        except queue.Full:
+            self.dropped += 1
+
+    # Writer thread
+    def _run(self):
+        pending = []
+        stop = False
+
+        while not stop:
+            deadline = time.monotonic() + FLUSH_INTERVAL
+
+            while len(pending) < FLUSH_LINES:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+
+                if item is _STOP:
+                    stop = True
+                    break
+
+                pending.append(item)
+
+            if pending:
+                self._write_batch(pending)
+                pending = []
+
+    def _write_batch(self, items: list):
+        # path: (mode, lines), in the order the paths first appear
+        batches = {}
+        for path, line, truncate in items:
+            if truncate or path not in batches:
+                batches[path] = ("w" if truncate else "a", [])
+
+            batches[path][1].append(line)
+
+        for path, (mode, lines) in batches.items():
+            try:
+                self._maybe_rotate(path)
+            except OSError as e:
+                log.warning("Could not rotate {}: {}".format(path, e))
+
+            try:
+                with open(path, mode, encoding="utf-8", errors="replace") as file:
+                    file.write("".join(lines))
+
+                self.written += len(lines)
+            except OSError as e:
+                self.dropped += len(lines)
+                log.warning("Could not write to {}: {}".format(path, e))
+
+    # Rotation
+    def _segment_start(self, path: str) -> float:
+        started = self._started.get(path)
+        if started is None:
+            started = time.time()
+
+            # Existing file: the first line says when it was started
+            try:
+                with open(path, encoding="utf-8", errors="replace") as file:
+                    first = file.readline()
+                started = datetime.strptime(first[:19], TIME_FORMAT).timestamp()
+            except (OSError, ValueError):
+                pass
+
+            self._started[path] = started
+
+        return started
+
+    def _maybe_rotate(self, path: str):
+        if not os.path.isfile(path):
+            self._started[path] = time.time()
+            return
+
+        too_big = self.max_size and os.path.getsize(path) > self.max_size
+        too_old = self.max_age and time.time() - self._segment_start(path) > self.max_age
+        if not (too_big or too_old):
+            return
+
+        target = "{}.{}".format(path, datetime.now().strftime(ROTATED_FORMAT))
+        os.replace(path, target)
+        self._started[path] = time.time()
+        self.rotations += 1
+
+        if self.compress:
+            with open(target, "rb") as source, gzip.open(target + ".gz", "wb") as compressed:
+                shutil.copyfileobj(source, compressed)
+            os.remove(target)
+
+    def close(self):
+        """
+        Writes everything that is still queued (call on shutdown)
+        """
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+
+        try:
+            self._queue.put(_STOP, timeout=CLOSE_TIMEOUT)
+        except queue.Full:
+            return
+
+        self._thread.join(CLOSE_TIMEOUT)
+
+    def info(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._pid == os.getpid() else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+        }
+
+
+def get_sink_from_settings(parser) -> LogSink:
+    """
+    Builds a LogSink from the [Logging] section of settings.ini (missing values = no rotation)
+    """
+    def get_number(option: str) -> float:
+        value = parser.get("Logging", option, fallback="").strip()
+        try:
+            return float(value) if value else 0
+        except ValueError:
+            return 0
+
+    sink = LogSink(max_size=int(get_number("max_size_mb") * 1024 * 1024),
+                   max_age=int(get_number("max_age_days") * 86400),
+                   compress=parser.get("Logging", "compress", fallback="").strip().lower() in ("true", "yes", "1", "on"))
+    atexit.register(sink.close)
+
+    return sink
@@ -0,0 +1,214 @@
+# coding=utf-8
+import bisect
+import logging
+import time
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+#####
+# Metrics
+# Counters, gauges and latency histograms kept in memory, exported in the Prometheus text format
+# (https://prometheus.io/docs/instrumenting/exposition_formats/) over a local HTTP endpoint.
+#####
+
+# Seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str=None) -> str:
+    pairs = ["{}=\"{}\"".format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    __slots__ = ("name", "help", "label_names", "values")
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: tuple=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+
+        # tuple(label values): value
+        self.values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def _samples(self):
+        for key, value in self.values.items():
+            yield "{}{} {}".format(self.name, _format_labels(self.label_names, key), _format_value(value))
+
+    def render(self) -> str:
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} {}".format(self.name, self.type_name)]
+        lines.extend(self._samples())
+
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    __slots__ = ()
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Either set directly or computed on every export (fn returns a number or a dict(tuple(label values): number))
+    """
+    __slots__ = ("fn", )
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: tuple=(), fn=None):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                log.warning("Gauge {} failed".format(self.name))
+                return
+
+            self.values = value if isinstance(value, dict) else {(): value}
+
+        yield from super()._samples()
+
+
+class Histogram(Metric):
+    __slots__ = ("buckets", )
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple=(), buckets: tuple=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+
+        # [count per bucket..., +Inf], sum
+        data = self.values.get(key)
+        if data is None:
+            data = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _samples(self):
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"), ), counts):
+                cumulative += count
+                le = "le=\"{}\"".format(_format_value(bound))
+                yield "{}_bucket{} {}".format(self.name, _format_labels(self.label_names, key, le), cumulative)
+
+            labels = _format_labels(self.label_names, key)
+            yield "{}_sum{} {}".format(self.name, labels, _format_value(total))
+            yield "{}_count{} {}".format(self.name, labels, cumulative)
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric: Metric):
+        # Registering twice (plugin reloads) returns the existing metric
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple=()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: tuple=(), fn=None) -> Gauge:
+        return self._register(Gauge(name, help_text, labels, fn=fn))
+
+    def histogram(self, name: str, help_text: str, labels: tuple=(), buckets: tuple=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets=buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in list(self.metrics.values())) + "\n"
+
+
+class MetricsServer:
+    """
+    Serves GET /metrics for Prometheus
+    """
+    def __init__(self, registry: MetricsRegistry, host: str, port: int):
+        self.registry = registry
+        self.host = host
+        self.port = port
+
+        self._runner = None
+
+    async def _handle(self, _):
+        return web.Response(body=self.registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self):
+        if self._runner is not None:
+            return
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+        log.info("Serving metrics on http://{}:{}/metrics".format(self.host, self.port))
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,208 @@
+# coding=utf-8
+import logging
+from string import Formatter
+
+try:
+    from rapidjson import loads, dumps
+except ImportError:
+    from json import loads, dumps
+
+from discord import errors, utils, Object
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+#####
+# Paginated lists
+# Lists that don't fit in one message are split into pages, the arrow reactions flip through them.
+# Page state lives in the cache redis and expires on its own, so it survives restarts and
+# any process can turn the page. Only the page that is shown gets formatted.
+#####
+
+# Maximum length of the text on one page (the rest of the message is left to the translation string)
+PAGE_LENGTH = 810
+# Seconds a list keeps reacting to the arrows
+PAGE_TTL = 60 * 3
+
+# Emojis to react with
+UP = "\U00002B06"
+DOWN = "\U00002B07"
+
+# Cache keys
+# hash: template, page, fmt, separator, breaks (json list, index of the first item of every page)
+PAGES_KEY = "pages:{}"
+# list: all items (json lists of values, formatted with fmt when their page is shown)
+ITEMS_KEY = "pages:{}:items"
+
+
+class Pages:
+    """
+    A list split into pages in one pass, keeping only the index of the first item of every page
+
+    Items are formatted with fmt (plain {} fields, one per tuple element) only when their page is shown.
+    Line lengths come from the items and the literal part of fmt, so no line is formatted to find the pages
+    and jumping to page k only formats page k.
+    """
+    __slots__ = ("items", "breaks", "fmt", "separator")
+
+    def __init__(self, source, fmt: str="{}", max_length: int=PAGE_LENGTH, separator: str="\n"):
+        """
+        :param source: any iterable of values or tuples of values (consumed once)
+        :param fmt: format string of one line, e.g. "{} : {}"
+        """
+        self.fmt = fmt
+        self.separator = separator
+
+        self.items = []
+        self.breaks = [0]
+
+        literal = sum(len(text) for text, *_ in Formatter().parse(fmt))
+        length = 0
+
+        for index, item in enumerate(source):
+            if not isinstance(item, tuple):
+                item = (item,)
+
+            size = literal + sum(len(str(a)) for a in item)
+
+            # A new page unless this page is still empty (a line that is too long gets its own page)
+            if index != self.breaks[-1] and length + size > max_length:
+                self.breaks.append(index)
+                length = 0
+
+            length += size + len(separator)
+            self.items.append(item)
+
+    def __len__(self):
+        return len(self.breaks)
+
+    def __iter__(self):
+        # Pages are rendered one by one, as they are needed
+        for page in range(len(self.breaks)):
+            yield self.render(page)
+
+    def bounds(self, page: int) -> tuple:
+        """
+        :return: tuple(first item, item after the last one)
+        """
+        end = self.breaks[page + 1] if page + 1 < len(self.breaks) else len(self.items)
+        return self.breaks[page], end
+
+    def render(self, page: int) -> str:
+        start, end = self.bounds(page)
+        return self.separator.join(self.fmt.format(*item) for item in self.items[start:end])
+
+
+class PaginationService:
+    """
+    Usage: `await pages.send(channel, trans_string, Pages(items, "{} : {}"), page)`
+    trans_string is formatted with (page, total pages, lines of the page).
+
+    The admin plugin passes raw reactions to handle_reaction, so every plugin can send paginated lists.
+    """
+    def __init__(self, client, handler, ttl: int=PAGE_TTL):
+        self.client = client
+        self.ttl = ttl
+
+        self.cache = handler.get_cache_handler().get_plugin_data_manager("pages")
+
+    async def send(self, channel, template: str, pages: Pages, page: int=0):
+        """
+        Sends a page and tracks the message if there are more
+        :return: Message
+        """
+        message = await channel.send(template.format(page + 1, len(pages), pages.render(page)))
+
+        # Nothing to flip through
+        if len(pages) == 1:
+            return message
+
+        await self._store(message.id, template, pages, page)
+
+        try:
+            await message.add_reaction(UP)
+            await message.add_reaction(DOWN)
+        except errors.Forbidden:
+            pass
+
+        return message
+
+    async def _store(self, message_id: int, template: str, pages: Pages, page: int):
+        pages_key, items_key = PAGES_KEY.format(message_id), ITEMS_KEY.format(message_id)
+        state = {
+            "template": template,
+            "page": page,
+            "fmt": pages.fmt,
+            "separator": pages.separator,
+            "breaks": dumps(pages.breaks),
+        }
+
+        pipe = self.cache.aio.pipeline()
+        pipe.hset(pages_key, mapping=state)
+        pipe.rpush(items_key, *[dumps(item) for item in pages.items])
+        pipe.expire(pages_key, self.ttl)
+        pipe.expire(items_key, self.ttl)
+        await pipe.execute()
+
+    async def _get_message(self, payload):
+        # Only fetched if it isn't in the message cache
+        message = utils.get(self.client.cached_messages, id=payload.message_id)
+        if message is not None:
+            return message
+
+        channel = self.client.get_channel(payload.channel_id)
+        if channel is None:
+            return None
+
+        try:
+            return await channel.fetch_message(payload.message_id)
+        except errors.HTTPException:
+            return None
+
+    async def handle_reaction(self, payload, **_):
+        """
+        Handles on_raw_reaction_add: lists outlive the message cache (restarts, other processes),
+        on_reaction_add only fires for cached messages
+        """
+        if payload.user_id == self.client.user.id or (payload.member is not None and payload.member.bot):
+            return
+
+        emoji = str(payload.emoji)
+        if emoji not in (UP, DOWN):
+            return
+
+        state = await self.cache.aio.hgetall(PAGES_KEY.format(payload.message_id), use_namespace=False)
+        if not state:
+            return
+
+        breaks = loads(state["breaks"])
+        page = int(state["page"]) + (-1 if emoji == UP else 1)
+
+        message = await self._get_message(payload)
+        if message is None:
+            return
+
+        # Remove the reaction so the same arrow can be used again
+        try:
+            await message.remove_reaction(payload.emoji, Object(id=payload.user_id))
+        except (errors.Forbidden, errors.NotFound):
+            pass
+
+        # Can't go past the first or the last page
+        if not 0 <= page < len(breaks):
+            return
+
+        # Fetch only the items of this page (LRANGE end is inclusive)
+        end = breaks[page + 1] - 1 if page + 1 < len(breaks) else -1
+
+        pipe = self.cache.aio.pipeline()
+        pipe.lrange(ITEMS_KEY.format(message.id), breaks[page], end)
+        pipe.hset(PAGES_KEY.format(message.id), "page", page)
+        items, _ = await pipe.execute()
+
+        lines = str(state["separator"]).join(state["fmt"].format(*loads(item.decode())) for item in items)
+        content = state["template"].format(page + 1, len(breaks), lines)
+        try:
+            await message.edit(content=content)
+        except errors.HTTPException as e:
+            log.warning("Could not turn the page: {}".format(e))
@@ -0,0 +1,97 @@
+# coding=utf-8
+import logging
+
+from discord import Member
+
+from .statestore import BoundedStore
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+#####
+# Permission resolver
+# Nano Admin / Nano Mod role checks without scanning role lists on every message.
+# Role name -> role ids is computed once per guild, role flags once per member,
+# both are dropped on role and member updates (see nano.py).
+#####
+
+ROLE_ADMIN = "Nano Admin"
+ROLE_MOD = "Nano Mod"
+
+# Role flags of a member
+FLAG_ADMIN = 1
+FLAG_MOD = 2
+
+PERMISSION_CACHE_SIZE = 100000
+# Safety net in case an update event is missed
+PERMISSION_CACHE_TTL = 3600
+
+
+class GuildRoles:
+    __slots__ = ("admin", "mod")
+
+    def __init__(self, guild):
+        # Role names aren't unique, any role with the name counts
+        self.admin = frozenset(role.id for role in guild.roles if role.name == ROLE_ADMIN)
+        self.mod = frozenset(role.id for role in guild.roles if role.name == ROLE_MOD)
+
+
+class PermissionResolver:
+    __slots__ = ("guild_roles", "generations", "flags")
+
+    def __init__(self):
+        # guild_id: GuildRoles
+        self.guild_roles = {}
+        # guild_id: int, bumped on role changes so cached member flags of that guild stop matching
+        self.generations = {}
+        # (guild_id, generation, member_id): flags
+        self.flags = BoundedStore("permissions", PERMISSION_CACHE_SIZE, PERMISSION_CACHE_TTL)
+
+    def _get_guild_roles(self, guild) -> GuildRoles:
+        roles = self.guild_roles.get(guild.id)
+        if roles is None:
+            roles = self.guild_roles[guild.id] = GuildRoles(guild)
+
+        return roles
+
+    def get_flags(self, member: Member) -> int:
+        if not isinstance(member, Member):
+            raise TypeError("expected Member, got {}".format(type(member).__name__))
+
+        guild_id = member.guild.id
+        key = (guild_id, self.generations.get(guild_id, 0), member.id)
+
+        flags = self.flags.get(key)
+        if flags is None:
+            roles = self._get_guild_roles(member.guild)
+            member_roles = {role.id for role in member.roles}
+
+            flags = 0
+            if roles.admin & member_roles:
+                flags |= FLAG_ADMIN
+            if roles.mod & member_roles:
+                flags |= FLAG_MOD
+
+            self.flags.set(key, flags)
+
+        return flags
+
+    @staticmethod
+    def is_guild_owner(member: Member) -> bool:
+        # Sent with the guild by the gateway, always up to date
+        return member.id == member.guild.owner_id
+
+    # Invalidation
+    def member_updated(self, before: Member, after: Member):
+        if before.roles != after.roles:
+            guild_id = after.guild.id
+            self.flags.delete((guild_id, self.generations.get(guild_id, 0), after.id))
+
+    def roles_changed(self, guild):
+        self.guild_roles.pop(guild.id, None)
+        self.generations[guild.id] = self.generations.get(guild.id, 0) + 1
+
+    def forget_guild(self, guild_id: int):
+        # Bumped, not dropped: going back to 0 would make flags cached under generation 0 valid again
+        self.guild_roles.pop(guild_id, None)
+        self.generations[guild_id] = self.generations.get(guild_id, 0) + 1
@@ -0,0 +1,300 @@
+# coding=utf-8
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+#####
+# Dispatch profiling
+# Wall time, calls and exceptions per (event, plugin), stack samples of slow callbacks
+# and on-demand profiling of the whole event loop (nano.dev.profile).
+# StartupProfile keeps the import and init time of every plugin (nano.dev.profile startup).
+#####
+
+# Callbacks running longer than this (seconds) are counted as slow and get a stack sample
+SLOW_THRESHOLD = 0.5
+# How often the watchdog looks for slow callbacks
+WATCHDOG_INTERVAL = 0.25
+# Stack samples kept (newest first)
+SLOW_SAMPLES_KEPT = 20
+# Frames per stack sample
+SAMPLE_DEPTH = 12
+# Longest allowed on-demand profiling run
+MAX_PROFILE_SECONDS = 120
+
+
+class CallbackStats:
+    __slots__ = ("calls", "errors", "slow", "total_time", "max_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "slow": self.slow,
+            "total_ms": round(self.total_time * 1000, 1),
+            "avg_ms": round(self.total_time / self.calls * 1000, 2) if self.calls else 0,
+            "max_ms": round(self.max_time * 1000, 1),
+        }
+
+
+class _Running:
+    __slots__ = ("event", "plugin", "task", "started", "sampled")
+
+    def __init__(self, event: str, plugin: str, task):
+        self.event = event
+        self.plugin = plugin
+        self.task = task
+        self.started = time.monotonic()
+        self.sampled = False
+
+
+class _Measurement:
+    __slots__ = ("profiler", "running")
+
+    def __init__(self, profiler: "DispatchProfiler", running: _Running):
+        self.profiler = profiler
+        self.running = running
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        self.profiler._finish(self.running, exc_type is not None)
+
+
+class DispatchProfiler:
+    """
+    Usage: `with profiler.measure(event, plugin): await callback(...)`
+    """
+    def __init__(self, loop, metrics=None, slow_threshold: float=SLOW_THRESHOLD):
+        self.loop = loop
+        self.slow_threshold = slow_threshold
+
+        # (event, plugin): CallbackStats
+        self.stats = {}
+        # dict(event, plugin, seconds, stack, time), newest first
+        self.slow_samples = deque(maxlen=SLOW_SAMPLES_KEPT)
+
+        self._running = {}
+        self._loop_thread = None
+        self._watchdog = None
+
+        self._profiling = False
+
+        if metrics is not None:
+            self.calls = metrics.counter("nano_dispatch_calls_total", "Plugin callbacks run", ("event", "plugin"))
+            self.errors = metrics.counter("nano_dispatch_errors_total", "Plugin callbacks that raised", ("event", "plugin"))
+            self.latency = metrics.histogram("nano_dispatch_seconds", "Time spent in plugin callbacks", ("event", "plugin"))
+        else:
+            self.calls = self.errors = self.latency = None
+
+    def measure(self, event: str, plugin: str) -> _Measurement:
+        if self._watchdog is None:
+            self._start_watchdog()
+
+        running = _Running(event, plugin, asyncio.current_task())
+        self._running[id(running)] = running
+
+        return _Measurement(self, running)
+
+    def _finish(self, running: _Running, failed: bool):
+        took = time.monotonic() - running.started
+        self._running.pop(id(running), None)
+
+        key = (running.event, running.plugin)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = CallbackStats()
+
+        stats.calls += 1
+        stats.total_time += took
+        if took > stats.max_time:
+            stats.max_time = took
+        if failed:
+            stats.errors += 1
+        if took > self.slow_threshold:
+            stats.slow += 1
+
+        if self.calls is not None:
+            self.calls.inc(event=running.event, plugin=running.plugin)
+            self.latency.observe(took, event=running.event, plugin=running.plugin)
+            if failed:
+                self.errors.inc(event=running.event, plugin=running.plugin)
+
+    # Slow callback sampling
+    def _start_watchdog(self):
+        # Runs in its own thread so it also catches callbacks that block the loop
+        self._loop_thread = threading.get_ident()
+        self._watchdog = threading.Thread(target=self._watch, name="nano-dispatch-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+
+            now = time.monotonic()
+            try:
+                running_now = list(self._running.values())
+            except RuntimeError:
+                # Changed size while copying (the loop thread added or removed one), try again next round
+                continue
+
+            for running in running_now:
+                if running.sampled or now - running.started < self.slow_threshold:
+                    continue
+
+                running.sampled = True
+                try:
+                    stack = self._sample(running)
+                except Exception:
+                    continue
+
+                self.slow_samples.appendleft({"event": running.event, "plugin": running.plugin,
+                                              "seconds": round(now - running.started, 2),
+                                              "stack": stack, "time": time.time()})
+
+    def _sample(self, running: _Running) -> str:
+        coro = running.task.get_coro() if running.task is not None else None
+
+        # Currently executing (blocking the loop): the loop thread's own stack
+        if coro is None or getattr(coro, "cr_running", False):
+            frame = sys._current_frames().get(self._loop_thread)
+            return "".join(traceback.format_stack(frame, limit=SAMPLE_DEPTH)) if frame else ""
+
+        # Suspended: follow the await chain down to where it is waiting
+        frames = []
+        while coro is not None and len(frames) < SAMPLE_DEPTH:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is None:
+                break
+
+            frames.append((frame, frame.f_lineno))
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+
+        return "".join(traceback.format_list(traceback.StackSummary.extract(frames)))
+
+    # Reports
+    def top(self, amount: int=15, key: str="total_ms") -> list:
+        """
+        :return: list(((event, plugin), stats dict)) sorted by key, biggest first
+        """
+        rows = [(k, v.as_dict()) for k, v in self.stats.items()]
+        rows.sort(key=lambda a: a[1][key], reverse=True)
+
+        return rows[:amount]
+
+    def reset(self):
+        self.stats.clear()
+        self.slow_samples.clear()
+
+    # On-demand profiling
+    @property
+    def is_profiling(self) -> bool:
+        return self._profiling
+
+    async def profile(self, seconds: float, limit: int=40) -> str:
+        """
+        Profiles everything that runs on the event loop for a while
+        :return: text report (pyinstrument if installed, otherwise cProfile sorted by cumulative time)
+        """
+        if self._profiling:
+            raise RuntimeError("already profiling")
+
+        seconds = max(1, min(seconds, MAX_PROFILE_SECONDS))
+        self._profiling = True
+
+        try:
+            if SamplingProfiler is not None:
+                profiler = SamplingProfiler(async_mode="disabled")
+                profiler.start()
+                await asyncio.sleep(seconds)
+                profiler.stop()
+
+                return profiler.output_text(unicode=False, color=False)
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+            await asyncio.sleep(seconds)
+            profiler.disable()
+
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+            return out.getvalue()
+        finally:
+            self._profiling = False
+
+
+class StartupProfile:
+    """
+    Where the boot time goes: import and constructor time per plugin, warm-up of lazy resources (core/lazy.py)
+    """
+    def __init__(self):
+        # plugin: dict(import=seconds, init=seconds)
+        self.plugins = {}
+        # resource name: seconds (None if it failed)
+        self.warm_up = {}
+
+        self.started = time.monotonic()
+        # Seconds from start to loaded plugins / first on_ready
+        self.plugins_loaded = None
+        self.ready = None
+
+    def add_plugin(self, name: str, import_time: float, init_time: float=0.0):
+        self.plugins[name] = {"import": import_time, "init": init_time}
+
+    def mark_plugins_loaded(self):
+        self.plugins_loaded = time.monotonic() - self.started
+
+    def mark_ready(self):
+        if self.ready is None:
+            self.ready = time.monotonic() - self.started
+
+    def top(self, amount: int=None) -> list:
+        """
+        :return: list((plugin, import seconds, init seconds)) sorted by total time, biggest first
+        """
+        rows = [(name, t["import"], t["init"]) for name, t in self.plugins.items()]
+        rows.sort(key=lambda a: a[1] + a[2], reverse=True)
+
+        return rows[:amount] if amount else rows
+
+    def report(self) -> str:
+        def ms(seconds):
+            return "{:.1f}".format(seconds * 1000) if seconds is not None else "-"
+
+        lines = ["{:<16} {:>10} {:>10} {:>10}".format("plugin", "import ms", "init ms", "total ms")]
+        for name, import_time, init_time in self.top():
+            lines.append("{:<16} {:>10} {:>10} {:>10}".format(name[:16], ms(import_time), ms(init_time),
+                                                              ms(import_time + init_time)))
+
+        lines.append("")
+        lines.append("Plugins loaded after {} ms, ready after {} ms".format(ms(self.plugins_loaded), ms(self.ready)))
+
+        if self.warm_up:
+            lines.append("")
+            lines.append("{:<24} {:>10}".format("warm-up", "ms"))
+            for name, seconds in sorted(self.warm_up.items(), key=lambda a: a[1] or 0, reverse=True):
+                lines.append("{:<24} {:>10}".format(name[:24], ms(seconds) if seconds is not None else "failed"))
+
+        return "\n".join(lines)
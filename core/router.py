@@ -0,0 +1,164 @@
+# coding=utf-8
+import logging
+import time
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Triggers starting with this character are relative to the guild prefix (_help -> !help)
+PREFIX_PLACEHOLDER = "_"
+
+
+class _TrieNode:
+    __slots__ = ("children", "owners")
+
+    def __init__(self):
+        self.children = {}
+        self.owners = None
+
+
+class CommandRouter:
+    """
+    Compiles the module-level `commands` dicts of all plugins into two prefix tries:
+    one for prefix-relative triggers (_help) and one for literal triggers (nano.info).
+
+    A lookup walks the message content once per trie and collects every plugin that owns a trigger
+    the content starts with - the same rule is_valid_command applies, but without scanning every trigger of every plugin.
+    """
+    __slots__ = ("_prefixed", "_literal", "trigger_amount")
+
+    def __init__(self):
+        self._prefixed = _TrieNode()
+        self._literal = _TrieNode()
+
+        self.trigger_amount = 0
+
+    def add(self, trigger: str, owner: str):
+        if trigger.startswith(PREFIX_PLACEHOLDER):
+            node = self._prefixed
+            path = trigger[len(PREFIX_PLACEHOLDER):]
+        else:
+            node = self._literal
+            path = trigger
+
+        for char in path:
+            nxt = node.children.get(char)
+            if nxt is None:
+                nxt = node.children[char] = _TrieNode()
+
+            node = nxt
+
+        if node.owners is None:
+            node.owners = {}
+
+        # owner: trigger as written in the commands dict
+        node.owners[owner] = trigger
+        self.trigger_amount += 1
+
+    @classmethod
+    def from_plugins(cls, plugins: dict) -> "CommandRouter":
+        """
+        :param plugins: dict(plugin_name: commands dict)
+        """
+        router = cls()
+
+        for name, cmds in plugins.items():
+            for trigger in cmds:
+                router.add(trigger, name)
+
+        log.info("Compiled {} triggers from {} plugins".format(router.trigger_amount, len(plugins)))
+        return router
+
+    @staticmethod
+    def _walk(node: _TrieNode, text: str, offset: int, found: dict):
+        for pos in range(offset, len(text)):
+            node = node.children.get(text[pos])
+            if node is None:
+                return
+
+            if node.owners:
+                found.update(node.owners)
+
+    def match(self, content: str, prefix: str) -> dict:
+        """
+        Returns the plugins that own a command the content starts with (empty if it isn't a command)
+        :return: dict(plugin name: the trigger it matched)
+        """
+        found = {}
+
+        if prefix is not None and content.startswith(prefix):
+            self._walk(self._prefixed, content, len(prefix), found)
+
+        self._walk(self._literal, content, 0, found)
+
+        return found
+
+
+class _ResponseNode:
+    __slots__ = ("children", "response")
+
+    def __init__(self):
+        self.children = {}
+        self.response = None
+
+
+class CustomCommandIndex:
+    """
+    In-memory copy of a guild's custom commands (commands:<id>), as a character trie of triggers.
+
+    match() walks the message once (at most as far as the longest trigger) and returns the response
+    of the longest trigger the message starts with.
+    """
+    __slots__ = ("_root", "amount", "loaded_at")
+
+    def __init__(self, commands: dict=None):
+        self._root = _ResponseNode()
+        self.amount = 0
+
+        self.loaded_at = time.monotonic()
+
+        if commands:
+            for trigger, response in commands.items():
+                self.set(str(trigger), response)
+
+    def set(self, trigger: str, response):
+        node = self._root
+        for char in trigger:
+            nxt = node.children.get(char)
+            if nxt is None:
+                nxt = node.children[char] = _ResponseNode()
+
+            node = nxt
+
+        if node.response is None:
+            self.amount += 1
+
+        node.response = response
+
+    def remove(self, trigger: str):
+        node = self._root
+        for char in trigger:
+            node = node.children.get(char)
+            if node is None:
+                return
+
+        if node.response is not None:
+            node.response = None
+            self.amount -= 1
+
+    def match(self, content: str):
+        """
+        Returns the response or None if the message doesn't start with any trigger
+        """
+        node = self._root
+        found = None
+
+        for char in content:
+            node = node.children.get(char)
+            if node is None:
+                break
+
+            if node.response is not None:
+                found = node.response
+
+        return found
@@ -0,0 +1,172 @@
+# coding=utf-8
+import asyncio
+import logging
+import time
+import traceback
+
+from core.utils import log_to_file
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Longest single sleep - jobs added by other processes are picked up at least this often
+MAX_SLEEP = 60
+# How many due jobs are claimed from one queue per wake-up
+CLAIM_BATCH = 100
+# Seconds to wait after a failed wake-up (redis down, ...), doubled for every failure in a row up to MAX_SLEEP
+ERROR_BACKOFF = 1
+
+
+class TimerScheduler:
+    """
+    Shared scheduler for timed jobs (reminders, softbans, ...)
+
+    Data type: Sorted Set
+
+    scheduler:<QUEUE> =>
+                    Members: job id
+                    Scores: unix epoch time when the job is due
+
+    Every queue is registered with a coroutine that gets called with the job id once it's due.
+    The runner only ever looks at the head of each queue: due jobs are claimed with ZRANGEBYSCORE(-inf, now)
+    and it sleeps until the lowest remaining score (or until an earlier job is scheduled),
+    so a wake-up costs O(log n + due jobs) regardless of how many jobs are stored.
+
+    With clusters every process sees every queue. Queues whose jobs can only run on some clusters
+    (e.g. the one that has the guild) register an owner check: jobs this process doesn't own are left
+    in the queue for the cluster that does.
+    """
+    def __init__(self, client, handler, loop=asyncio.get_event_loop()):
+        self.client = client
+        self.loop = loop
+        self.redis = handler.get_plugin_data_manager(namespace="scheduler")
+
+        self.queues = {}
+        # queue: coroutine function(job id) -> bool, queues without one are run by any process
+        self.owners = {}
+
+        self._wakeup = asyncio.Event()
+        self._next_deadline = None
+        self._runner = None
+
+    def register(self, queue: str, callback, owner=None):
+        """
+        Registers a queue and starts the runner if needed
+        :param queue: queue name
+        :param callback: coroutine function, called with the job id
+        :param owner: coroutine function, called with the job id, True if this process can run the job
+        """
+        self.queues[queue] = callback
+        if owner is not None:
+            self.owners[queue] = owner
+        log.info("Registered timer queue: {}".format(queue))
+
+        if self._runner is None:
+            self._runner = self.loop.create_task(self.run())
+        else:
+            self._wakeup.set()
+
+    def schedule(self, queue: str, job_id: str, due: float, only_new=False):
+        """
+        Adds (or moves) a job
+        :param queue: queue name
+        :param job_id: unique id within the queue
+        :param due: unix epoch time
+        :param only_new: don't touch jobs that are already scheduled
+        """
+        added = self.redis.zadd(queue, {job_id: due}, nx=only_new)
+
+        # Wake the runner up if this job is due before whatever it's currently sleeping for
+        if self._next_deadline is None or due < self._next_deadline:
+            self._wakeup.set()
+
+        return added
+
+    def cancel(self, queue: str, job_id: str):
+        return self.redis.zrem(queue, job_id)
+
+    def pending(self, queue: str) -> int:
+        return self.redis.zcard(queue)
+
+    async def _claim_due(self, queue: str, now: float) -> list:
+        owner = self.owners.get(queue)
+
+        claimed = []
+        # Jobs of other clusters stay in the queue, so they are skipped with the offset
+        skipped = 0
+        while True:
+            due = await self.redis.aio.zrangebyscore(queue, "-inf", now, start=skipped, num=CLAIM_BATCH)
+
+            for job_id in due:
+                if owner is not None and not await owner(job_id):
+                    skipped += 1
+                    continue
+
+                # ZREM returns 0 if someone else (another process or cancel()) got to it first
+                if await self.redis.aio.zrem(queue, job_id):
+                    claimed.append(job_id)
+
+            if len(due) < CLAIM_BATCH:
+                return claimed
+
+    async def _next_score(self, queue: str, now: float):
+        # Due jobs that are still there belong to other clusters
+        head = await self.redis.aio.zrangebyscore(queue, "({}".format(now), "+inf", start=0, num=1, withscores=True)
+        if not head:
+            return None
+
+        return float(head[0][1])
+
+    async def _tick(self):
+        """
+        Runs everything that's due
+        :return: lowest remaining score (or None if all queues are empty)
+        """
+        now = time.time()
+
+        next_deadline = None
+        for queue, callback in list(self.queues.items()):
+            for job_id in await self._claim_due(queue, now):
+                try:
+                    await callback(job_id)
+                except Exception:
+                    log.warning("ERROR in timer queue {}, see bugs.txt".format(queue))
+                    log_to_file(traceback.format_exc(), "bug")
+
+            score = await self._next_score(queue, now)
+            if score is not None and (next_deadline is None or score < next_deadline):
+                next_deadline = score
+
+        return next_deadline
+
+    async def run(self):
+        await self.client.wait_until_ready()
+
+        errors = 0
+        while True:
+            self._wakeup.clear()
+
+            try:
+                next_deadline = await self._tick()
+                errors = 0
+            except Exception:
+                # Redis errors (and anything else) must not stop the runner, try again later
+                errors += 1
+                delay = min(ERROR_BACKOFF * 2 ** (errors - 1), MAX_SLEEP)
+                log.warning("Timer scheduler failed, retrying in {} s: {}".format(delay, traceback.format_exc()))
+
+                self._next_deadline = None
+                await asyncio.sleep(delay)
+                continue
+
+            self._next_deadline = next_deadline
+
+            if next_deadline is None:
+                delay = MAX_SLEEP
+            else:
+                delay = min(max(next_deadline - time.time(), 0), MAX_SLEEP)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
@@ -1,12 +1,20 @@
 # coding=utf-8
+import asyncio
+import functools
 import redis
 import logging
 import time
 import os
 
+from redis import asyncio as aioredis
+
 from discord import Member, Guild
-from .utils import Singleton, decode, bin2bool, SecurityError
+from .utils import Singleton, decode, decode_auto, bin2bool, gen_id, SecurityError
 from .confparser import get_settings_parser, get_config_parser
+from .router import CustomCommandIndex
+from .batching import RedisBatcher
+from .permissions import PermissionResolver, FLAG_MOD
+from .statestore import BoundedStore
 
 __author__ = "DefaltSimon"
 
@@ -22,6 +30,23 @@ par = get_settings_parser()
 
 MAX_INPUT_LENGTH = 1100
 
+# Guild settings snapshots are dropped after this many seconds even without an invalidation message
+# (safety net in case the pub/sub connection drops)
+SNAPSHOT_MAX_AGE = 600
+# Same for custom command indexes
+COMMAND_INDEX_MAX_AGE = 600
+# Custom command indexes kept in memory (least recently used guilds are dropped first)
+COMMAND_INDEX_CACHE_SIZE = 20000
+# Every process publishes guild ids here after changing their settings
+INVALIDATION_CHANNEL = "nano:invalidate"
+
+# Every key that belongs to a guild (removed when Nano leaves it)
+GUILD_KEYS = ("commands:{}", "blacklist:{}", "mutes:{}", "server:{}", "voting:{}", "voting:{}:voters", "voting:{}:votes",
+              "sr:{}", "wordfilter:{}", "wordfilter:{}:mode")
+
+# Guilds per pipeline when reconciling guild data on startup
+WARMUP_CHUNK_SIZE = 500
+
 server_defaults = {
     "name": "",
     "owner": "",
@@ -120,6 +145,11 @@ class ServerHandler:
         log.info("Created ConnectionPool for {}:{}".format(ip, port))
         return redis.ConnectionPool(host=ip, port=port, password=password, **kwargs)
 
+    @staticmethod
+    def make_async_pool(ip, port, password, **kwargs):
+        log.info("Created asyncio ConnectionPool for {}:{}".format(ip, port))
+        return aioredis.ConnectionPool(host=ip, port=port, password=password, **kwargs)
+
     # Permission checker
     @staticmethod
     def has_role(member: Member, role_name: str):
@@ -138,25 +168,23 @@ class ServerHandler:
 
     @staticmethod
     async def is_server_owner(user_id: int, server: Guild):
-        owner = await server.fetch_member(server.owner_id)
-        return user_id == owner.id
+        # owner_id is sent with the guild, no need to fetch the member
+        return user_id == server.owner_id
 
     async def is_admin(self, member: Member, guild: Guild):
         # Changed in 3.7
         # Having Nano Admin allows access to Nano Mod commands as well
-        bo = self.is_bot_owner(member.id)
-        so = await self.is_server_owner(member.id, guild)
-        im = self.has_role(member, "Nano Mod")
-        ia = self.has_role(member, "Nano Admin")
+        if self.is_bot_owner(member.id) or member.id == guild.owner_id:
+            return True
 
-        return bo or so or ia or im
+        # Nano Admin or Nano Mod
+        return self.permissions.get_flags(member) != 0
 
     async def is_mod(self, member: Member, guild: Guild):
-        bo = self.is_bot_owner(member.id)
-        so = await self.is_server_owner(member.id, guild)
-        im = self.has_role(member, "Nano Mod")
+        if self.is_bot_owner(member.id) or member.id == guild.owner_id:
+            return True
 
-        return bo or so or im
+        return bool(self.permissions.get_flags(member) & FLAG_MOD)
 
 
 # Everything regarding RedisServerHandler below
@@ -190,8 +218,54 @@ mod_settings_map = {
 # For selfroles => sr:
 
 
+def _as_stored(value):
+    # Mirrors what decode() returns after a value makes a round-trip through redis
+    return decode_auto(str(value))
+
+
+class GuildSnapshot:
+    """
+    In-process copy of server:<id>, mutes:<id> and blacklist:<id>, loaded in one round-trip
+    """
+    __slots__ = ("settings", "mutes", "blacklist", "loaded_at")
+
+    def __init__(self, settings: dict, mutes: set, blacklist: set):
+        self.settings = settings
+        self.mutes = mutes
+        self.blacklist = blacklist
+
+        self.loaded_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        return (time.monotonic() - self.loaded_at) > SNAPSHOT_MAX_AGE
+
+
+class ExecutorFallback:
+    """
+    Compatibility shim for the asyncio mirrors below: any method that doesn't have a native
+    asyncio implementation yet is looked up on the blocking object and run in the loop's default executor.
+    That way `await x.aio.<method>(...)` works for the whole method surface and plugins can migrate one at a time.
+    """
+    _blocking = None
+    loop = None
+
+    def __getattr__(self, item):
+        attr = getattr(self._blocking, item)
+
+        # Already awaitable (is_admin, server_setup, ...) or not a method at all
+        if not callable(attr) or asyncio.iscoroutinefunction(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def in_executor(*args, **kwargs):
+            return await self.loop.run_in_executor(None, functools.partial(attr, *args, **kwargs))
+
+        return in_executor
+
+
 class RedisServerHandler(ServerHandler, metaclass=Singleton):
-    __slots__ = ("_redis", "redis", "pool")
+    __slots__ = ("_redis", "redis", "pool", "snapshots", "instance_id", "pubsub", "_pubsub_thread",
+                 "async_pool", "aio", "command_indexes", "permissions")
 
     def __init__(self, loop, redis_ip, redis_port, redis_password):
         super().__init__()
@@ -205,6 +279,23 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
 
         self.verify_connection(redis_ip, redis_port, redis_password)
 
+        # Non-blocking access: await handler.aio.get_prefix(guild)
+        self.async_pool = self.make_async_pool(redis_ip, redis_port, redis_password, db=0)
+        self.aio = AsyncRedisServerHandler(self, self.async_pool, loop)
+
+        # Guild settings cache
+        self.snapshots = {}
+        # Custom command cache: guild_id => CustomCommandIndex
+        self.command_indexes = BoundedStore("commands", COMMAND_INDEX_CACHE_SIZE, COMMAND_INDEX_MAX_AGE)
+        # Cached Nano Admin/Nano Mod role lookups (is_admin, is_mod)
+        self.permissions = PermissionResolver()
+        self.instance_id = gen_id(length=12)
+
+        # Other processes tell us when they change guild settings
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(**{INVALIDATION_CHANNEL: self._handle_invalidation})
+        self._pubsub_thread = self.pubsub.run_in_thread(sleep_time=1, daemon=True)
+
     def verify_connection(self, redis_ip, redis_port, redis_password):
         try:
             self.redis.ping()
@@ -222,13 +313,110 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
     def bg_save(self):
         return bool(self.redis.bgsave() == b"OK")
 
+    # SETTINGS SNAPSHOTS
+    def _handle_invalidation(self, message):
+        instance_id, guild_id = decode_auto(message["data"]).split(":", maxsplit=1)
+
+        # Our own changes are already applied
+        if int(instance_id) == self.instance_id:
+            return
+
+        self.snapshots.pop(int(guild_id), None)
+        # Runs in the pub/sub thread, the store is only used from the loop
+        self.loop.call_soon_threadsafe(self.command_indexes.delete, int(guild_id))
+
+    def _publish_invalidation(self, guild_id: int):
+        self.redis.publish(INVALIDATION_CHANNEL, "{}:{}".format(self.instance_id, guild_id))
+
+    def invalidate_snapshot(self, guild_id: int):
+        self.snapshots.pop(int(guild_id), None)
+        # Can be called from the executor (through .aio)
+        self.loop.call_soon_threadsafe(self.command_indexes.delete, int(guild_id))
+        self._publish_invalidation(guild_id)
+
+    def _cached_snapshot(self, guild_id: int):
+        snapshot = self.snapshots.get(guild_id)
+        if snapshot is not None and not snapshot.is_stale():
+            return snapshot
+
+        return None
+
+    @staticmethod
+    def _queue_snapshot(pipe, guild_id: int):
+        pipe.hgetall("server:{}".format(guild_id))
+        pipe.smembers("mutes:{}".format(guild_id))
+        pipe.smembers("blacklist:{}".format(guild_id))
+
+    def _store_snapshot(self, guild_id: int, settings, mutes, blacklist):
+        # Not set up yet, don't cache
+        if not settings:
+            self.snapshots.pop(guild_id, None)
+            return None
+
+        snapshot = GuildSnapshot(decode(settings), decode(mutes) or set(), decode(blacklist) or set())
+        self.snapshots[guild_id] = snapshot
+
+        return snapshot
+
+    def get_snapshot(self, guild_id: int):
+        """
+        Returns the cached GuildSnapshot or None if the guild is not set up
+        """
+        guild_id = int(guild_id)
+
+        snapshot = self._cached_snapshot(guild_id)
+        if snapshot is not None:
+            return snapshot
+
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_snapshot(pipe, guild_id)
+
+        return self._store_snapshot(guild_id, *pipe.execute())
+
+    def _get_setting(self, guild_id: int, key: str):
+        snapshot = self.get_snapshot(guild_id)
+        if snapshot is None:
+            return None
+
+        return snapshot.settings.get(key)
+
+    def _set_setting(self, guild_id: int, key: str, value):
+        # Write-through: redis first, then the local snapshot (if loaded) and other processes
+        if value is None:
+            resp = self.redis.hdel("server:{}".format(guild_id), key)
+        else:
+            resp = self.redis.hset("server:{}".format(guild_id), key, value)
+
+        snapshot = self.snapshots.get(int(guild_id))
+        if snapshot is not None:
+            if value is None:
+                snapshot.settings.pop(key, None)
+            else:
+                snapshot.settings[key] = _as_stored(value)
+
+        self._publish_invalidation(guild_id)
+        return resp
+
+    def _apply_settings(self, guild_id: int, settings: dict):
+        snapshot = self.snapshots.get(int(guild_id))
+        if snapshot is not None:
+            snapshot.settings.update({k: _as_stored(v) for k, v in settings.items()})
+
+    def _set_settings(self, guild_id: int, settings: dict):
+        # Same as _set_setting, but for several (non-None) values in one HSET
+        resp = self.redis.hset("server:{}".format(guild_id), mapping=settings)
+
+        self._apply_settings(guild_id, settings)
+        self._publish_invalidation(guild_id)
+        return resp
+
     # SERVER SETUPS
     @staticmethod
-    async def _default_guild_data(guild):
+    def _default_guild_data(guild):
         # These are server defaults
         s_data = server_defaults.copy()
-        owner = await guild.fetch_member(guild.owner_id)
-        s_data["owner"] = owner.id
+        # Sent with the guild by the gateway, no need to fetch the member
+        s_data["owner"] = guild.owner_id
         s_data["name"] = guild.name
 
         # Remove entries with None
@@ -236,12 +424,13 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
 
     async def server_setup(self, guild: Guild):
         # These are server defaults
-        s_data = await self._default_guild_data(guild)
+        s_data = self._default_guild_data(guild)
 
         sid = "server:{}".format(guild.id)
 
         self.redis.hmset(sid, s_data)
         # commands:id, mutes:id, blacklist:id and sr:id are created automatically when needed
+        self.invalidate_snapshot(guild.id)
 
         log.info("New server: {}".format(guild.name))
 
@@ -251,59 +440,72 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
 
         self.redis.delete(sid)
         self.redis.hmset(sid, server_data)
+        self.invalidate_snapshot(guild.id)
 
         log.info("Guild reset: {}".format(guild.name))
 
     def server_exists(self, server_id: int) -> bool:
-        return bool(self.redis.exists("server:{}".format(server_id)))
+        return self.get_snapshot(server_id) is not None
 
     def auto_setup_server(self, server: Guild):
         # shortcut for checking sever existence
         if not self.server_exists(server.id):
             self.server_setup(server)
 
-    def get_server_data(self, server) -> dict:
+    @staticmethod
+    def _make_server_data(base, cmd_list, bl, mutes) -> dict:
         # NOTE: HGETALL returns a dict with binary keys and values!
-        base = decode(self.redis.hgetall("server:{}".format(server.id)))
-        cmd_list = self.get_custom_commands(server)
-        bl = self.get_blacklists(server)
-        mutes = self.get_mute_list(server)
-
         data = decode(base)
-        data["commands"] = cmd_list
-        data["blacklist"] = bl
-        data["mutes"] = mutes
+        data["commands"] = decode(cmd_list) or {}
+        data["blacklist"] = list(decode(bl) or [])
+        data["mutes"] = list(decode(mutes) or [])
 
         return data
 
+    def get_server_data(self, server) -> dict:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall("server:{}".format(server.id))
+        pipe.hgetall("commands:{}".format(server.id))
+        pipe.smembers("blacklist:{}".format(server.id))
+        pipe.smembers("mutes:{}".format(server.id))
+
+        return self._make_server_data(*pipe.execute())
+
     # GENERAL USE: moderation settings, server vars
     # TODO investigate uses
     def get_var(self, server_id: int, key: str):
         # If value is in json, it will be a json-encoded string and not parsed
-        return decode(self.redis.hget("server:{}".format(server_id), key))
+        return self._get_setting(server_id, key)
 
     @validate_input
     def update_var(self, server_id: int, key: str, value: str) -> bool:
-        return bin2bool(self.redis.hset("server:{}".format(server_id), key, value))
+        return bin2bool(self._set_setting(server_id, key, value))
 
     @validate_input
     def update_moderation_settings(self, server_id: int, key: str, value: bool) -> bool:
         if key not in mod_settings_map.keys():
             raise TypeError("invalid moderation setting: {}".format(key))
 
-        return bin2bool(self.redis.hset("server:{}".format(server_id), mod_settings_map.get(key), value))
+        return bin2bool(self._set_setting(server_id, mod_settings_map.get(key), value))
 
-    def check_server_vars(self, server: Guild):
-        try:
-            sid = "server:{}".format(server.id)
+    @staticmethod
+    def _server_var_changes(server: Guild, snapshot: GuildSnapshot) -> dict:
+        if snapshot is None:
+            return {}
 
-            if int(decode(self.redis.hget(sid, "owner"))) != server.owner.id:
-                self.redis.hset(sid, "owner", server.owner.id)
+        changes = {}
+        # owner_id comes with the guild itself, server.owner may not be cached
+        if snapshot.settings.get("owner") != server.owner_id:
+            changes["owner"] = server.owner_id
+        if str(snapshot.settings.get("name")) != str(server.name):
+            changes["name"] = str(server.name)
 
-            if decode(self.redis.hget(sid, "name")) != str(server.name):
-                self.redis.hset(sid, "name", server.name)
-        except AttributeError:
-            pass
+        return changes
+
+    def check_server_vars(self, server: Guild):
+        changes = self._server_var_changes(server, self.get_snapshot(server.id))
+        if changes:
+            self._set_settings(server.id, changes)
 
     def check_old_servers(self, current_servers: list):
         servers = ["server:" + str(s_id) for s_id in current_servers]
@@ -319,12 +521,8 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
         log.info("Removed {} old servers.".format(len(removed_servers)))
 
     def delete_server(self, server_id: int):
-        self.redis.delete("commands:{}".format(server_id))
-        self.redis.delete("blacklist:{}".format(server_id))
-        self.redis.delete("mutes:{}".format(server_id))
-        self.redis.delete("server:{}".format(server_id))
-        self.redis.delete("voting:{}".format(server_id))
-        self.redis.delete("sr:{}".format(server_id))
+        self.redis.delete(*[key.format(server_id) for key in GUILD_KEYS])
+        self.invalidate_snapshot(server_id)
 
         log.info("Deleted server: {}".format(server_id))
 
@@ -334,10 +532,25 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
         if len(trigger) > 80:
             return False
 
-        return self.redis.hset("commands:{}".format(server.id), trigger, response)
+        resp = self.redis.hset("commands:{}".format(server.id), trigger, response)
+
+        # Write-through, same as settings (stored like it is loaded)
+        index = self.command_indexes.get(server.id)
+        if index is not None:
+            index.set(str(_as_stored(trigger)), _as_stored(response))
+        self._publish_invalidation(server.id)
+
+        return resp
 
     def remove_command(self, server: Guild, trigger: str) -> bool:
-        return bin2bool(self.redis.hdel("commands:{}".format(server.id), trigger))
+        resp = bin2bool(self.redis.hdel("commands:{}".format(server.id), trigger))
+
+        index = self.command_indexes.get(server.id)
+        if index is not None:
+            index.remove(trigger)
+        self._publish_invalidation(server.id)
+
+        return resp
 
     def get_custom_commands(self, server_id: int) -> dict:
         return decode(self.redis.hgetall("commands:{}".format(server_id))) or {}
@@ -348,6 +561,33 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
     def get_custom_command_by_key(self, server_id: int, key: str) -> str:
         return decode(self.redis.hget("commands:{}".format(server_id), key))
 
+    def _cached_command_index(self, guild_id: int):
+        index = self.command_indexes.get(guild_id)
+        if index is not None and time.monotonic() - index.loaded_at < COMMAND_INDEX_MAX_AGE:
+            return index
+
+        return None
+
+    def _store_command_index(self, guild_id: int, commands) -> CustomCommandIndex:
+        # Guilds without commands get an empty index as well, so they don't hit redis on every message
+        index = CustomCommandIndex(decode(commands))
+        self.command_indexes.set(guild_id, index)
+
+        return index
+
+    def get_command_index(self, guild_id: int) -> CustomCommandIndex:
+        index = self._cached_command_index(guild_id)
+        if index is not None:
+            return index
+
+        return self._store_command_index(guild_id, self.redis.hgetall("commands:{}".format(guild_id)))
+
+    def match_custom_command(self, guild_id: int, content: str):
+        """
+        Returns the response of the (longest) custom command trigger the message starts with or None
+        """
+        return self.get_command_index(guild_id).match(content)
+
     def get_command_amount(self, server_id: int) -> int:
         return decode(self.redis.hlen("commands:{}".format(server_id)))
 
@@ -357,46 +597,68 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
     # CHANNEL BLACKLIST
     @validate_input
     def add_channel_blacklist(self, server_id: int, channel_id: int):
-        return bool(self.redis.sadd("blacklist:{}".format(server_id), channel_id))
+        resp = bool(self.redis.sadd("blacklist:{}".format(server_id), channel_id))
+        self._update_snapshot_set(server_id, "blacklist", channel_id, add=True)
+
+        return resp
 
     @validate_input
     def remove_channel_blacklist(self, server_id: int, channel_id: int):
-        return bool(self.redis.srem("blacklist:{}".format(server_id), channel_id))
+        resp = bool(self.redis.srem("blacklist:{}".format(server_id), channel_id))
+        self._update_snapshot_set(server_id, "blacklist", channel_id, add=False)
+
+        return resp
 
     def is_blacklisted(self, server_id, channel_id):
-        return self.redis.sismember("blacklist:{}".format(server_id), channel_id)
+        snapshot = self.get_snapshot(server_id)
+        if snapshot is None:
+            return False
+
+        return channel_id in snapshot.blacklist
 
     def get_blacklists(self, server_id):
         serv = "blacklist:{}".format(server_id)
         return list(decode(self.redis.smembers(serv)) or [])
 
+    def _update_snapshot_set(self, guild_id, name: str, value, add: bool):
+        snapshot = self.snapshots.get(int(guild_id))
+        if snapshot is not None:
+            target = getattr(snapshot, name)
+
+            if add:
+                target.add(_as_stored(value))
+            else:
+                target.discard(_as_stored(value))
+
+        self._publish_invalidation(guild_id)
+
     # PREFIX
     def get_prefix(self, server: Guild) -> str:
-        return decode(self.redis.hget("server:{}".format(server.id), "prefix"))
+        return self._get_setting(server.id, "prefix")
 
     @validate_input
     def change_prefix(self, server, prefix):
-        self.redis.hset("server:{}".format(server.id), "prefix", prefix)
+        self._set_setting(server.id, "prefix", prefix)
 
     # MODERATION
     def has_spam_filter(self, server):
-        return decode(self.redis.hget("server:{}".format(server.id), SPAMFILTER_SETTING)) is True
+        return self._get_setting(server.id, SPAMFILTER_SETTING) is True
 
     def has_word_filter(self, server):
-        return decode(self.redis.hget("server:{}".format(server.id), WORDFILTER_SETTING)) is True
+        return self._get_setting(server.id, WORDFILTER_SETTING) is True
 
     def has_invite_filter(self, server):
-        return decode(self.redis.hget("server:{}".format(server.id), INVITEFILTER_SETTING)) is True
+        return self._get_setting(server.id, INVITEFILTER_SETTING) is True
 
     def get_log_channel(self, server):
-        return decode(self.redis.hget("server:{}".format(server.id), "logchannel"))
+        return self._get_setting(server.id, "logchannel")
 
     def get_defaultchannel(self, server_id):
-        return decode(self.redis.hget("server:{}".format(server_id), "dchan"))
+        return self._get_setting(server_id, "dchan")
 
     @validate_input
     def set_defaultchannel(self, server, channel_id):
-        self.redis.hset("server:{}".format(server.id), "dchan", channel_id)
+        self._set_setting(server.id, "dchan", channel_id)
 
     # SETTINGS
     @validate_input
@@ -405,9 +667,9 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
             raise TypeError("invalid channel type")
 
         if value is not None:
-            return bin2bool(self.redis.hset("server:{}".format(guild_id), var_name, value))
+            return bin2bool(self._set_setting(guild_id, var_name, value))
         else:
-            return self.redis.hdel("server:{}".format(guild_id), var_name)
+            return self._set_setting(guild_id, var_name, None)
 
     @validate_input
     def set_custom_event_message(self, guild_id, var_name, value):
@@ -415,32 +677,41 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
             raise TypeError("invalid event type")
 
         if value is not None:
-            return bin2bool(self.redis.hset("server:{}".format(guild_id), var_name, value))
+            return bin2bool(self._set_setting(guild_id, var_name, value))
         else:
-            return self.redis.hdel("server:{}".format(guild_id), var_name)
+            return self._set_setting(guild_id, var_name, None)
 
     # SLEEPING
     def is_sleeping(self, server_id):
-        return decode(self.redis.hget("server:{}".format(server_id), "sleeping"))
+        return self._get_setting(server_id, "sleeping")
 
     @validate_input
     def set_sleeping(self, server, bool_var):
-        self.redis.hset("server:{}".format(server.id), "sleeping", bool(bool_var))
+        self._set_setting(server.id, "sleeping", bool(bool_var))
 
     # MUTING
     @validate_input
     def mute(self, server, user_id):
         serv = "mutes:{}".format(server.id)
-        return bool(self.redis.sadd(serv, user_id))
+        resp = bool(self.redis.sadd(serv, user_id))
+        self._update_snapshot_set(server.id, "mutes", user_id, add=True)
+
+        return resp
 
     @validate_input
     def unmute(self, member_id, server_id):
         serv = "mutes:{}".format(server_id)
-        return bool(self.redis.srem(serv, member_id))
+        resp = bool(self.redis.srem(serv, member_id))
+        self._update_snapshot_set(server_id, "mutes", member_id, add=False)
+
+        return resp
 
     def is_muted(self, server, user_id):
-        serv = "mutes:{}".format(server.id, user_id)
-        return bool(self.redis.sismember(serv, user_id))
+        snapshot = self.get_snapshot(server.id)
+        if snapshot is None:
+            return False
+
+        return user_id in snapshot.mutes
 
     def get_mute_list(self, server):
         serv = "mutes:{}".format(server.id)
@@ -449,10 +720,10 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
     # LANGUAGES
     @validate_input
     def set_lang(self, server_id, language):
-        self.redis.hset("server:{}".format(server_id), "lang", language)
+        self._set_setting(server_id, "lang", language)
 
     def get_lang(self, server_id):
-        return decode(self.redis.hget("server:{}".format(server_id), "lang"))
+        return self._get_setting(server_id, "lang")
 
     # SELFROLES
     def get_selfroles(self, server_id):
@@ -478,17 +749,245 @@ class RedisServerHandler(ServerHandler, metaclass=Singleton):
 
     # Plugin storage system
     def get_plugin_data_manager(self, namespace, *args, **kwargs) -> "RedisPluginDataManager":
-        return RedisPluginDataManager(self.pool, namespace, *args, **kwargs)
+        return RedisPluginDataManager(self.pool, namespace, *args, async_pool=self.async_pool, loop=self.loop,
+                                      batcher=self.aio.batch, **kwargs)
 
     def _get_redis_instance(self):
         return self.redis
 
 
+class AsyncRedisServerHandler(ExecutorFallback):
+    """
+    asyncio mirror of RedisServerHandler (available as handler.aio)
+
+    Message-path getters are implemented natively with redis.asyncio and share the guild snapshots
+    of the blocking handler. Everything else goes through ExecutorFallback.
+
+    Native methods go through a RedisBatcher: commands issued in the same loop iteration
+    (by any coroutine) are sent as one pipeline and identical reads share one reply.
+    """
+    def __init__(self, blocking: RedisServerHandler, pool, loop):
+        self._blocking = blocking
+        self.loop = loop
+
+        self.redis = aioredis.StrictRedis(connection_pool=pool)
+        self.batch = RedisBatcher("server", self.redis, loop)
+
+    async def _publish_invalidation(self, guild_id: int):
+        await self.redis.publish(INVALIDATION_CHANNEL, "{}:{}".format(self._blocking.instance_id, guild_id))
+
+    async def get_snapshot(self, guild_id: int):
+        guild_id = int(guild_id)
+
+        snapshot = self._blocking._cached_snapshot(guild_id)
+        if snapshot is not None:
+            return snapshot
+
+        data = await asyncio.gather(self.batch.hgetall("server:{}".format(guild_id)),
+                                    self.batch.smembers("mutes:{}".format(guild_id)),
+                                    self.batch.smembers("blacklist:{}".format(guild_id)))
+
+        return self._blocking._store_snapshot(guild_id, *data)
+
+    async def _get_setting(self, guild_id: int, key: str):
+        snapshot = await self.get_snapshot(guild_id)
+        if snapshot is None:
+            return None
+
+        return snapshot.settings.get(key)
+
+    async def server_exists(self, server_id: int) -> bool:
+        return await self.get_snapshot(server_id) is not None
+
+    async def get_var(self, server_id: int, key: str):
+        return await self._get_setting(server_id, key)
+
+    async def get_prefix(self, server: Guild) -> str:
+        return await self._get_setting(server.id, "prefix")
+
+    async def get_lang(self, server_id):
+        return await self._get_setting(server_id, "lang")
+
+    async def is_sleeping(self, server_id):
+        return await self._get_setting(server_id, "sleeping")
+
+    async def has_spam_filter(self, server):
+        return await self._get_setting(server.id, SPAMFILTER_SETTING) is True
+
+    async def has_word_filter(self, server):
+        return await self._get_setting(server.id, WORDFILTER_SETTING) is True
+
+    async def has_invite_filter(self, server):
+        return await self._get_setting(server.id, INVITEFILTER_SETTING) is True
+
+    async def get_log_channel(self, server):
+        return await self._get_setting(server.id, "logchannel")
+
+    async def get_defaultchannel(self, server_id):
+        return await self._get_setting(server_id, "dchan")
+
+    async def is_muted(self, server, user_id):
+        snapshot = await self.get_snapshot(server.id)
+        if snapshot is None:
+            return False
+
+        return user_id in snapshot.mutes
+
+    async def is_blacklisted(self, server_id, channel_id):
+        snapshot = await self.get_snapshot(server_id)
+        if snapshot is None:
+            return False
+
+        return channel_id in snapshot.blacklist
+
+    async def get_server_data(self, server) -> dict:
+        data = await asyncio.gather(self.batch.hgetall("server:{}".format(server.id)),
+                                    self.batch.hgetall("commands:{}".format(server.id)),
+                                    self.batch.smembers("blacklist:{}".format(server.id)),
+                                    self.batch.smembers("mutes:{}".format(server.id)))
+
+        return self._blocking._make_server_data(*data)
+
+    async def check_server_vars(self, server: Guild):
+        changes = self._blocking._server_var_changes(server, await self.get_snapshot(server.id))
+        if not changes:
+            return
+
+        fields = [a for pair in changes.items() for a in pair]
+        await self.batch.execute("HSET", "server:{}".format(server.id), *fields)
+
+        self._blocking._apply_settings(server.id, changes)
+        await self._publish_invalidation(server.id)
+
+    async def reconcile_guilds(self, guilds: list, chunk_size: int=WARMUP_CHUNK_SIZE, progress=None) -> dict:
+        """
+        Bulk version of server_setup + check_server_vars for startup: sets up missing guilds,
+        updates changed owners/names and fills the snapshot cache, one chunk (two round trips) at a time
+        :param guilds: list of Guild
+        :param progress: optional function(done, total), called after every chunk
+        :return: dict(checked, created, updated)
+        """
+        blocking = self._blocking
+        result = {"checked": 0, "created": 0, "updated": 0}
+
+        for start in range(0, len(guilds), chunk_size):
+            chunk = guilds[start:start + chunk_size]
+
+            pipe = self.redis.pipeline(transaction=False)
+            for guild in chunk:
+                blocking._queue_snapshot(pipe, guild.id)
+            replies = await pipe.execute()
+
+            writes = self.redis.pipeline(transaction=False)
+            changed = []
+
+            for pos, guild in enumerate(chunk):
+                snapshot = blocking._store_snapshot(guild.id, *replies[pos * 3:pos * 3 + 3])
+
+                if snapshot is None:
+                    data = blocking._default_guild_data(guild)
+                    writes.hset("server:{}".format(guild.id), mapping=data)
+                    blocking.snapshots[guild.id] = GuildSnapshot({k: _as_stored(v) for k, v in data.items()}, set(), set())
+                    result["created"] += 1
+                else:
+                    changes = blocking._server_var_changes(guild, snapshot)
+                    if not changes:
+                        continue
+
+                    writes.hset("server:{}".format(guild.id), mapping=changes)
+                    blocking._apply_settings(guild.id, changes)
+                    result["updated"] += 1
+
+                changed.append(guild.id)
+
+            for guild_id in changed:
+                writes.publish(INVALIDATION_CHANNEL, "{}:{}".format(blocking.instance_id, guild_id))
+            if changed:
+                await writes.execute()
+
+            result["checked"] += len(chunk)
+            if progress is not None:
+                progress(result["checked"], len(guilds))
+
+        return result
+
+    async def remove_old_guilds(self, current_ids: set, owns_guild=None, chunk_size: int=WARMUP_CHUNK_SIZE) -> int:
+        """
+        Bulk version of check_old_servers: deletes data of guilds Nano isn't in anymore
+        :param current_ids: ids of all guilds this process is in
+        :param owns_guild: function(guild_id) -> bool, True if this process would have the guild
+                           (other clusters' guilds must be left alone)
+        :return: number of removed guilds
+        """
+        old = []
+        async for key in self.redis.scan_iter(match="server:*", count=chunk_size):
+            key = decode_auto(key)
+
+            # Other data that happens to match server:* (e.g. server:<id>:something)
+            try:
+                guild_id = int(key.split(":", maxsplit=1)[1])
+            except ValueError:
+                log.warning("Skipping {}: not a guild key".format(key))
+                continue
+
+            if guild_id not in current_ids and (owns_guild is None or owns_guild(guild_id)):
+                old.append(guild_id)
+
+        for start in range(0, len(old), chunk_size):
+            chunk = old[start:start + chunk_size]
+
+            pipe = self.redis.pipeline(transaction=False)
+            for guild_id in chunk:
+                pipe.delete(*[key.format(guild_id) for key in GUILD_KEYS])
+                pipe.publish(INVALIDATION_CHANNEL, "{}:{}".format(self._blocking.instance_id, guild_id))
+                self._blocking.snapshots.pop(guild_id, None)
+                self._blocking.command_indexes.delete(guild_id)
+
+            await pipe.execute()
+
+        return len(old)
+
+    async def delete_server(self, server_id: int):
+        await self.batch.delete(*[key.format(server_id) for key in GUILD_KEYS])
+
+        self._blocking.snapshots.pop(int(server_id), None)
+        self._blocking.command_indexes.delete(int(server_id))
+        await self._publish_invalidation(server_id)
+
+        log.info("Deleted server: {}".format(server_id))
+
+    async def get_custom_commands(self, server_id: int) -> dict:
+        return decode(await self.batch.hgetall("commands:{}".format(server_id))) or {}
+
+    async def get_custom_commands_keys(self, server_id: int) -> list:
+        return decode(await self.batch.hkeys("commands:{}".format(server_id))) or []
+
+    async def get_custom_command_by_key(self, server_id: int, key: str) -> str:
+        return decode(await self.batch.hget("commands:{}".format(server_id), key))
+
+    async def get_command_index(self, guild_id: int) -> CustomCommandIndex:
+        index = self._blocking._cached_command_index(guild_id)
+        if index is not None:
+            return index
+
+        commands = await self.batch.hgetall("commands:{}".format(guild_id))
+        return self._blocking._store_command_index(guild_id, commands)
+
+    async def match_custom_command(self, guild_id: int, content: str):
+        return (await self.get_command_index(guild_id)).match(content)
+
+
 class RedisPluginDataManager:
-    def __init__(self, pool, namespace=None, *_, **__):
+    def __init__(self, pool, namespace=None, *_, async_pool=None, loop=None, batcher=None, **__):
         self.namespace = namespace
         self.redis = redis.StrictRedis(connection_pool=pool)
 
+        # Non-blocking access: await manager.aio.hget(...)
+        if async_pool is not None:
+            self.aio = AsyncPluginDataManager(self, async_pool, loop or asyncio.get_event_loop(), batcher)
+        else:
+            self.aio = None
+
         log.info("New plugin namespace registered: {}".format(self.namespace or "(no namespace)"))
 
     def _make_key(self, name):
@@ -507,6 +1006,9 @@ class RedisPluginDataManager:
     def hget(self, name, field, use_namespace=True):
         return decode(self.redis.hget(self._make_key(name) if use_namespace else name, field))
 
+    def hmget(self, name, *fields, use_namespace=True):
+        return decode(self.redis.hmget(self._make_key(name) if use_namespace else name, fields))
+
     def hgetall(self, name, use_namespace=True):
         return decode(self.redis.hgetall(self._make_key(name) if use_namespace else name))
 
@@ -562,12 +1064,49 @@ class RedisPluginDataManager:
     def srandmember(self, name, amount=1):
         return decode(self.redis.srandmember(self._make_key(name), amount))
 
-    def scard(self, name):
-        return self.redis.scard(self._make_key(name))
+    def scard(self, name, use_namespace=True):
+        return self.redis.scard(self._make_key(name) if use_namespace else name)
+
+    def smembers(self, name, use_namespace=True):
+        return decode(self.redis.smembers(self._make_key(name) if use_namespace else name))
+
+    def srem(self, name, *values):
+        return self.redis.srem(self._make_key(name), *values)
+
+    def zadd(self, name, mapping: dict, **kwargs):
+        return self.redis.zadd(self._make_key(name), mapping, **kwargs)
+
+    def zrem(self, name, *values):
+        return self.redis.zrem(self._make_key(name), *values)
+
+    def zscore(self, name, value):
+        return self.redis.zscore(self._make_key(name), value)
+
+    def zcard(self, name):
+        return self.redis.zcard(self._make_key(name))
+
+    def zrange(self, name, start=0, end=-1, withscores=False):
+        return decode(self.redis.zrange(self._make_key(name), start, end, withscores=withscores))
+
+    def zrangebyscore(self, name, min_score, max_score, start=None, num=None, withscores=False):
+        return decode(self.redis.zrangebyscore(self._make_key(name), min_score, max_score,
+                                               start=start, num=num, withscores=withscores))
 
     def pipeline(self, **options):
         return self.redis.pipeline(**options)
 
+    def register_script(self, script: str, use_namespace=True):
+        """
+        Loads a Lua script (EVALSHA, falls back to EVAL after a SCRIPT FLUSH)
+        :return: callable(keys=list, args=list)
+        """
+        lua = self.redis.register_script(script)
+
+        def run(keys=(), args=()):
+            return lua(keys=[self._make_key(key) if use_namespace else key for key in keys], args=list(args))
+
+        return run
+
     def expire(self, name, time):
         return self.redis.expire(name, int(time))
 
@@ -575,14 +1114,109 @@ class RedisPluginDataManager:
         return decode(self.redis.ttl(name))
 
 
+class AsyncPluginDataManager(ExecutorFallback):
+    """
+    asyncio mirror of RedisPluginDataManager (available as manager.aio), same namespacing and decoding rules
+
+    Simple commands go through a RedisBatcher (shared with the server handler when created by it).
+    """
+    def __init__(self, blocking: RedisPluginDataManager, pool, loop, batcher: RedisBatcher=None):
+        self._blocking = blocking
+        self.loop = loop
+
+        self.redis = aioredis.StrictRedis(connection_pool=pool)
+        self.batch = batcher or RedisBatcher(blocking.namespace or "plugins", self.redis, loop)
+
+    def _make_key(self, name):
+        return self._blocking._make_key(name)
+
+    async def set(self, key, val, **kwargs):
+        return decode(await self.redis.set(self._make_key(key), val, **kwargs))
+
+    async def get(self, key):
+        return decode(await self.batch.get(self._make_key(key)))
+
+    async def hget(self, name, field, use_namespace=True):
+        return decode(await self.batch.hget(self._make_key(name) if use_namespace else name, field))
+
+    async def hmget(self, name, *fields, use_namespace=True):
+        return decode(await self.batch.hmget(self._make_key(name) if use_namespace else name, *fields))
+
+    async def hgetall(self, name, use_namespace=True):
+        return decode(await self.batch.hgetall(self._make_key(name) if use_namespace else name))
+
+    async def hdel(self, name, field):
+        return decode(await self.batch.execute("HDEL", self._make_key(name), field))
+
+    async def hmset(self, name, payload):
+        return await self.redis.hset(self._make_key(name), mapping=payload)
+
+    async def hset(self, name, field, value):
+        return decode(await self.batch.hset(self._make_key(name), field, value))
+
+    async def hexists(self, name, field):
+        return await self.batch.execute("HEXISTS", name, field)
+
+    async def exists(self, name, use_namespace=True):
+        return await self.batch.exists(self._make_key(name) if use_namespace else name)
+
+    async def delete(self, name, use_namespace=True):
+        return await self.batch.delete(self._make_key(name) if use_namespace else name)
+
+    async def sadd(self, name, *values):
+        return await self.batch.execute("SADD", self._make_key(name), *values)
+
+    async def srem(self, name, *values):
+        return await self.batch.execute("SREM", self._make_key(name), *values)
+
+    async def srandmember(self, name, amount=1):
+        return decode(await self.redis.srandmember(self._make_key(name), amount))
+
+    async def scard(self, name):
+        return await self.batch.scard(self._make_key(name))
+
+    async def smembers(self, name, use_namespace=True):
+        return decode(await self.batch.smembers(self._make_key(name) if use_namespace else name))
+
+    async def zadd(self, name, mapping: dict, **kwargs):
+        return await self.redis.zadd(self._make_key(name), mapping, **kwargs)
+
+    async def zrem(self, name, *values):
+        return await self.redis.zrem(self._make_key(name), *values)
+
+    async def zcard(self, name):
+        return await self.redis.zcard(self._make_key(name))
+
+    async def zrange(self, name, start=0, end=-1, withscores=False):
+        return decode(await self.redis.zrange(self._make_key(name), start, end, withscores=withscores))
+
+    async def zrangebyscore(self, name, min_score, max_score, start=None, num=None, withscores=False):
+        return decode(await self.redis.zrangebyscore(self._make_key(name), min_score, max_score,
+                                                     start=start, num=num, withscores=withscores))
+
+    def pipeline(self, **options):
+        # Not a coroutine: queue commands, then `await pipe.execute()`
+        return self.redis.pipeline(**options)
+
+    async def expire(self, name, time):
+        return await self.redis.expire(name, int(time))
+
+    async def ttl(self, name):
+        return decode(await self.redis.ttl(name))
+
+
 # Singleton
 
 class RedisCacheHandler(RedisPluginDataManager, ServerHandler, metaclass=Singleton):
     def __init__(self):
         redis_ip, redis_port, redis_pass = self.get_cache_credentials()
         self.pool = self.make_pool(redis_ip, redis_port, redis_pass, db=0)
+        self.async_pool = self.make_async_pool(redis_ip, redis_port, redis_pass, db=0)
+
+        # Separate redis server, separate batches
+        self.batcher = RedisBatcher("cache", aioredis.StrictRedis(connection_pool=self.async_pool), asyncio.get_event_loop())
 
-        super().__init__(self.pool)
+        super().__init__(self.pool, async_pool=self.async_pool, batcher=self.batcher)
 
     def get_plugin_data_manager(self, namespace):
-        return RedisPluginDataManager(self.pool, namespace)
+        return RedisPluginDataManager(self.pool, namespace, async_pool=self.async_pool, batcher=self.batcher)
@@ -0,0 +1,121 @@
+# coding=utf-8
+import logging
+import sys
+import time
+import weakref
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# All live stores by name, for !debug
+_stores = weakref.WeakValueDictionary()
+
+
+class BoundedStore:
+    """
+    Per-key (usually per-user) state with TTL eviction and a hard size cap.
+
+    Entries are kept in least-recently-used order: every access moves the key to the end, so expired entries
+    and eviction candidates are always at the front and each operation only looks at as many of them as it removes.
+    """
+    __slots__ = ("name", "max_size", "ttl", "_data", "_touched", "evicted_ttl", "evicted_size", "__weakref__")
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # key: value / key: last access time, same order
+        self._data = OrderedDict()
+        self._touched = {}
+
+        self.evicted_ttl = 0
+        self.evicted_size = 0
+
+        _stores[name] = self
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _expire(self, now: float):
+        data = self._data
+        touched = self._touched
+
+        while data:
+            key = next(iter(data))
+            if now - touched[key] <= self.ttl:
+                break
+
+            del data[key]
+            del touched[key]
+            self.evicted_ttl += 1
+
+    def get(self, key, default=None):
+        value = self._data.get(key)
+        if value is None:
+            return default
+
+        now = time.monotonic()
+        if now - self._touched[key] > self.ttl:
+            self._expire(now)
+            return default
+
+        self._data.move_to_end(key)
+        self._touched[key] = now
+
+        return value
+
+    def set(self, key, value):
+        now = time.monotonic()
+        self._expire(now)
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+        self._touched[key] = now
+
+        while len(self._data) > self.max_size:
+            old, _ = self._data.popitem(last=False)
+            del self._touched[old]
+            self.evicted_size += 1
+
+    def get_or_create(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value)
+
+        return value
+
+    def delete(self, key):
+        if self._data.pop(key, None) is not None:
+            del self._touched[key]
+
+    def approximate_memory(self) -> int:
+        """
+        Rough size of the store in bytes (containers + keys + values, not following references)
+        """
+        size = sys.getsizeof(self._data) + sys.getsizeof(self._touched)
+        for key, value in self._data.items():
+            size += sys.getsizeof(key) + sys.getsizeof(value)
+            for slot in getattr(type(value), "__slots__", ()):
+                size += sys.getsizeof(getattr(value, slot, None))
+
+        return size
+
+    def info(self) -> dict:
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "memory": self.approximate_memory(),
+            "evicted_ttl": self.evicted_ttl,
+            "evicted_size": self.evicted_size,
+        }
+
+
+def get_store_info() -> list:
+    return [store.info() for store in list(_stores.values())]
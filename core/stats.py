@@ -1,7 +1,9 @@
 # coding=utf-8
+import asyncio
 import configparser
 import logging
 import redis
+from .metrics import MetricsRegistry
 from .utils import decode
 
 __author__ = "DefaltSimon"
@@ -28,6 +30,9 @@ SUPPRESS = "messagessuppressed"
 DOWNLOAD = "imagesize"
 PRAYER = "prayerssaid"
 
+# How often pending counts are written to redis (seconds)
+STATS_FLUSH_INTERVAL = 30
+
 stat_types = [MESSAGE, WRONG_ARG, SERVER_LEFT, SLEPT, WRONG_PERMS, HELP, IMAGE_SENT, VOTE, PING, SUPPRESS, DOWNLOAD, PRAYER]
 
 
@@ -36,14 +41,25 @@ stat_types = [MESSAGE, WRONG_ARG, SERVER_LEFT, SLEPT, WRONG_PERMS, HELP, IMAGE_S
 
 
 class NanoStats:
-    __slots__ = ("_redis", "redis", "loop", "_pending_data", "MAX_BEFORE_UPDATE")
+    """
+    Global counters for !stats, kept in the "stats" hash
+
+    add() only counts in memory, the counts are written to redis every STATS_FLUSH_INTERVAL seconds
+    in one pipeline (and on shutdown). They are also exported as nano_stats_total{type=...}.
+    """
+    __slots__ = ("_redis", "redis", "loop", "_pending_data", "_flushing", "metrics", "counter", "_task")
 
-    def __init__(self, loop, redis_ip, redis_port, redis_pass):
+    def __init__(self, loop, redis_ip, redis_port, redis_pass, metrics: MetricsRegistry=None):
         self.loop = loop
         self.redis = None
 
         self._pending_data = {a: 0 for a in stat_types}
-        self.MAX_BEFORE_UPDATE = 5
+        # Counts that are being written right now (still shown by get_data)
+        self._flushing = {}
+
+        self.metrics = metrics or MetricsRegistry()
+        self.counter = self.metrics.counter("nano_stats_total", "Counters shown in !stats", ("type", ))
+        self._task = None
 
         self.redis = redis.StrictRedis(host=redis_ip, port=redis_port, password=redis_pass)
 
@@ -61,26 +77,88 @@ class NanoStats:
         else:
             log.info("Enabled: stats found")
 
+    def start(self):
+        if self._task is None:
+            self._task = self.loop.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+
+            try:
+                await self.flush_async()
+            except redis.RedisError:
+                log.warning("Could not flush stats, retrying later")
+
+    def _take_pending(self) -> dict:
+        # Swapped for a fresh dict, add() keeps counting into that one while the old counts are written
+        pending = {typ: amount for typ, amount in self._pending_data.items() if amount}
+        self._pending_data = {a: 0 for a in stat_types}
+
+        return pending
+
+    def _restore_pending(self, pending: dict):
+        # Keep them for the next flush
+        for typ, amount in pending.items():
+            self._pending_data[typ] += amount
 
+    def _write(self, pending: dict):
+        pipe = self.redis.pipeline(transaction=False)
+        for typ, amount in pending.items():
+            pipe.hincrby("stats", typ, amount)
+
+        pipe.execute()
+
+    async def flush_async(self):
+        """
+        Writes pending counts to redis in one round trip (in the executor)
+        Must be called from the loop, which is the only place the pending counts are touched
+        """
+        pending = self._take_pending()
+        if not pending:
+            return
+
+        self._flushing = pending
+        try:
+            await self.loop.run_in_executor(None, self._write, pending)
+        except redis.RedisError:
+            self._restore_pending(pending)
+            raise
+        finally:
+            self._flushing = {}
+
+    def flush(self):
+        """
+        Blocking version of flush_async, for when the loop isn't running (shutdown)
+        """
+        pending = self._take_pending()
+        if not pending:
+            return
+
+        try:
+            self._write(pending)
+        except redis.RedisError:
+            self._restore_pending(pending)
+            raise
 
     def add(self, stat_type):
         if stat_type not in stat_types:
             return False
 
         self._pending_data[stat_type] += 1
-
-        value = self._pending_data[stat_type]
-        if value >= self.MAX_BEFORE_UPDATE:
-            log.debug("Reached max size, posting to redis...")
-            # Send data and reset the pending counter
-            self.redis.hincrby("stats", stat_type, value)
-            self._pending_data[stat_type] = 0
+        self.counter.inc(type=stat_type)
 
     def get_data(self):
-        return decode(self.redis.hgetall("stats"))
+        data = decode(self.redis.hgetall("stats"))
+
+        # Include what hasn't been flushed yet
+        for typ, amount in self._pending_data.items():
+            data[typ] = int(data.get(typ) or 0) + amount + self._flushing.get(typ, 0)
+
+        return data
 
     def get_amount(self, typ):
         if typ not in stat_types:
             raise TypeError("invalid type")
 
-        return decode(self.redis.hget("stats", typ))
+        return int(decode(self.redis.hget("stats", typ)) or 0) + self._pending_data[typ] + self._flushing.get(typ, 0)
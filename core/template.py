@@ -0,0 +1,239 @@
+# coding=utf-8
+import logging
+import re
+import sys
+import time
+from datetime import datetime
+from functools import lru_cache
+from random import randint
+
+from .utils import IgnoredException
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+#####
+# Response templates
+# Custom command responses and join/leave/kick/ban messages are compiled once into a list of
+# literal strings and placeholder nodes, so rendering them is just a walk over that list.
+#
+# Custom commands ({...} groups):
+#   {author|name/id/mention/discrim/avatar}, {mentions|<index>|name/id/mention/discrim/avatar},
+#   {rnd|<to>}, {rnd|<from>|<to>}, {time|raw/now}, {time|format|<strftime format>},
+#   {choose|a|b|c}, {onfail|<text>}, {onfail|raw}
+# Event messages:
+#   :user (mention), :username (display name), :server (guild name)
+#####
+
+# How many compiled templates to keep (least recently used ones are dropped first)
+TEMPLATE_CACHE_SIZE = 4096
+
+SYNTAX_COMMAND = "command"
+SYNTAX_EVENT = "event"
+
+# Captures {...} groups
+GROUP_PATTERN = re.compile(r"({.+?})")
+# Longest first, so :username isn't read as :user + "name"
+EVENT_PATTERN = re.compile(r"(:username|:user|:server)")
+
+
+class EventContext:
+    """
+    Render context for member events (join, leave, kick, ban)
+    """
+    __slots__ = ("member", "guild")
+
+    def __init__(self, member, guild):
+        self.member = member
+        self.guild = guild
+
+
+# Placeholder nodes
+# Every node is a function(ctx) -> str, compiled for one group (unknown groups are kept as literal text)
+
+def _user_field(field):
+    if field == "name":
+        return lambda user: user.display_name
+    if field == "id":
+        return lambda user: user.id
+    if field == "mention":
+        return lambda user: user.mention
+    if field == "discrim":
+        return lambda user: user.discriminator
+    if field == "avatar":
+        return lambda user: user.avatar_url or user.default_avatar_url
+    else:
+        return lambda user: user.name
+
+
+def _compile_group(group: str):
+    name, *tokens = group.split("|")
+    if len(tokens) != 0:
+        first, *tokens = tokens
+    else:
+        first = None
+
+    # 1. Author stuff
+    if name == "author":
+        field = _user_field(first)
+        return lambda ctx: field(ctx.author)
+
+    # 2. Mention stuff
+    elif name == "mentions":
+        # first == index
+        field = _user_field(tokens[0] if tokens else None)
+        index = first or "0"
+
+        def mention(ctx):
+            try:
+                return field(ctx.mentions[int(index)])
+            except IndexError:
+                raise IndexError("No such mention") from None
+
+        return mention
+
+    # 3. Random numbers
+    elif name == "rnd":
+        to = tokens[0] if tokens else None
+        first = first or 1
+
+        # Two arguments
+        if to:
+            return lambda ctx: randint(int(first), int(to))
+        # Only one
+        else:
+            return lambda ctx: randint(0, int(first))
+
+    elif name == "time":
+        # https://docs.python.org/3/library/datetime.html#strftime-strptime-behavior
+        first = first or "format"
+
+        if first == "now":
+            return lambda ctx: datetime.now().strftime("%H:%M %d. of %B, %Y")
+        elif first == "format":
+            return lambda ctx: datetime.now().strftime(tokens[0])
+        else:
+            # Defaults to epoch time (also "raw")
+            return lambda ctx: time.time()
+
+    elif name == "choose":
+        items = (first, *tokens)
+        return lambda ctx: items[randint(0, len(items) - 1)]
+
+    # 4. Failure fallback: handled by Template.render
+    elif name == "onfail":
+        return OnFail(first)
+
+    # Unknown groups ({prefix}, json, ...) are not placeholders: kept exactly as written
+    else:
+        return "{" + group + "}"
+
+
+class OnFail:
+    """
+    {onfail|<text>} / {onfail|raw}: what to send instead if a later placeholder fails
+    """
+    __slots__ = ("text", )
+
+    def __init__(self, text):
+        self.text = text
+
+    def get(self) -> str:
+        if self.text == "raw":
+            return "Error: " + str(sys.exc_info()[1])
+
+        return self.text
+
+
+_EVENT_NODES = {
+    ":user": lambda ctx: ctx.member.mention,
+    ":username": lambda ctx: ctx.member.display_name,
+    ":server": lambda ctx: ctx.guild.name,
+}
+
+
+class Template:
+    __slots__ = ("nodes", "static")
+
+    def __init__(self, nodes: list):
+        # Literal strings and placeholder nodes, in order
+        self.nodes = nodes
+        # Nothing to render: the response is just the text
+        self.static = all(type(node) is str for node in nodes)
+
+    def render(self, ctx) -> str:
+        if self.static:
+            return "".join(self.nodes)
+
+        parts = []
+        on_fail = None
+
+        for node in self.nodes:
+            if type(node) is str:
+                parts.append(node)
+                continue
+
+            if type(node) is OnFail:
+                on_fail = node
+                continue
+
+            try:
+                parts.append(str(node(ctx)))
+            except Exception:
+                if on_fail is not None:
+                    return on_fail.get()
+
+                raise IgnoredException
+
+        return "".join(parts)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(text: str, syntax: str=SYNTAX_COMMAND) -> Template:
+    """
+    Compiles (or returns the cached) template
+    :param text: raw response
+    :param syntax: SYNTAX_COMMAND or SYNTAX_EVENT
+    """
+    if syntax == SYNTAX_EVENT:
+        pattern, compile_node = EVENT_PATTERN, _EVENT_NODES.get
+    else:
+        # Not a dynamic response
+        if "{" not in text or "}" not in text:
+            return Template([text])
+
+        # Cut out { and }
+        pattern, compile_node = GROUP_PATTERN, lambda group: _compile_group(group[1:-1])
+
+    nodes = []
+    last = 0
+    for match in pattern.finditer(text):
+        if match.start() > last:
+            nodes.append(text[last:match.start()])
+
+        nodes.append(compile_node(match.group()))
+        last = match.end()
+
+    if last < len(text):
+        nodes.append(text[last:])
+
+    return Template(nodes)
+
+
+def render_command(text: str, message) -> str:
+    """
+    Renders a custom command response for a message
+    """
+    return compile_template(text, SYNTAX_COMMAND).render(message)
+
+
+def render_event(text: str, member, guild) -> str:
+    """
+    Renders a join/leave/kick/ban message for a member
+    """
+    return compile_template(text, SYNTAX_EVENT).render(EventContext(member, guild))
+
+
+def get_cache_info() -> dict:
+    info = compile_template.cache_info()
+    return {"size": info.currsize, "max_size": info.maxsize, "hits": info.hits, "misses": info.misses}
@@ -2,10 +2,10 @@
 import re
 import uuid
 import os
-from datetime import datetime
 from typing import Iterable
 
-from .confparser import DATA_DIR
+from .confparser import DATA_DIR, get_settings_parser
+from .logsink import get_sink_from_settings
 from .translations import TranslationManager, DEFAULT_LANGUAGE
 
 
@@ -23,22 +23,6 @@ class SecurityError(Exception):
     pass
 
 
-class CmdResponseTypes:
-    REGISTER_ON_FAIL = "reg_on_fail"
-
-
-class DynamicResponse:
-    __slots__ = ("intention", "data")
-
-    def __init__(self, intention, data):
-        self.intention = intention
-        self.data = data
-
-    @classmethod
-    def register_failure_response(cls, text):
-        return cls(CmdResponseTypes.REGISTER_ON_FAIL, text)
-
-
 # Singleton
 class Singleton(type):
     """
@@ -295,26 +279,16 @@ if not os.path.isfile(LOG_FILE):
         pass
 
 
-def log_to_file(content, type_="log"):
-    fn = BUG_FILE if type_ == "bug" else LOG_FILE
+# Lines are written by a background thread, see core/logsink.py
+log_sink = get_sink_from_settings(get_settings_parser())
 
-    with open(fn, "a") as file:
-        cn = datetime.now().strftime("%d-%m-%Y %H:%M:%S") + " - " + str(content)
 
-        try:
-            file.write(cn + "\n")
-        except UnicodeEncodeError:
-            pass
+def log_to_file(content, type_="log"):
+    log_sink.write(BUG_FILE if type_ == "bug" else LOG_FILE, content)
 
 
 def alternate_log(content: str, filename: str, append=True):
-    with open(filename, "a" if append else "w") as file:
-        cn = datetime.now().strftime("%d-%m-%Y %H:%M:%S") + " - " + str(content)
-
-        try:
-            file.write(cn + "\n")
-        except UnicodeEncodeError:
-            pass
+    log_sink.write(filename, content, truncate=not append)
 
 
 none_ux = [
@@ -0,0 +1,115 @@
+# coding=utf-8
+import logging
+from collections import deque
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Matching modes
+# "ass" matches "ass." and "ass!", but not "class"
+MODE_WORD = "word"
+# "ass" matches "class" as well
+MODE_SUBSTRING = "substring"
+
+
+class WordFilter:
+    """
+    Aho-Corasick automaton over a word list: finds every listed word in a single pass over the text,
+    no matter how many words there are.
+
+    State 0 is the root. For every state we keep its transitions, its failure link
+    and the lengths of all words that end there (including the ones inherited through failure links).
+    """
+    __slots__ = ("_goto", "_fail", "_out", "mode", "word_amount")
+
+    def __init__(self, words, mode: str=MODE_WORD):
+        if mode not in (MODE_WORD, MODE_SUBSTRING):
+            raise ValueError("unknown mode: {}".format(mode))
+
+        self.mode = mode
+
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+
+        self.word_amount = 0
+        for word in set(words):
+            if word:
+                self._add(word)
+
+        self._link()
+
+    def _add(self, word: str):
+        state = 0
+        for char in word:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+
+            state = nxt
+
+        self._out[state] += (len(word),)
+        self.word_amount += 1
+
+    def _link(self):
+        # Breadth-first, so failure targets (always shallower) are done before they're needed
+        queue = deque(self._goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+
+                target = self._goto[fail].get(char, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    @staticmethod
+    def _is_boundary(text: str, pos: int) -> bool:
+        return pos < 0 or pos >= len(text) or not text[pos].isalnum()
+
+    def find(self, text: str):
+        """
+        Generator, yields (start, end) of every match
+        """
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        whole_words = self.mode == MODE_WORD
+
+        state = 0
+        for pos, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+
+            state = goto[state].get(char, 0)
+
+            for length in out[state]:
+                start = pos - length + 1
+
+                if whole_words and not (self._is_boundary(text, start - 1) and self._is_boundary(text, pos + 1)):
+                    continue
+
+                yield start, pos + 1
+
+    def matches(self, text: str) -> list:
+        return [text[start:end] for start, end in self.find(text)]
+
+    def search(self, text: str) -> bool:
+        """
+        Returns True as soon as any word is found
+        """
+        for _ in self.find(text):
+            return True
+
+        return False
@@ -3,15 +3,24 @@ import asyncio
 import importlib
 import logging
 import os
+import signal
 import sys
 import time
 import discord
 import traceback
 
+from core.cluster import ClusterCoordinator, get_cluster_env
+from core.executor import ExecutorService
+from core.httpclient import HttpService
+from core.lazy import warm_up
+from core.metrics import MetricsRegistry, MetricsServer
+from core.profiling import DispatchProfiler, StartupProfile
+from core.router import CommandRouter
+from core.scheduler import TimerScheduler
 from core.serverhandler import ServerHandler
 from core.stats import NanoStats
 from core.translations import TranslationManager
-from core.utils import log_to_file
+from core.utils import log_to_file, log_sink
 from core.confparser import get_settings_parser, PLUGINS_DIR
 
 __title__ = "Nano"
@@ -23,6 +32,8 @@ __version__ = '3.8.3'
 
 ON_MESSAGE = "on_message"
 ON_REACTION_ADD = "on_reaction_add"
+# Also fired for messages that aren't in the message cache (sent before a restart or pushed out of it)
+ON_RAW_REACTION_ADD = "on_raw_reaction_add"
 ON_READY = "on_ready"
 
 ON_MESSAGE_DELETE = "on_message_delete"
@@ -50,7 +61,7 @@ EVENTS = ["on_message", "on_guild_join", "on_channel_create", "on_channel_delete
           "on_channel_update", "on_message_edit", "on_message_delete", "on_ready",
           "on_member_join", "on_member_remove", "on_member_update", "on_member_ban",
           "on_member_unban", "on_guild_remove", "on_error", "on_shutdown",
-          "on_plugins_loaded", "on_reaction_add"]
+          "on_plugins_loaded", "on_reaction_add", "on_raw_reaction_add"]
 
 # Ensure there are no duplicates
 assert len(set(EVENTS)) == len(EVENTS)
@@ -59,6 +70,9 @@ assert len(set(EVENTS)) == len(EVENTS)
 
 IS_RESUME = False
 
+# Independent handlers (see Nano._parse_priorities) are cancelled after this many seconds unless they set their own
+HANDLER_TIMEOUT = 30
+
 # LOGGING
 
 logging.basicConfig(level=logging.INFO)
@@ -73,6 +87,9 @@ logging.getLogger("websockets.protocol").setLevel(logging.INFO)
 logging.getLogger("core.stats").setLevel(logging.INFO)
 logging.getLogger("plugins.statistics").setLevel(logging.INFO)
 
+# Plugin import/init times, time to on_ready (nano.dev.profile startup)
+startup = StartupProfile()
+
 # Config parser setup
 parser = get_settings_parser()
 
@@ -83,20 +100,75 @@ loop = asyncio.get_event_loop()
 custom_intents = discord.Intents.default()
 custom_intents.members = True
 
+# When started by the cluster launcher (cluster.py), only run the assigned shard range
+cluster_env = get_cluster_env()
+if cluster_env is not None:
+    cluster_id, shard_ids, shard_count = cluster_env
+    shard_options = dict(shard_ids=shard_ids, shard_count=shard_count)
+
+    log.info("Running as cluster {} with shards {} (of {})".format(cluster_id, shard_ids, shard_count))
+else:
+    shard_options = {}
+
 client = discord.AutoShardedClient(
     loop=loop,
     intents=custom_intents,
     chunk_guilds_at_startup=True,
     guild_ready_timeout=2,
-    guild_subscriptions=True
+    guild_subscriptions=True,
+    **shard_options
 )
 
 log.info("Initializing ServerHandler and NanoStats...")
 
 # Setup the server data and stats
 handler = ServerHandler.get_handler(loop)
-stats = NanoStats(loop, *ServerHandler.get_redis_credentials())
+# Counters, gauges and latencies (Prometheus export, see [Metrics] in settings.ini)
+metrics = MetricsRegistry()
+stats = NanoStats(loop, *ServerHandler.get_redis_credentials(), metrics=metrics)
 trans = TranslationManager()
+# Shared timer queues (reminders, softbans, ...)
+scheduler = TimerScheduler(client, handler, loop)
+# Cross-cluster totals and commands
+cluster = ClusterCoordinator(client, handler, loop)
+
+
+def _int_option(section: str, option: str):
+    value = parser.get(section, option, fallback="").strip()
+    return int(value) if value.isdigit() else None
+
+
+# Process/thread pools for blocking work
+executor = ExecutorService(loop, cpu_workers=_int_option("Executor", "cpu_workers"),
+                           io_workers=_int_option("Executor", "io_workers"))
+# Pooled HTTP client for all plugins
+http = HttpService(loop, max_connections=_int_option("HTTP", "max_connections"),
+                   max_per_host=_int_option("HTTP", "max_per_host"))
+
+
+def _make_metrics_server():
+    port = parser.get("Metrics", "port", fallback="").strip()
+    if not port.isdigit():
+        return None
+
+    # Every cluster gets its own port: port + cluster id
+    return MetricsServer(metrics, parser.get("Metrics", "host", fallback="127.0.0.1").strip() or "127.0.0.1",
+                         int(port) + cluster.cluster_id)
+
+
+metrics_server = _make_metrics_server()
+
+command_counter = metrics.counter("nano_commands_total", "Commands handled", ("plugin", "command"))
+command_latency = metrics.histogram("nano_command_seconds", "Time spent handling a command", ("plugin", ))
+
+# Per event and plugin timings, slow callback stacks (nano.dev.profile)
+profiler = DispatchProfiler(loop, metrics=metrics)
+
+metrics.gauge("nano_guilds", "Guilds in this cluster", fn=lambda: len(client.guilds))
+metrics.gauge("nano_gateway_latency_seconds", "Average heartbeat latency", fn=lambda: client.latency)
+metrics.gauge("nano_executor_pending", "Queued and running jobs", ("pool", ),
+              fn=lambda: {(name, ): pool["pending"] for name, pool in executor.info().items()})
+metrics.gauge("nano_log_queued", "Log lines waiting to be written", fn=lambda: log_sink.info()["queued"])
 
 
 class PluginObject:
@@ -133,6 +205,21 @@ class Nano(metaclass=Singleton):
         self.plugin_events = {a: [] for a in EVENTS}
         self.event_types = set(self.plugin_events.keys())
 
+        # Command routing
+        # plugin_routes mirrors plugin_events: plugin name if the callback only handles its own commands, else None
+        self.router = CommandRouter()
+        self.plugin_routes = {a: [] for a in EVENTS}
+
+        # Profiling
+        # plugin_sources mirrors plugin_events: name of the plugin every callback belongs to
+        self.profiler = profiler
+        self.startup = startup
+        self.plugin_sources = {a: [] for a in EVENTS}
+
+        # Concurrent dispatch
+        # plugin_timeouts mirrors plugin_events: timeout if the callback is independent, else None
+        self.plugin_timeouts = {a: [] for a in EVENTS}
+
         # Updates the plugin list
         self.update_plugins()
 
@@ -143,8 +230,12 @@ class Nano(metaclass=Singleton):
                         and pl.endswith(".py")]
 
         self._update_plugins(plugin_names)
+        startup.mark_plugins_loaded()
 
         log.info("Plugins loaded in {}s".format(round(time.monotonic() - started, 3)))
+        slowest = ", ".join("{} ({:.0f} ms)".format(name, (import_time + init_time) * 1000)
+                            for name, import_time, init_time in startup.top(5))
+        log.info("Slowest plugins: {}".format(slowest))
 
     def _update_plugins(self, names: list):
         log.info("Loading plugins...")
@@ -157,6 +248,7 @@ class Nano(metaclass=Singleton):
 
         for plug_name in list(names):
             # Import the plugin
+            import_started = time.monotonic()
             try:
                 plugin = importlib.import_module("{}.{}".format(PLUGINS_NAMESPACE, plug_name))
             except ImportError:
@@ -165,6 +257,7 @@ class Nano(metaclass=Singleton):
                 failed.append(plug_name)
 
                 continue
+            import_time = time.monotonic() - import_started
 
             # Plugin loaded, check validity
             # Plugin must have a class NanoPlugin, see examples in plugins/
@@ -180,15 +273,21 @@ class Nano(metaclass=Singleton):
             handler_cls = info.handler
 
             # Make an instance
+            init_started = time.monotonic()
             try:
                 inst = handler_cls(client=client,
                                    loop=loop,
                                    handler=handler,
                                    nano=self,
                                    stats=stats,
-                                   trans=trans)
+                                   trans=trans,
+                                   scheduler=scheduler,
+                                   cluster=cluster,
+                                   executor=executor,
+                                   http=http)
             # A plugin can raise RuntimeError to indicate it doesn't want to be loaded
             except RuntimeError:
+                startup.add_plugin(plug_name, import_time)
                 disabled.append(plug_name)
 
                 del plugin
@@ -201,6 +300,8 @@ class Nano(metaclass=Singleton):
                 del plugin
                 continue
 
+            startup.add_plugin(plug_name, import_time, time.monotonic() - init_started)
+
             self.plugins[plug_name] = PluginObject(plugin, inst)
             loaded.append(plug_name)
 
@@ -216,6 +317,7 @@ class Nano(metaclass=Singleton):
             log.warning("Failed plugins: {}".format(", ".join(failed)))
 
         self._parse_priorities()
+        self._build_router()
 
         asyncio.ensure_future(self.dispatch_event(ON_PLUGINS_LOADED))
 
@@ -263,7 +365,11 @@ class Nano(metaclass=Singleton):
                                handler=handler,
                                nano=self,
                                stats=stats,
-                               trans=trans)
+                               trans=trans,
+                               scheduler=scheduler,
+                               cluster=cluster,
+                               executor=executor,
+                               http=http)
         # A plugin can raise RuntimeError to indicate it doesn't want to be loaded
         except RuntimeError:
             del plugin
@@ -279,6 +385,7 @@ class Nano(metaclass=Singleton):
         self.plugins[name] = PluginObject(plugin, inst)
 
         self._parse_priorities()
+        self._build_router()
 
         # Call ON_PLUGINS_LOADED if the plugin requires it
         if ON_PLUGINS_LOADED in events.keys():
@@ -288,25 +395,57 @@ class Nano(metaclass=Singleton):
         return True
 
     def _parse_priorities(self):
+        """
+        NanoPlugin.events maps event names to either an importance (int) or a dict:
+            {"importance": 9, "independent": True, "timeout": 20}
+
+        Independent handlers don't depend on other handlers of the event and don't return anything,
+        neighbouring ones (by importance) are run at the same time.
+        """
         log.info("Parsing priorities...")
 
         temp = {}
 
-        for p in self.plugins.values():
+        for name, p in self.plugins.items():
             assert isinstance(p, PluginObject)
 
             for ev_name, priority in p.events.items():
                 if not temp.get(ev_name):
                     temp[ev_name] = []
 
-                temp[ev_name].append({"callback": getattr(p.instance, ev_name), "importance": priority})
+                if isinstance(priority, dict):
+                    importance = priority["importance"]
+                    timeout = priority.get("timeout", HANDLER_TIMEOUT) if priority.get("independent") else None
+                else:
+                    importance, timeout = priority, None
+
+                temp[ev_name].append({"callback": getattr(p.instance, ev_name), "importance": importance,
+                                      "route": name if ev_name == ON_MESSAGE and self._is_routed(p) else None,
+                                      "source": name, "timeout": timeout})
 
         # Order callbacks
         for event, unordered in temp.items():
             ordered = sorted(unordered, key=lambda a: a["importance"])
-            ordered = [i["callback"] for i in ordered]
 
-            self.plugin_events[event] = ordered
+            self.plugin_events[event] = [i["callback"] for i in ordered]
+            self.plugin_routes[event] = [i["route"] for i in ordered]
+            self.plugin_sources[event] = [i["source"] for i in ordered]
+            self.plugin_timeouts[event] = [i["timeout"] for i in ordered]
+
+    @staticmethod
+    def _is_routed(plugin: PluginObject) -> bool:
+        # Plugins with a commands dict only receive messages that match one of their commands
+        # NanoPlugin.command_routing = False opts out (for plugins that need to see every message)
+        if not isinstance(getattr(plugin.plugin, "commands", None), dict):
+            return False
+
+        return getattr(plugin.handler, "command_routing", True)
+
+    def _build_router(self):
+        log.info("Building command router...")
+
+        routed = {name: p.plugin.commands for name, p in self.plugins.items() if self._is_routed(p)}
+        self.router = CommandRouter.from_plugins(routed)
 
     def get_plugin(self, name: str) -> dict:
         if name.endswith(".py"):
@@ -326,12 +465,44 @@ class Nano(metaclass=Singleton):
         if not self.plugin_events[event_type]:
             return
 
+        # Resolved lazily: the prefix is only known after the prefix handler adds it to kwargs
+        route = None
+
+        # Consecutive independent callbacks, run together before the next ordered one
+        group = []
+
         # Plugins have already been ordered from most important to least important
-        for cb in self.plugin_events[event_type]:
+        callbacks = zip(self.plugin_events[event_type], self.plugin_routes[event_type],
+                        self.plugin_sources[event_type], self.plugin_timeouts[event_type])
+        for cb, owner, source, timeout in callbacks:
             # log.debug("Executing plugin {}:{}".format(cb.strip(".py"), event_type))
 
-            # Execute the corresponding method in the plugin
-            resp = await cb(*args, **kwargs)
+            # Skip command plugins that don't own the command in this message
+            if owner is not None:
+                if route is None:
+                    route = self.router.match(args[0].content, kwargs.get("prefix"))
+
+                if owner not in route:
+                    continue
+
+                command_counter.inc(plugin=owner, command=route[owner])
+
+            if timeout is not None:
+                group.append((cb, source, timeout))
+                continue
+
+            if group:
+                await self._run_independent(event_type, group, args, kwargs)
+                group = []
+
+            if owner is not None:
+                with command_latency.time(plugin=owner), profiler.measure(event_type, source):
+                    resp = await cb(*args, **kwargs)
+
+            else:
+                # Execute the corresponding method in the plugin
+                with profiler.measure(event_type, source):
+                    resp = await cb(*args, **kwargs)
 
             # COMMUNICATION
             # If data is passed, assign proper variables
@@ -381,6 +552,41 @@ class Nano(metaclass=Singleton):
                         # but it is here as backup as well
                         sys.exit(0)
 
+        if group:
+            await self._run_independent(event_type, group, args, kwargs)
+
+    async def warm_up(self):
+        """
+        Loads lazy plugin resources (core/lazy.py) in the background, after on_ready
+        """
+        self.startup.warm_up.update(await warm_up())
+
+    async def _run_independent(self, event_type, group: list, args: tuple, kwargs: dict):
+        """
+        Runs independent callbacks concurrently, a failing or hanging one doesn't affect the others
+        :param group: list((callback, plugin name, timeout))
+        """
+        async def run(cb, source, timeout):
+            try:
+                with profiler.measure(event_type, source):
+                    await asyncio.wait_for(cb(*args, **kwargs), timeout)
+
+            except asyncio.TimeoutError:
+                log.warning("{}:{} timed out after {} s".format(source, event_type, timeout))
+
+            except Exception:
+                # Reported like errors in ordered callbacks (reporter.py), but without stopping the rest
+                if event_type == ON_ERROR:
+                    log.critical(traceback.format_exc())
+                    return
+
+                try:
+                    await self.dispatch_event(ON_ERROR, event_type, *args, **kwargs)
+                except Exception:
+                    log.critical(traceback.format_exc())
+
+        await asyncio.gather(*[run(*item) for item in group])
+
 
 nano = Nano()
 
@@ -397,6 +603,11 @@ async def on_reaction_add(reaction, user):
     await nano.dispatch_event(ON_REACTION_ADD, reaction, user)
 
 
+@client.event
+async def on_raw_reaction_add(payload):
+    await nano.dispatch_event(ON_RAW_REACTION_ADD, payload)
+
+
 @client.event
 async def on_message_delete(message):
     await nano.dispatch_event(ON_MESSAGE_DELETE, message)
@@ -434,6 +645,7 @@ async def on_member_remove(member):
 
 @client.event
 async def on_member_update(before, after):
+    handler.permissions.member_updated(before, after)
     await nano.dispatch_event(ON_MEMBER_UPDATE, before, after)
 
 
@@ -454,9 +666,27 @@ async def on_guild_join(guild):
 
 @client.event
 async def on_guild_remove(guild):
+    handler.permissions.forget_guild(guild.id)
     await nano.dispatch_event(ON_GUILD_REMOVE, guild)
 
 
+# Roles are only tracked for permission checks (Nano Admin, Nano Mod)
+@client.event
+async def on_guild_role_create(role):
+    handler.permissions.roles_changed(role.guild)
+
+
+@client.event
+async def on_guild_role_delete(role):
+    handler.permissions.roles_changed(role.guild)
+
+
+@client.event
+async def on_guild_role_update(before, after):
+    if before.name != after.name:
+        handler.permissions.roles_changed(after.guild)
+
+
 @client.event
 async def on_error(event, *args, **kwargs):
     await nano.dispatch_event(ON_ERROR, event, *args, **kwargs)
@@ -481,8 +711,21 @@ async def on_ready():
 
     log_to_file("Connected as {} ({})".format(client.user.name, client.user.id))
 
+    cluster.start()
+    await cluster.send_heartbeat()
+
+    stats.start()
+    if metrics_server is not None:
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            log.warning("Could not start the metrics endpoint: {}".format(e))
+
     await nano.dispatch_event(ON_READY)
 
+    startup.mark_ready()
+    loop.create_task(nano.warm_up())
+
 
 async def start():
     if not parser.has_option("Credentials", "token"):
@@ -496,7 +739,22 @@ async def start():
     await client.connect()
 
 
+async def stop():
+    """
+    Graceful shutdown (SIGTERM, sent by the cluster launcher on restarts)
+    """
+    log.critical("Received SIGTERM, shutting down...")
+
+    try:
+        await nano.dispatch_event(ON_SHUTDOWN)
+    finally:
+        await client.close()
+
+
 def main():
+    if os.name != "nt":
+        loop.add_signal_handler(signal.SIGTERM, lambda: loop.create_task(stop()))
+
     try:
         print("Connecting to Discord...", end="")
         loop.run_until_complete(start())
@@ -512,6 +770,23 @@ def main():
         log.critical("Shutting down...")
 
     finally:
+        # Write out pending !stats counts
+        try:
+            stats.flush()
+        except Exception:
+            log.warning("Could not flush stats")
+
+        # Count reaction votes that are still waiting (ON_SHUTDOWN isn't dispatched on every exit)
+        if "voting" in nano.plugins:
+            try:
+                loop.run_until_complete(nano.get_plugin("voting").instance.tally.flush())
+            except Exception:
+                log.warning("Could not count the remaining reaction votes")
+
+        executor.shutdown()
+        loop.run_until_complete(http.close())
+        # Write out queued log lines
+        log_sink.close()
         loop.close()
 
 
@@ -5,10 +5,11 @@ import logging
 import time
 import traceback
 
-from typing import Union
 from discord import utils, Client, Embed, TextChannel, Colour, DiscordException, Object, HTTPException
 
+from core.pagination import Pages, PaginationService
 from core.serverhandler import INVITEFILTER_SETTING, SPAMFILTER_SETTING, WORDFILTER_SETTING
+from core.wordfilter import MODE_WORD, MODE_SUBSTRING
 from core.utils import convert_to_seconds, matches_iterable, is_valid_command, StandardEmoji, \
                        resolve_time, log_to_file, is_disabled, IgnoredException, parse_special_chars, \
                        apply_string_padding, filter_text
@@ -31,7 +32,9 @@ CMD_LIMIT_A = 1000
 SELFROLE_MAX = 35
 PREFIX_MAX = 50
 BLACKLIST_MAX = 35
-TICK_DURATION = 15
+# Custom word filter: words per server and characters per word
+WORDFILTER_MAX = 100
+WORDFILTER_WORD_MAX = 40
 
 # Threshold for when to make a new command page
 NEW_PAGE_BEFORE = 2000 - (CMD_LIMIT_T + CMD_LIMIT_A + 150)
@@ -40,9 +43,8 @@ NEW_PAGE_BEFORE = 2000 - (CMD_LIMIT_T + CMD_LIMIT_A + 150)
 REMINDER_MIN = 15
 # 5 Days
 REMINDER_MAX = 5 * 24 * 60 * 60
-
-# Maximum age (in seconds) of a message that should be kept in cache
-MAX_MSG_AGE = 60 * 3
+# Timer queue name (see core/scheduler.py)
+SOFTBAN_QUEUE = "softban"
 
 # Maximum join/leave/kick/ban message length
 MAX_NOTIF_LENGTH = 800
@@ -84,6 +86,12 @@ commands = {
     "nano.blacklist remove": {"desc": "Removes a channel from command blacklist", "use": "[command] [channel name]"},
     "nano.blacklist list": {"desc": "Shows all blacklisted channels on this server", "use": "[command]"},
 
+    "nano.wordfilter": {"desc": "Words the word filter deletes on this server (on top of the default list). Subcommands:\n`add` `remove` `list` `mode`"},
+    "nano.wordfilter add": {"desc": "Adds words to the server's word filter.", "use": "[command] word, word, ..."},
+    "nano.wordfilter remove": {"desc": "Removes words from the server's word filter.", "use": "[command] word, word, ..."},
+    "nano.wordfilter list": {"desc": "Shows the server's filtered words.", "use": "[command]"},
+    "nano.wordfilter mode": {"desc": "How the server's own words are matched: `word` only matches whole words, `substring` also matches them inside other words.", "use": "[command] word/substring"},
+
     "nano.settings": {"desc": "Sets server settings like word, spam, invite filtering, log channel and selfrole.\nPossible setting keyords: `wordfilter`, `spamfilter`, `invitefilter`, `logchannel`, `selfrole`, `defaultchannel`", "use": "[command] [setting] True/False/Something else"},
     "nano.settings wordfilter": {"desc": "Turns the swearing filter on or off.", "use": "[command] True/False"},
     "nano.settings spamfilter": {"desc": "Turns the spam filter on or off. (please note, this is only a gibberish filter)", "use": "[command] True/False"},
@@ -123,9 +131,18 @@ ignore_commands = [
 
 
 class RedisSoftBanScheduler:
-    def __init__(self, client, handler, loop=asyncio.get_event_loop()):
+    """
+    Data type: Hash
+
+    softban:<GUILD_ID> => user id: unix epoch time of the unban
+
+    Due times are kept in the "softban" timer queue as <GUILD_ID>:<USER_ID>
+    """
+    def __init__(self, client, handler, scheduler, cluster, loop=asyncio.get_event_loop()):
         self.client = client
         self.loop = loop
+        self.scheduler = scheduler
+        self.cluster = cluster
         self.redis = handler.get_plugin_data_manager(namespace="softban")
 
     def get_guild_bans(self, guild_id) -> dict:
@@ -148,264 +165,41 @@ class RedisSoftBanScheduler:
         if not (REMINDER_MIN <= tim <= REMINDER_MAX):
             return False
 
-        return self.redis.hset(guild.id, user.id, int(t + tim))
+        resp = self.redis.hset(guild.id, user.id, int(t + tim))
+        self.scheduler.schedule(SOFTBAN_QUEUE, "{}:{}".format(guild.id, user.id), int(t + tim))
 
-    @staticmethod
-    async def tick(last_time):
-        """
-        Very simple implementation of a self-correcting tick system
-        :return: epoch time
-        """
-        delta = TICK_DURATION - (time.time() - last_time)
-
-        # If previous loop took more than TICK_DURATION, do one right away
-        if delta <= 0:
-            return time.time()
-
-        await asyncio.sleep(delta)
-        return time.time()
+        return resp
 
     async def dispatch(self, guild_id: int, user_id: int):
         try:
             logger.debug("Dispatching")
 
             guild = self.client.get_guild(guild_id)
+            if guild is None:
+                logger.warning("Softban of {} not lifted: guild {} is gone".format(user_id, guild_id))
+                return
+
             await guild.unban(Object(id=user_id))
         except DiscordException as e:
             logger.warning(e)
 
-    async def start_monitoring(self):
-        await self.client.wait_until_ready()
-        await asyncio.sleep(1)
-
-        last_time = time.time()
-
-        while True:
-            # Iterate through users and their reminders
-            for guild_id, ban in self.get_all_bans().items():
-                # If time is up, unban the user
-                for user, tm in ban.items():
-                    if int(tm) <= last_time:
-                        guild_id = int(guild_id)
-                        user_id = int(user)
+    async def owns(self, job_id: str) -> bool:
+        # Only the cluster with the guild can unban
+        return self.cluster.owns_guild(int(job_id.split(":")[0]))
 
-                        await self.dispatch(guild_id, user_id)
-                        self.redis.hdel(guild_id, user_id)
-
-            # And tick.
-            last_time = await self.tick(last_time)
-
-
-class MessageTracker:
-    __slots__ = (
-        "msgs", "timestamps", "max_age"
-    )
-
-    def __init__(self, max_active_age=MAX_MSG_AGE):
-        self.msgs = {}
-        self.timestamps = {}
-
-        self.max_age = max_active_age
-
-    def is_active(self, message_id):
-        return self.timestamps.get(message_id, False)
-
-    def set_message_data(self, msg_id, data, renew_timestamp=False):
-        # Update timestamp
-        if (msg_id not in self.msgs.keys()) or renew_timestamp:
-            self.timestamps[msg_id] = time.time()
-
-        # Set data
-        self.msgs[msg_id] = data
-
-    def get_message_data(self, msg_id) -> Union[None, dict]:
-        if not self.is_active(msg_id):
-            return None
-
-        return self.msgs.get(msg_id)
-
-    @staticmethod
-    async def tick(last_time):
-        """
-        Very simple implementation of a self-correcting tick system
-        :return: None
-        """
-        current_time = time.time()
-        delta = TICK_DURATION - (current_time - last_time)
+    async def fire(self, job_id: str):
+        guild_id, user_id = [int(a) for a in job_id.split(":")]
 
-        # If previous loop took more than TICK_DURATION, do one right away
-        if delta <= 0:
-            return time.time()
+        await self.dispatch(guild_id, user_id)
+        self.redis.hdel(guild_id, user_id)
 
-        await asyncio.sleep(delta)
+    def start(self):
+        # Softbans set before the timer queue existed need to be scheduled once
+        for guild_id, bans in self.get_all_bans().items():
+            for user_id, tm in bans.items():
+                self.scheduler.schedule(SOFTBAN_QUEUE, "{}:{}".format(guild_id, user_id), int(tm), only_new=True)
 
-        return time.time()
-
-    async def start_monitoring(self):
-        last_time = time.time()
-
-        while True:
-            # Iterate through users and their reminders
-            for msg_id, ts in self.timestamps.copy().items():
-                # If message is too old, remove it
-                if (last_time - ts) > self.max_age:
-                    del self.msgs[msg_id]
-                    del self.timestamps[msg_id]
-
-            # And tick.
-            last_time = await self.tick(last_time)
-
-
-def make_pages_from_dict(item_dict: dict):
-    """
-    Makes pages out of a custom command list
-    :param item_dict: dictionary containing custom commands
-    :return: tuple -> dict(page_index:[lines], etc...), total_pages
-    """
-    cmd_list = {0: []}
-    c_page = 0
-
-    for trigger, value in item_dict.items():
-        fm = "{} : {}".format(trigger, value)
-
-        # Creates a new page index if this command is the first one in the new page
-        if not cmd_list.get(c_page):
-            cmd_list[c_page] = []
-
-        # Shifts the page counter if page is too long
-        if (sum([len(a) for a in cmd_list[c_page]]) + len(fm)) > NEW_PAGE_BEFORE:
-            c_page += 1
-            cmd_list[c_page] = []
-
-        cmd_list[c_page].append(fm)
-
-    # dict(page_index:[lines], etc...), total_pages
-    return cmd_list, c_page
-
-
-def make_pages_from_list(item_list: list):
-    """
-    Makes pages out of a mute list
-    :param item_list: list containing mutes
-    :return: tuple -> dict(page_index:[lines], etc...), total_pages
-    """
-    cmd_list = {0: []}
-    c_page = 0
-
-    for item in item_list:
-        # Creates a new page index if this command is the first one in the new page
-        if not cmd_list.get(c_page):
-            cmd_list[c_page] = []
-
-        # Shifts the page counter if page is too long
-        if sum([len(a) for a in cmd_list[c_page]]) > NEW_PAGE_BEFORE:
-            c_page += 1
-            cmd_list[c_page] = []
-
-        cmd_list[c_page].append("➤ " + str(item))
-
-    # dict(page_index:[lines], etc...), total_pages
-    return cmd_list, c_page
-
-
-class ObjectListReactions:
-    __slots__ = (
-        "client", "handler", "trans", "track"
-    )
-
-    # Emojis to react with
-    UP = "\U00002B06"
-    DOWN = "\U00002B07"
-
-    def __init__(self, client, handler, trans):
-        self.client = client
-        self.handler = handler
-        self.trans = trans
-
-        self.track = MessageTracker()
-
-    async def new_message(self, message, page, object_map, trans_string):
-        # Ignore if there is only one page
-        if len(object_map.keys()) == 1:
-            return
-
-        # Adds reactions for navigation
-        await message.add_reaction(ObjectListReactions.UP)
-        await message.add_reaction(ObjectListReactions.DOWN)
-
-        # Caches data into MessageTracker
-        data = {
-            "page": int(page),
-            "serv_id": message.guild.id,
-            "objs": object_map,
-            "trans_string": trans_string
-        }
-
-        self.track.set_message_data(message.id, data)
-
-    async def handle_reaction(self, reaction, user, **_):
-        # Ignore reactions from self
-        if user.id == self.client.user.id:
-            return
-
-        msg = reaction.message
-
-        # Get and verify data existence
-        data = self.track.get_message_data(msg.id)
-        if not data:
-            return
-
-        c_page = data.get("page")
-        page_amount = len(data.get("objs").keys())
-
-        # Default to down, even though it should always change
-        # True - up
-        # False - down
-        up_down = None
-        for react in msg.reactions:
-
-            if react.count > 1:
-                if react.emoji == ObjectListReactions.UP:
-                    up_down = True
-                    break
-                elif react.emoji == ObjectListReactions.DOWN:
-                    up_down = False
-                    break
-
-        # This will not get set if a custom/some other emoji was added
-        if up_down is None:
-            return
-
-        # True - goes up one page
-        if up_down:
-            # Can't go higher
-            if c_page <= 0:
-                return
-
-            page = data.get("objs").get(c_page - 1)
-            c_page -= 1
-
-        # False - goes down one page
-        else:
-            # Can't go lower
-            if c_page + 1 >= page_amount:
-                return
-
-            page = data.get("objs").get(c_page + 1)
-            c_page += 1
-
-        # Reset reactions and edit message
-        await msg.clear_reactions()
-
-        new_msg = data.get("trans_string").format(c_page + 1, page_amount, "\n".join(page))
-        await msg.edit(content=new_msg)
-
-        await msg.add_reaction(ObjectListReactions.UP)
-        await msg.add_reaction(ObjectListReactions.DOWN)
-
-        # Updates the page counter
-        data["page"] = c_page
-        self.track.set_message_data(msg.id, data)
+        self.scheduler.register(SOFTBAN_QUEUE, self.fire, owner=self.owns)
 
 
 class Admin:
@@ -417,14 +211,16 @@ class Admin:
         self.trans = kwargs.get("trans")
         self.nano = kwargs.get("nano")
 
-        self.timer = RedisSoftBanScheduler(self.client, self.handler, self.loop)
-        self.loop.create_task(self.timer.start_monitoring())
+        self.timer = RedisSoftBanScheduler(self.client, self.handler, kwargs.get("scheduler"), kwargs.get("cluster"),
+                                           self.loop)
+        self.timer.start()
 
-        self.list = ObjectListReactions(self.client, self.handler, self.trans)
-        self.loop.create_task(self.list.track.start_monitoring())
+        self.pages = PaginationService(self.client, self.handler)
 
         self.default_channel = None
         self.handle_log_channel = None
+        # Moderator plugin instance (custom word lists), None if it isn't loaded
+        self.moderator = None
 
         self.modp = self.handler.get_plugin_data_manager("moderation")
 
@@ -432,6 +228,9 @@ class Admin:
         self.default_channel = self.nano.get_plugin("server").instance.default_channel
         self.handle_log_channel = self.nano.get_plugin("server").instance.handle_log_channel
 
+        moderator = self.nano.plugins.get("moderator")
+        self.moderator = moderator.instance if moderator else None
+
     async def resolve_role(self, name, message, lang, no_error=False):
         if len(message.role_mentions) > 0:
             return message.role_mentions[0]
@@ -697,17 +496,14 @@ class Admin:
                     await message.channel.send(trans.get("MSG_SELFROLE_NONE", lang))
                     return
 
-                r_list, r_page = make_pages_from_list(roles)
+                pages = Pages(roles, "➤ {}", NEW_PAGE_BEFORE)
 
                 # If user wants a page that doesn't exist
-                if page > r_page:
-                    await message.channel.send(trans.get("MSG_SELFROLE_NO_PAGE", lang).format(r_page + 1))
+                if page >= len(pages):
+                    await message.channel.send(trans.get("MSG_SELFROLE_NO_PAGE", lang).format(len(pages)))
                     return
 
-                msg = trans.get("MSG_SELFROLE_LIST", lang).format(page + 1, r_page + 1, "\n".join(r_list[page]))
-                msg_list = await message.channel.send(msg)
-
-                await self.list.new_message(msg_list, page, r_list, trans.get("MSG_SELFROLE_LIST", lang))
+                await self.pages.send(message.channel, trans.get("MSG_SELFROLE_LIST", lang), pages, page)
 
             else:
                 # If a list is not requested, proceed like normal selfrole
@@ -970,7 +766,7 @@ class Admin:
             page = message.content[len(prefix + "mute list "):].strip(" ")
             if page:
                 try:
-                    page -= 1
+                    page = max(int(page) - 1, 0)
                 except ValueError:
                     await message.channel.send(trans.get("ERROR_INVALID_CMD_ARGUMENTS", lang))
                     return
@@ -979,18 +775,10 @@ class Admin:
 
             if mutes:
                 # Verifies the presence of users
-                muted_ppl = []
-                for u_id in mutes:
-                    usr = utils.find(lambda b: b.id == u_id, message.guild.members)
-                    if usr:
-                        muted_ppl.append(usr.name)
-
-                mute_list, m_page = make_pages_from_list(muted_ppl)
+                muted_ppl = (message.guild.get_member(int(u_id)) for u_id in mutes)
+                pages = Pages((member.name for member in muted_ppl if member), "➤ {}", NEW_PAGE_BEFORE)
 
-                final = trans.get("MSG_MUTE_LIST", lang).format(page + 1, m_page + 1, "\n".join(mute_list[page]))
-
-                msg = await message.channel.send(final)
-                await self.list.new_message(msg, page, mute_list, trans.get("MSG_MUTE_LIST", lang))
+                await self.pages.send(message.channel, trans.get("MSG_MUTE_LIST", lang), pages, min(page, len(pages) - 1))
 
             else:
                 await message.channel.send(trans.get("MSG_MUTE_NONE", lang))
@@ -1380,18 +1168,16 @@ class Admin:
                 await message.channel.send(trans.get("MSG_CMD_NO_CUSTOM", lang).format(prefix))
                 return
 
-            cmd_list, c_page = make_pages_from_dict(custom_cmds)
+            # Only the requested page gets formatted
+            pages = Pages(custom_cmds.items(), "{} : {}", NEW_PAGE_BEFORE)
 
             # If user requests a page that does not exist
-            if page > c_page:
-                await message.channel.send(trans.get("MSG_CMD_LIST_NO_PAGE", lang).format(c_page + 1))
+            if page >= len(pages):
+                await message.channel.send(trans.get("MSG_CMD_LIST_NO_PAGE", lang).format(len(pages)))
                 return
 
-            final = trans.get("MSG_CMD_LIST", lang).format(page + 1, c_page + 1, "\n".join(cmd_list[page]))
-
-            # Mark for reaction monitoring
-            msg_list = await message.channel.send(final)
-            await self.list.new_message(msg_list, page, cmd_list, trans.get("MSG_CMD_LIST", lang))
+            # Arrow reactions flip through the pages
+            await self.pages.send(message.channel, trans.get("MSG_CMD_LIST", lang), pages, page)
 
         # !cmd status
         elif startswith(prefix + "cmd status"):
@@ -1707,13 +1493,85 @@ class Admin:
                     if not channel:
                         self.handler.remove_channel_blacklist(message.guild.id, ch_id)
                     else:
-                        names.append("`{}`".format(channel.name))
+                        names.append(channel.name)
 
                 if not names:
                     await message.channel.send(trans.get("MSG_BLACKLIST_NONE", lang))
                     return
 
-                await message.channel.send(trans.get("MSG_BLACKLIST_LIST", lang).format(" ".join(names)))
+                pages = Pages(names, "`{}`", NEW_PAGE_BEFORE, separator=" ")
+                if len(pages) == 1:
+                    await message.channel.send(trans.get("MSG_BLACKLIST_LIST", lang).format(pages.render(0)))
+                else:
+                    await self.pages.send(message.channel, trans.get("MSG_BLACKLIST_LIST_PAGES", lang), pages)
+
+        # nano.wordfilter
+        elif startswith("nano.wordfilter"):
+            if self.moderator is None:
+                await message.channel.send(trans.get("MSG_WORDFILTER_UNAVAILABLE", lang))
+                return
+
+            setting, _, arg = message.content[len("nano.wordfilter "):].strip(" ").partition(" ")
+            words = {word.strip(" ").lower() for word in arg.split(",") if word.strip(" ")}
+
+            # nano.wordfilter add
+            if setting == "add":
+                if not words:
+                    await message.channel.send(trans.get("MSG_WORDFILTER_NO_WORDS", lang))
+                    return
+
+                if any(len(word) > WORDFILTER_WORD_MAX for word in words):
+                    await message.channel.send(trans.get("MSG_WORDFILTER_TOO_LONG", lang).format(WORDFILTER_WORD_MAX))
+                    return
+
+                current = await self.moderator.get_guild_words(message.guild.id)
+                if len(current | words) > WORDFILTER_MAX:
+                    await message.channel.send(trans.get("MSG_WORDFILTER_TOO_MANY", lang).format(WORDFILTER_MAX))
+                    return
+
+                added = await self.moderator.add_guild_words(message.guild.id, words)
+                await message.channel.send(trans.get("MSG_WORDFILTER_ADDED", lang).format(added))
+
+            # nano.wordfilter remove
+            elif setting == "remove":
+                if not words:
+                    await message.channel.send(trans.get("MSG_WORDFILTER_NO_WORDS", lang))
+                    return
+
+                removed = await self.moderator.remove_guild_words(message.guild.id, words)
+                if not removed:
+                    await message.channel.send(trans.get("MSG_WORDFILTER_NOT_PRESENT", lang))
+                    return
+
+                await message.channel.send(trans.get("MSG_WORDFILTER_REMOVED", lang).format(removed))
+
+            # nano.wordfilter list
+            elif setting == "list":
+                current = await self.moderator.get_guild_words(message.guild.id)
+                if not current:
+                    await message.channel.send(trans.get("MSG_WORDFILTER_NONE", lang))
+                    return
+
+                pages = Pages((filter_text(word) for word in sorted(current)), "`{}`", NEW_PAGE_BEFORE, separator=" ")
+                if len(pages) == 1:
+                    await message.channel.send(trans.get("MSG_WORDFILTER_LIST", lang).format(pages.render(0)))
+                else:
+                    await self.pages.send(message.channel, trans.get("MSG_WORDFILTER_LIST_PAGES", lang), pages)
+
+            # nano.wordfilter mode
+            elif setting == "mode":
+                mode = arg.strip(" ").lower()
+
+                if mode not in (MODE_WORD, MODE_SUBSTRING):
+                    current = await self.moderator.get_filter_mode(message.guild.id)
+                    await message.channel.send(trans.get("MSG_WORDFILTER_MODE_USAGE", lang).format(current))
+                    return
+
+                await self.moderator.set_filter_mode(message.guild.id, mode)
+                await message.channel.send(trans.get("MSG_WORDFILTER_MODE_SET", lang).format(mode))
+
+            else:
+                await message.channel.send(trans.get("MSG_WORDFILTER_USAGE", lang).format(prefix))
 
         # nano.serverreset
         elif startswith("nano.serverreset"):
@@ -1799,7 +1657,7 @@ class Admin:
             # User confirmed the action
             else:
                 if ch1.content.lower().strip(" ") == YES_L:
-                    handler.server_setup(message.guild)
+                    await handler.server_setup(message.guild)
 
                     # Edit message to confirm action
                     edit = msg_one + "\n\n " + DONE_EXPR
@@ -2070,19 +1928,19 @@ class Admin:
         if self.timer.is_guild_ban(member.guild.id, member.id):
             return "return"
 
-    async def on_reaction_add(self, reaction, user, **kwargs):
-        await self.list.handle_reaction(reaction, user, **kwargs)
+    async def on_raw_reaction_add(self, payload, **kwargs):
+        await self.pages.handle_reaction(payload, **kwargs)
 
 
 class NanoPlugin:
     name = "Admin Commands"
-    version = "33"
+    version = "39"
 
     handler = Admin
     events = {
         "on_message": 10,
         "on_member_remove": 4,
-        "on_reaction_add": 10,
+        "on_raw_reaction_add": {"importance": 10, "independent": True},
         "on_plugins_loaded": 5,
         # type : importance
     }
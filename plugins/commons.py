@@ -1,15 +1,14 @@
 # coding=utf-8
 import logging
-import sys
 import time
-import re
 from datetime import timedelta, datetime
 from random import randint
 
 from discord import Embed, Forbidden, utils
 
 from core.stats import MESSAGE, PING
-from core.utils import is_valid_command, add_dots, DynamicResponse, CmdResponseTypes, IgnoredException, filter_text
+from core.template import render_command
+from core.utils import is_valid_command, add_dots, filter_text, IgnoredException
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -76,184 +75,6 @@ commands = {
 valid_commands = commands.keys()
 
 
-# Utility for non-failable get operator
-def l_get(lst, index, fallback=None):
-    return lst[index] if len(lst) > index else fallback
-
-
-class Parser:
-    __slots__ = ("pt", )
-
-    def __init__(self):
-        # Used to capture parsing groups
-        self.pt = re.compile(r"({.+?})")
-
-    def _split_groups(self, text):
-        text_list = []
-
-        # Splits the text on every group in the match
-        c_ind = 0
-        gr = self.pt.finditer(text)
-        for m in gr:
-            st = m.start()
-            en = m.end()
-
-            text_list.append(text[c_ind:st])
-            text_list.append(text[st:en])
-            # Set last char index
-            c_ind = en
-
-        # Append the last group
-        last = text[c_ind:len(text)]
-        text_list.append(last)
-
-        return text_list
-
-    @staticmethod
-    def _parse_group(group, ctx):
-        name, *tokens = group.split("|")
-        if len(tokens) != 0:
-            first, *tokens = tokens
-        else:
-            first = None
-
-        # Actually gets the result
-        # whole system in this function because of performance
-
-        # 1. Author stuff
-        if name == "author":
-            if first == "name":
-                return ctx.author.display_name
-            if first == "id":
-                return ctx.author.id
-            if first == "mention":
-                return ctx.author.mention
-            if first == "discrim":
-                return ctx.author.discriminator
-            if first == "avatar":
-                return ctx.author.avatar_url or ctx.author.default_avatar_url
-            else:
-                return ctx.author.name
-
-        # 2. Mention stuff
-        elif name == "mentions":
-            # first == index
-            try:
-                typ = tokens[0]
-            except IndexError:
-                typ = None
-
-            if first:
-                first = int(first)
-            else:
-                first = 0
-
-            try:
-                if typ == "name":
-                    return ctx.mentions[first].display_name
-                if typ == "id":
-                    return ctx.mentions[first].id
-                if typ == "mention":
-                    return ctx.mentions[first].mention
-                if typ == "discrim":
-                    return ctx.mentions[first].discriminator
-                if typ == "avatar":
-                    return ctx.mentions[first].avatar_url or ctx.mentions[first].default_avatar_url
-                else:
-                    return ctx.mentions[first].name
-            except IndexError:
-                raise IndexError("No such mention") from None
-
-        # 3. Random numbers
-        elif name == "rnd":
-            # from is first
-            # to is the second item (index 1)
-            to = l_get(tokens, 0)
-            first = first or 1
-
-            # Two arguments
-            if to:
-                # Assumes both arguments can be ints
-                return randint(int(first), int(to))
-            # Only one
-            else:
-                # Assumes argument is int
-                return randint(0, int(first))
-
-        elif name == "time":
-            # https://docs.python.org/3/library/datetime.html#strftime-strptime-behavior
-            first = first or "format"
-
-            if first == "raw":
-                return time.time()
-            elif first == "now":
-                return datetime.now().strftime("%H:%M %d. of %B, %Y")
-            elif first == "format":
-                return datetime.now().strftime(tokens[0])
-            else:
-                # Defaults to epoch time
-                return time.time()
-
-        elif name == "choose":
-            items = (first, *tokens)
-            chnum = randint(0, len(items) - 1)
-
-            return items[chnum]
-
-        # 4. Failure fallback
-        elif name == "onfail":
-            # onfail|<message> - returns your custom text
-            # onfail|raw - returns the raw exception
-            if first == "raw":
-                return DynamicResponse.register_failure_response(lambda: "Error: " + str(sys.exc_info()[1]))
-            else:
-                return DynamicResponse.register_failure_response(first)
-
-    @staticmethod
-    def _handle_onfail(on_fail):
-        if callable(on_fail):
-            return on_fail()
-        else:
-            return on_fail
-
-    def parse(self, text, ctx):
-        # Ignore stuff that isn't a dynamic command
-        if "{" not in text or "}" not in text:
-            return text
-
-        ls = self._split_groups(text)
-        responses = []
-
-        on_fail = None
-
-        for ind, t in enumerate(ls):
-            if t and (t[0] == "{") and (t[-1] == "}"):
-                # valid group, parse
-                # Cut out { and }
-                try:
-                    result = self._parse_group(t[1:-1], ctx)
-                except Exception:
-                    if on_fail is not None:
-                        return self._handle_onfail(on_fail)
-
-                    raise IgnoredException
-
-                if type(result) is DynamicResponse:
-                    # Special cases (for example: {onfail|text}
-                    if result.intention == CmdResponseTypes.REGISTER_ON_FAIL:
-                        on_fail = result.data
-
-                    # Don't add that class' repr to the list
-                    continue
-
-                responses.append(str(result))
-            # Not a group, just append it to responses
-            else:
-                responses.append(t)
-
-        return "".join(responses)
-
-
 class Commons:
     def __init__(self, **kwargs):
         self.client = kwargs.get("client")
@@ -267,7 +88,6 @@ class Commons:
         self.getter = None
         self.resolve_user = None
 
-        self.parser = Parser()
 
     async def on_plugins_loaded(self):
         self.getter = self.nano.get_plugin("server").instance
@@ -301,21 +121,18 @@ class Commons:
         lang = kwargs.get("lang")
 
         # Custom commands registered for the server
-        server_commands = self.handler.get_custom_commands_keys(message.guild.id)
+        # (in-memory index, redis is only hit when the guild's commands are first loaded or changed)
+        response = await self.handler.aio.match_custom_command(message.guild.id, message.content)
 
-        if server_commands:
-            # According to tests, .startswith is faster than slicing, m8pls
-            for k in server_commands:
-                k = str(k)
-
-                if message.content.startswith(k):
-                    # raw_resp = self.handler.get_custom_command_by_key(message.guild.id, k)
-                    # response = self.parser.parse(raw_resp, message)
-                    response = self.handler.get_custom_command_by_key(message.guild.id, k)
-
-                    await message.channel.send(response)
-                    return
+        if response is not None:
+            try:
+                content = render_command(str(response), message)
+            except IgnoredException:
+                # A placeholder failed (e.g. {mentions} without a mention) and there is no {onfail}: sent as written
+                content = str(response)
 
+            await message.channel.send(content)
+            return
 
         # Check if this is a valid command
         if not is_valid_command(message.content, commands, prefix):
@@ -553,12 +370,14 @@ class Commons:
 
 class NanoPlugin:
     name = "Common Commands"
-    version = "26"
+    version = "28"
 
     handler = Commons
+    # Custom commands are checked on every message
+    command_routing = False
     events = {
         "on_message": 10,
-        "on_reaction_add": 10,
+        "on_reaction_add": {"importance": 10, "independent": True},
         "on_plugins_loaded": 5,
         # type : importance
     }
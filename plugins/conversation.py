@@ -7,6 +7,30 @@ from fuzzywuzzy import fuzz, process
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
+# Translation keys of questions, matched with fuzzy matching
+QUESTIONS = [
+    "CONV_Q_HOW", "CONV_Q_SNOW", "CONV_Q_SLEEP", "CONV_Q_AYY", "CONV_Q_RIP", "CONV_Q_MASTER",
+    "INFO_HELP", "CONV_Q_LOVE", "CONV_Q_HELLO", "CONV_Q_BIRTH", "CONV_Q_MAKER",
+]
+
+
+def matches(query: str, possibilities: list) -> bool:
+    highest, score = process.extractOne(query, possibilities, scorer=fuzz.token_set_ratio)
+
+    if score > 80:
+        return True
+    else:
+        return False
+
+
+def match_questions(query: str, questions: dict) -> set:
+    """
+    Runs in the CPU executor (see core/executor.py): all questions are matched in one go
+    :param questions: dict(key: possibilities)
+    :return: set of matching keys
+    """
+    return set(key for key, possibilities in questions.items() if possibilities and matches(query, possibilities))
+
 
 class Conversation:
     def __init__(self, *_, **kwargs):
@@ -15,20 +39,12 @@ class Conversation:
         self.nano = kwargs.get("nano")
         self.trans = kwargs.get("trans")
         self.loop = kwargs.get("loop")
+        self.executor = kwargs.get("executor")
 
 
     def _safe_get(self, lang, lst):
         return self.trans.get(lst, lang) or []
 
-    @staticmethod
-    def matches(query: str, possibilities: list):
-        highest, score = process.extractOne(query, possibilities, scorer=fuzz.token_set_ratio)
-
-        if score > 80:
-            return True
-        else:
-            return False
-
     async def on_message(self, message, **kwargs):
         prefix = kwargs.get("prefix")
 
@@ -55,11 +71,17 @@ class Conversation:
         # If it is just a raw mention, send the help message
         if extracted == "":
             await message.channel.send(trans.get("MSG_HELP", lang).format(prefix=prefix))
+            return
 
         elif has(trans.get("INFO_PREFIX_LITERAL", lang)):
             await message.channel.send(trans.get("INFO_PREFIX", lang).format(prefix))
+            return
+
+        # Fuzzy matching is CPU-heavy, do it off the event loop
+        questions = {key: self._safe_get(lang, key) for key in QUESTIONS}
+        matched = await self.executor.run_cpu(match_questions, extracted, questions)
 
-        elif self.matches(extracted, trans.get("CONV_Q_HOW", lang)):
+        if "CONV_Q_HOW" in matched:
             lst = trans.get("CONV_MOOD_LIST", lang)
 
             # Choose random reply
@@ -67,40 +89,40 @@ class Conversation:
 
             await reply(str(lst[rn]))
 
-        elif self.matches(extracted, trans.get("CONV_Q_SNOW", lang)):
+        elif "CONV_Q_SNOW" in matched:
             await reply(trans.get("CONV_SNOW", lang))
 
         elif has(trans.get("CONV_Q_DIE", lang)):
             await reply(trans.get("CONV_NAH", lang))
 
-        elif self.matches(extracted, trans.get("CONV_Q_SLEEP", lang)):
+        elif "CONV_Q_SLEEP" in matched:
             await reply(trans.get("CONV_NOPE", lang))
 
-        elif self.matches(extracted, trans.get("CONV_Q_AYY", lang)):
+        elif "CONV_Q_AYY" in matched:
             await reply(trans.get("CONV_AYYLMAO", lang))
 
-        elif self.matches(extracted, trans.get("CONV_Q_RIP", lang)):
+        elif "CONV_Q_RIP" in matched:
             await reply(trans.get("CONV_RIP", lang))
 
-        elif self.matches(extracted, trans.get("CONV_Q_MASTER", lang)):
+        elif "CONV_Q_MASTER" in matched:
             await reply(trans.get("CONV_MASTER", lang))
 
         elif has(trans.get("CONV_Q_WHAT", lang)):
             await reply(trans.get("CONV_SPARTA", lang))
 
-        elif self.matches(extracted, trans.get("INFO_HELP", lang)):
+        elif "INFO_HELP" in matched:
             await reply(trans.get("MSG_HELP", lang).format(prefix=prefix))
 
-        elif self.matches(extracted, trans.get("CONV_Q_LOVE", lang)):
+        elif "CONV_Q_LOVE" in matched:
             await reply(trans.get("CONV_LOVE", lang))
 
-        elif self.matches(extracted, trans.get("CONV_Q_HELLO", lang)):
+        elif "CONV_Q_HELLO" in matched:
             await reply(trans.get("CONV_HI", lang))
 
-        elif self.matches(extracted, trans.get("CONV_Q_BIRTH", lang)):
+        elif "CONV_Q_BIRTH" in matched:
             await reply(trans.get("CONV_BEGINDATE", lang))
 
-        elif self.matches(extracted, trans.get("CONV_Q_MAKER", lang)):
+        elif "CONV_Q_MAKER" in matched:
             await reply(trans.get("CONV_OWNER", lang))
 
 
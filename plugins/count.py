@@ -2,7 +2,6 @@
 import configparser
 import json
 import logging
-import aiohttp
 
 from core.confparser import get_config_parser
 
@@ -16,6 +15,7 @@ class GuildCounter:
     def __init__(self, **kwargs):
         self.client = kwargs.get("client")
         self.loop = kwargs.get("loop")
+        self.http = kwargs.get("http")
 
         try:
             self.botspw_token = parser.get("discord.bots.gg", "token")
@@ -24,14 +24,6 @@ class GuildCounter:
             log.critical("Missing api key(s), disabling plugin...")
             raise RuntimeError
 
-        self.session = None
-
-    async def handle_session(self) -> aiohttp.ClientSession:
-        if not self.session:
-            self.session = aiohttp.ClientSession(loop=self.loop)
-
-        return self.session
-
     async def on_guild_join(self, guild, **_):
         srv_amount = len(self.client.guilds)
 
@@ -49,10 +41,8 @@ class GuildCounter:
         return a and b
 
     async def _send(self, url, payload, headers):
-        session = await self.handle_session()
-
-        async with session.post(url, data=json.dumps(payload), headers=headers) as resp:
-            status_code = resp.status
+        resp = await self.http.post(url, data=json.dumps(payload), headers=headers)
+        status_code = resp.status
 
         log.info("Sent server count to {} with status code {}".format(url, status_code))
 
@@ -91,9 +81,10 @@ class GuildCounter:
 
 class NanoPlugin:
     name = "Server count updater"
-    version = "11"
+    version = "13"
 
     handler = GuildCounter
     events = {
-        "on_guild_join": 9
+        # Posting to the bot lists can take a while, nothing depends on it
+        "on_guild_join": {"importance": 9, "independent": True},
     }
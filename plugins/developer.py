@@ -4,11 +4,14 @@ import os
 import subprocess
 from asyncio import sleep
 from datetime import datetime
+from io import BytesIO
 from random import shuffle
 from shutil import copy2
 
-from discord import Game, utils, Embed, Colour, DiscordException
+from discord import Game, utils, Embed, Colour, DiscordException, File
 
+from core.cluster import LAUNCHER_RESTART, LAUNCHER_SHUTDOWN
+from core.profiling import MAX_PROFILE_SECONDS
 from core.stats import MESSAGE
 from core.utils import is_valid_command, log_to_file, StandardEmoji, resolve_time
 from core.confparser import get_settings_parser, BACKUP_DIR, DATA_DIR
@@ -161,6 +164,14 @@ class DevFeatures:
         self.stats = kwargs.get("stats")
         self.loop = kwargs.get("loop")
         self.trans = kwargs.get("trans")
+        self.cluster = kwargs.get("cluster")
+
+        # Commands that have to run on every cluster
+        self.cluster.register("plugin.reload", self._cluster_plugin_reload)
+        self.cluster.register("translations.reload", self._cluster_translations_reload)
+        self.cluster.register("playing", self._cluster_playing)
+        self.cluster.register("guild.leave", self._cluster_guild_leave)
+        self.cluster.register("announce", self._cluster_announce)
 
         self.backup = BackupManager()
         self.roller = StatusRoller(self.client)
@@ -172,6 +183,31 @@ class DevFeatures:
     async def on_plugins_loaded(self):
         self.default_channel = self.nano.get_plugin("server").instance.default_channel
 
+    # Cluster commands
+    async def _cluster_plugin_reload(self, _, name):
+        await self.nano.reload_plugin(name)
+
+    async def _cluster_translations_reload(self, _):
+        self.trans.reload_translations()
+
+    async def _cluster_playing(self, _, status):
+        await self.client.change_presence(activity=Game(name=str(status)))
+
+    async def _cluster_guild_leave(self, _, guild_id):
+        guild = self.client.get_guild(guild_id)
+        if guild:
+            await guild.leave()
+            log_to_file("Left {}".format(guild_id))
+
+    async def _cluster_announce(self, _, content):
+        for g in self.client.guilds:
+            try:
+                d_chan = await self.default_channel(g)
+                await d_chan.send(content)
+                log_to_file("Sent announcement for {}".format(g.name))
+            except DiscordException:
+                log_to_file("Couldn't send announcement for {}".format(g.name))
+
     async def on_message(self, message, **kwargs):
         client = self.client
 
@@ -237,9 +273,9 @@ class DevFeatures:
                 await message.channel.send("Not a number.")
                 return
 
-            srv = await self.client.get_guild(sid)
-            await srv.leave()
-            await message.channel.send("Left {}".format(srv.id))
+            # The guild can be on any cluster
+            await self.cluster.broadcast("guild.leave", sid)
+            await message.channel.send("Leaving {}".format(sid))
 
         # nano.dev.tf.reload
         elif startswith("nano.dev.tf.clean"):
@@ -257,6 +293,7 @@ class DevFeatures:
 
             if s:
                 await message.channel.send("Successfully reloaded **{}**\nFrom version *{}* to *{}*.".format(name, v_old, v_new))
+                await self.cluster.broadcast("plugin.reload", name, include_self=False)
             else:
                 await message.channel.send("Something went wrong, check the logs.")
 
@@ -266,6 +303,11 @@ class DevFeatures:
 
         # nano.restart
         elif startswith("nano.restart"):
+            # Let the launcher restart all clusters one by one
+            if self.cluster.is_managed and await self.cluster.notify_launcher(LAUNCHER_RESTART):
+                await message.channel.send("**Rolling restart of all clusters started**")
+                return
+
             await message.channel.send("**DED, but gonna come back**")
 
             await client.logout()
@@ -277,6 +319,10 @@ class DevFeatures:
         elif startswith("nano.kill"):
             await message.channel.send("**DED**")
 
+            # The launcher stops every cluster, including this one
+            if self.cluster.is_managed and await self.cluster.notify_launcher(LAUNCHER_SHUTDOWN):
+                return
+
             await client.logout()
 
             self.shutdown_mode = "exit"
@@ -286,12 +332,12 @@ class DevFeatures:
         elif startswith("nano.playing"):
             status = message.content[len("nano.playing "):]
 
-            await client.change_presence(activity=Game(name=str(status)))
+            await self.cluster.broadcast("playing", status)
             await message.channel.send("Status changed " + StandardEmoji.THUMBS_UP)
 
         # nano.dev.translations.reload
         elif startswith("nano.dev.translations.reload"):
-            self.trans.reload_translations()
+            await self.cluster.broadcast("translations.reload")
 
             await message.channel.send(StandardEmoji.PERFECT)
 
@@ -311,17 +357,10 @@ class DevFeatures:
             await message.channel.send("Sending... ")
             ann = message.content[len("nano.dev.announce "):]
 
-            s = []
-            for g in self.client.guilds:
-                try:
-                    d_chan = await self.default_channel(g)
-                    await d_chan.send(ann)
-                    log_to_file("Sent announcement for {}".format(g.name))
-                    s.append(g.name)
-                except DiscordException:
-                    log_to_file("Couldn't send announcement for {}".format(g.name))
+            # Every cluster sends it to its own guilds
+            await self.cluster.broadcast("announce", ann)
 
-            await message.channel.send("Sent to {} servers".format(len(s)))
+            await message.channel.send("Sending on all clusters, see the logs for details")
 
         # nano.dev.logannounce
         elif startswith("nano.dev.logannounce"):
@@ -392,6 +431,62 @@ class DevFeatures:
 
             await message.channel.send(embed=embed)
 
+        # nano.dev.profile [slow/reset/startup/run seconds]
+        elif startswith("nano.dev.profile"):
+            param = message.content[len("nano.dev.profile"):].strip().split()
+            profiler = self.nano.profiler
+
+            if not param:
+                rows = profiler.top()
+                if not rows:
+                    await message.channel.send("Nothing measured yet.")
+                    return
+
+                lines = ["{:<22} {:<14} {:>7} {:>5} {:>5} {:>9} {:>8}".format("event", "plugin", "calls", "err", "slow",
+                                                                           "avg ms", "max ms")]
+                for (event, plugin), data in rows:
+                    lines.append("{:<22} {:<14} {:>7} {:>5} {:>5} {:>9} {:>8}".format(
+                        event[:22], plugin[:14], data["calls"], data["errors"], data["slow"], data["avg_ms"], data["max_ms"]))
+
+                await message.channel.send("```\n{}```".format("\n".join(lines)))
+
+            elif param[0] == "slow":
+                if not profiler.slow_samples:
+                    await message.channel.send("No slow callbacks (over {} s) so far.".format(profiler.slow_threshold))
+                    return
+
+                report = "\n\n".join("{} / {} after {} s ({})\n{}".format(
+                    s["event"], s["plugin"], s["seconds"], datetime.fromtimestamp(s["time"]).strftime("%H:%M:%S"), s["stack"])
+                    for s in profiler.slow_samples)
+                await message.channel.send("{} slow samples".format(len(profiler.slow_samples)),
+                                           file=File(BytesIO(report.encode()), filename="slow.txt"))
+
+            elif param[0] == "startup":
+                report = self.nano.startup.report()
+                if len(report) < 1900:
+                    await message.channel.send("```\n{}```".format(report))
+                else:
+                    await message.channel.send("Startup profile",
+                                               file=File(BytesIO(report.encode()), filename="startup.txt"))
+
+            elif param[0] == "reset":
+                profiler.reset()
+                await message.channel.send("Dispatch stats reset " + StandardEmoji.PERFECT)
+
+            elif param[0] == "run":
+                seconds = min(int(param[1]) if len(param) > 1 and param[1].isdigit() else 10, MAX_PROFILE_SECONDS)
+                if profiler.is_profiling:
+                    await message.channel.send("Already profiling.")
+                    return
+
+                await message.channel.send("Profiling for {} s...".format(seconds))
+                report = await profiler.profile(seconds)
+                await message.channel.send("Profile done",
+                                           file=File(BytesIO(report.encode()), filename="profile.txt"))
+
+            else:
+                await message.channel.send("Usage: nano.dev.profile [slow/reset/startup/run seconds]")
+
 
     async def on_ready(self):
         self.loop.create_task(self.backup.start())
@@ -412,7 +507,7 @@ class DevFeatures:
 
 class NanoPlugin:
     name = "Developer Commands"
-    version = "27"
+    version = "29"
 
     handler = DevFeatures
     events = {
@@ -2,21 +2,15 @@
 import configparser
 import os
 import logging
-import aiohttp
 import textwrap
 from copy import copy
 from io import BytesIO
 
-try:
-    from rapidjson import loads
-except ImportError:
-    from json import loads
-
 from discord import Embed, Colour, File
 from PIL import Image, ImageDraw, ImageFont
 
 from core.stats import PRAYER, MESSAGE, IMAGE_SENT
-from core.utils import is_valid_command, build_url, add_dots, gen_id, filter_text
+from core.utils import is_valid_command, add_dots, gen_id, filter_text
 from core.confparser import get_config_parser, DATA_DIR, PLUGINS_DIR
 
 # plugins/config.ini
@@ -123,13 +117,29 @@ class Achievement:
         return mem_file
 
 
+# Created lazily in each executor process (fonts and images can't be pickled)
+_achievement = None
+
+
+def render_achievement(text: str) -> bytes:
+    """
+    Runs in the CPU executor (see core/executor.py)
+    """
+    global _achievement
+    if _achievement is None:
+        _achievement = Achievement()
+
+    return _achievement.create_image(text).getvalue()
+
+
 class MemeGenerator:
     MEME_ENDPOINT = "https://api.imgflip.com/get_memes"
     CAPTION_ENDPOINT = "https://api.imgflip.com/caption_image"
 
-    def __init__(self, username, password, loop):
+    def __init__(self, username, password, http, loop):
 
         self.loop = loop
+        self.http = http
 
         self.username = str(username)
         self.password = str(password)
@@ -137,8 +147,6 @@ class MemeGenerator:
         self.meme_list = []
         self.meme_name_id = {}
 
-        self.session = aiohttp.ClientSession(loop=loop)
-
         loop.create_task(self.prepare())
 
     async def prepare(self):
@@ -154,11 +162,9 @@ class MemeGenerator:
 
         log.info("Ready to make memes")
 
-    @staticmethod
-    async def get_memes():
-        async with aiohttp.ClientSession() as session:
-            async with session.get(MemeGenerator.MEME_ENDPOINT) as resp:
-                return await resp.json(loads=loads, content_type=None)
+    async def get_memes(self):
+        resp = await self.http.get(MemeGenerator.MEME_ENDPOINT)
+        return resp.json()
 
     async def caption_meme(self, name, top, bottom):
         meme_id = self.meme_name_id.get(str(name).lower())
@@ -182,16 +188,16 @@ class MemeGenerator:
             template_id=meme_id,
         )
 
-        async with self.session.post(MemeGenerator.CAPTION_ENDPOINT, data=payload) as resp:
-            return await resp.json(loads=loads, content_type=None)
+        resp = await self.http.post(MemeGenerator.CAPTION_ENDPOINT, data=payload)
+        return resp.json()
 
 
 class GiphyApi:
     RANDOM_GIF = "https://api.giphy.com/v1/gifs/random"
 
-    def __init__(self, api_key: str, loop):
+    def __init__(self, api_key: str, http):
         self.key = str(api_key)
-        self.session = aiohttp.ClientSession(loop=loop)
+        self.http = http
 
     @staticmethod
     async def _parse_response(response):
@@ -224,20 +230,17 @@ class GiphyApi:
         if optional_tag is not None:
             payload["tag"] = str(optional_tag)
 
-        full_url = build_url(GiphyApi.RANDOM_GIF, **payload)
-
-        async with self.session.get(full_url) as resp:
+        # Random: a cached response would always be the same gif
+        resp = await self.http.get(GiphyApi.RANDOM_GIF, params=payload, cache=False)
 
-            if resp.status == 429:
-                return -1
+        if resp.status == 429:
+            return -1
 
-            if 200 < resp.status <= 300:
-                # Anything other than 200 is not good
-                raise ConnectionError("GiphyApi status code: {}".format(resp.status))
+        if 200 < resp.status <= 300:
+            # Anything other than 200 is not good
+            raise ConnectionError("GiphyApi status code: {}".format(resp.status))
 
-            data = await resp.json(loads=loads, content_type=None)
-
-            return await self._parse_response(data)
+        return await self._parse_response(resp.json())
 
 
 class Fun:
@@ -247,11 +250,13 @@ class Fun:
         self.stats = kwargs.get("stats")
         self.loop = kwargs.get("loop")
         self.trans = kwargs.get("trans")
+        self.executor = kwargs.get("executor")
+        self.http = kwargs.get("http")
 
         # Giphy
         try:
             api_key = parser.get("giphy", "api-key")
-            self.gif = GiphyApi(api_key, self.loop)
+            self.gif = GiphyApi(api_key, self.http)
         except configparser.Error:
             log.critical("Missing api key for giphy, disabling command...")
             self.giphy_enabled = False
@@ -260,14 +265,12 @@ class Fun:
         try:
             username = parser.get("imgflip", "username")
             password = parser.get("imgflip", "password")
-            self.generator = MemeGenerator(username, password, self.loop)
+            self.generator = MemeGenerator(username, password, self.http, self.loop)
             self.imgflip_enabled = True
         except configparser.Error:
             log.critical("Missing credentials for imgflip, disabling command...")
             self.imgflip_enabled = False
 
-        self.achievement = Achievement()
-
     async def on_message(self, message, **kwargs):
         trans = self.trans
 
@@ -393,7 +396,8 @@ class Fun:
                 await message.channel.send(trans.get("MSG_ACHIEVMENT_NOTEXT", lang))
                 return
 
-            img = self.achievement.create_image(text)
+            # Resizing and PNG encoding are too slow for the event loop
+            img = BytesIO(await self.executor.run_cpu(render_achievement, text))
             img_filename = "Achievement_{}.png".format(gen_id(4))
 
             await message.channel.send(file=File(img, img_filename))
@@ -403,7 +407,7 @@ class Fun:
 
 class NanoPlugin:
     name = "Admin Commands"
-    version = "13"
+    version = "14"
 
     handler = Fun
     events = {
@@ -1,16 +1,11 @@
 # coding=utf-8
 import configparser
-import aiohttp
 import logging
 from fuzzywuzzy import process, fuzz
 
-try:
-    from rapidjson import loads, dumps
-except ImportError:
-    from json import loads, dumps
 from discord import Embed
 
-from core.utils import is_valid_command, build_url
+from core.utils import is_valid_command
 from core.confparser import get_config_parser
 from core.stats import MESSAGE
 
@@ -67,6 +62,19 @@ class GameCompat:
         return self._fields[item]
 
 
+def find_closest(name: str, compares: list):
+    """
+    Runs in the CPU executor (see core/executor.py)
+    :return: the closest name or None if nothing is close enough
+    """
+    highest, score = process.extractOne(name, compares, scorer=fuzz.partial_token_sort_ratio)
+
+    if score > 85:
+        return highest
+    else:
+        return None
+
+
 class IgdbCacheManager:
     """
     Layout:
@@ -76,8 +84,9 @@ class IgdbCacheManager:
             games:ID
                 hash fields with all
     """
-    def __init__(self, handler):
+    def __init__(self, handler, executor):
         self._cache = handler.get_cache_handler().get_plugin_data_manager("games")
+        self.executor = executor
 
         self._tmp_names = {}
         self._fill_name_cache()
@@ -113,14 +122,15 @@ class IgdbCacheManager:
     def get_by_id(self, id_):
         return self._get(id_)
 
-    def get_by_name(self, name):
-        compares = self._tmp_names.keys()
+    async def get_by_name(self, name):
+        compares = list(self._tmp_names.keys())
         if not compares:
             return None
 
-        highest, score = process.extractOne(name, compares, scorer=fuzz.partial_token_sort_ratio)
+        highest = await self.executor.run_cpu(find_closest, name, compares)
 
-        if score > 85:
+        # Could have been removed in the meantime
+        if highest is not None and highest in self._tmp_names:
             return self._get(self._tmp_names[highest])
         else:
             return None
@@ -149,24 +159,23 @@ class Igdb:
     IMAGES = "https://images.igdb.com/igdb/image/upload/t_{size}/{id}.jpg"
     VIDEO = "https://youtu.be/{}"
 
-    def __init__(self, api_key: str, handler, loop):
+    def __init__(self, api_key: str, handler, http, executor):
         self.key = api_key
-        self.cache = IgdbCacheManager(handler)
+        self.cache = IgdbCacheManager(handler, executor)
 
-        self.session = aiohttp.ClientSession(loop=loop)
+        self.http = http
 
     async def _request(self, url: str, fields: dict):
-        url = build_url(url, **fields)
         headers = {
             "user-key": self.key,
             "Accept": "application/json"
         }
 
-        async with self.session.get(url, headers=headers) as resp:
-            return await resp.json(loads=loads, content_type=None)
+        resp = await self.http.get(url, params=fields, headers=headers)
+        return resp.json()
 
     async def get_game_by_name(self, name: str):
-        a = self.cache.get_by_name(name)
+        a = await self.cache.get_by_name(name)
         if a is not None:
             return GameCompat(a)
 
@@ -202,7 +211,7 @@ class GameDB:
             log.critical("Missing api key for Igdb, disabling plugin...")
             raise RuntimeError
 
-        self.gamedb = Igdb(gamedb_key, self.handler, self.loop)
+        self.gamedb = Igdb(gamedb_key, self.handler, kwargs.get("http"), kwargs.get("executor"))
 
     async def on_message(self, message, **kwargs):
         trans = self.trans
@@ -266,7 +275,7 @@ class GameDB:
 
 class NanoPlugin:
     name = "Game Database"
-    version = "1"
+    version = "3"
 
     handler = GameDB
     events = {
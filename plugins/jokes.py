@@ -2,20 +2,20 @@
 import asyncio
 import configparser
 import logging
-import aiohttp
 import os
 import traceback
 
 from random import randint
 try:
-    from rapidjson import loads, load
+    from rapidjson import load
 except ImportError:
-    from json import loads, load
+    from json import load
 from bs4 import BeautifulSoup
 from typing import Union
 
 from discord import Embed, Colour
 
+from core.lazy import LazyResource
 from core.stats import MESSAGE, IMAGE_SENT
 from core.utils import is_valid_command, is_number, log_to_file, filter_text
 from core.confparser import get_config_parser, PLUGINS_DIR
@@ -38,36 +38,28 @@ class APIFailure(Exception):
 
 
 class Connector:
-    def __init__(self, loop):
-        self.session = aiohttp.ClientSession(loop=loop)
-
-    @staticmethod
-    def _build_url(url, **fields):
-        if not url.endswith("?"):
-            url += "?"
-
-        field_list = ["{}={}".format(key, value) for key, value in fields.items()]
-        return str(url) + "&".join(field_list)
+    def __init__(self, http):
+        self.http = http
 
     async def get_json(self, url, **fields) -> dict:
-        async with self.session.get(self._build_url(url, **fields)) as resp:
-            # Check if everything is ok
-            if not (200 <= resp.status < 300):
-                raise APIFailure("response code: {}".format(resp.status))
+        resp = await self.http.get(url, params=fields)
+        # Check if everything is ok
+        if not resp.ok:
+            raise APIFailure("response code: {}".format(resp.status))
 
-            return await resp.json(loads=loads, content_type=None)
+        return resp.json()
 
-    async def get_html(self, url, **fields):
-        async with self.session.get(self._build_url(url, **fields)) as resp:
-            # Check if everything is ok
-            if not (200 <= resp.status < 300):
-                raise APIFailure("response code: {}".format(resp.status))
+    async def get_html(self, url, cache=True, **fields):
+        resp = await self.http.get(url, params=fields, cache=cache)
+        # Check if everything is ok
+        if not resp.ok:
+            raise APIFailure("response code: {}".format(resp.status))
 
-            return await resp.text()
+        return resp.text()
 
 
 class CatGenerator:
-    def __init__(self, loop):
+    def __init__(self, http):
         try:
             self.key = parser.get("catapi", "api-key")
         except (configparser.NoOptionError, configparser.NoSectionError):
@@ -77,13 +69,15 @@ class CatGenerator:
         self.url = "http://thecatapi.com/api/images/get"
         self.format = "html"
         self.size = "med"
-        self.req = Connector(loop)
+        self.req = Connector(http)
 
     async def random_cat(self, type_="gif"):
         # structure:
         # response -> data -> images -> image -> url
         try:
-            data = await self.req.get_html(self.url, api_key=self.key, format=self.format, size=self.size, type=type_)
+            # Random: a cached response would always be the same cat
+            data = await self.req.get_html(self.url, cache=False, api_key=self.key, format=self.format,
+                                           size=self.size, type=type_)
             link = BeautifulSoup(data, "lxml").find("img").get("src")
         except (APIFailure, Exception):
             log_to_file("CatGenerator exception\n{}".format(traceback.format_exc()), "bug")
@@ -110,7 +104,7 @@ class ComicImage:
 
 
 class XKCD:
-    def __init__(self, handler, loop=asyncio.get_event_loop()):
+    def __init__(self, handler, http, loop=asyncio.get_event_loop()):
         self.url_latest = "http://xkcd.com/info.0.json"
         self.url_number = "http://xkcd.com/{}/info.0.json"
         self.link_base = "https://xkcd.com/{}"
@@ -119,7 +113,7 @@ class XKCD:
         cache_handler = handler.get_cache_handler()
         self.cache = cache_handler.get_plugin_data_manager("xkcd")
 
-        self.req = Connector(loop)
+        self.req = Connector(http)
         self.loop = loop
 
         self.running = True
@@ -216,24 +210,26 @@ class JokeList:
 
         self.redis = handler.get_cache_handler()
 
+    def load(self):
+        """
+        Adds the jokes to redis if they aren't there yet (blocking, see Joke.joke)
+        :return: self
+        """
         if self.redis.scard(self.stupidstuff_ns):
             log.info("Joke 'dataset' already in db. Ready!")
-            return
+            return self
 
         log.info("Jokes not yet in redis db, adding...")
 
         with open(os.path.join(PLUGINS_DIR, "jokes", "stupidstuff.json")) as j:
             jokes = load(j)
 
-        for joke in jokes:
-            # Verify that %SEP% exists
-            # if "%SEP%" not in joke:
-            #     raise LookupError("invalid jokes.json")
-
-            self.redis.sadd(self.stupidstuff_ns, joke)
+        # One SADD instead of one per joke
+        self.redis.sadd(self.stupidstuff_ns, *jokes)
 
         del jokes
         log.info("Dataset ready!")
+        return self
 
     def random_joke(self) -> str:
         # title, body = self.redis.srandmember(self.r_namespace)[0].split("%SEP%")
@@ -255,9 +251,10 @@ class Joke:
         self.stats = kwargs.get("stats")
         self.trans = kwargs.get("trans")
 
-        self.cats = CatGenerator(self.loop)
-        self.xkcd = XKCD(self.handler, self.loop)
-        self.joke = JokeList(self.handler)
+        self.cats = CatGenerator(kwargs.get("http"))
+        self.xkcd = XKCD(self.handler, kwargs.get("http"), self.loop)
+        # Loaded after on_ready or by the first !joke
+        self.joke = LazyResource("jokes", JokeList(self.handler).load, executor=kwargs.get("executor"))
 
     async def on_message(self, message, **kwargs):
         trans = self.trans
@@ -350,7 +347,8 @@ class Joke:
 
         # !joke (yo mama/chuck norris)
         elif startswith(prefix + "joke"):
-            content = filter_text(self.joke.random_joke())
+            jokes = await self.joke.get()
+            content = filter_text(jokes.random_joke())
 
             embed = Embed(description=content)
             await message.channel.send(embed=embed)
@@ -358,7 +356,7 @@ class Joke:
 
 class NanoPlugin:
     name = "Joke-telling module"
-    version = "10"
+    version = "12"
 
     handler = Joke
     events = {
@@ -10,9 +10,9 @@ except ImportError:
 
 from json import JSONDecodeError
 
-import aiohttp
 from discord import File
 
+from core.lazy import LazyResource
 from core.stats import MESSAGE, WRONG_ARG, IMAGE_SENT
 from core.utils import is_valid_command, is_number
 from core.confparser import PLUGINS_DIR
@@ -25,6 +25,9 @@ ITEM_ID_PAIR = 1
 ITEM_ID = 2
 ITEM_NAME = 3
 
+# Cached item data is fetched again after a week
+MAX_AGE = 604800
+
 commands = {
     "_mc": {"desc": "Searches for items and displays their details", "use": "[command] [item name or id:meta]"},
 }
@@ -43,48 +46,57 @@ class McItems:
     """
     url = "http://minecraft-ids.grahamedgecombe.com/items.json"
 
-    def __init__(self, handler, loop):
-        # Gets a fresh copy of items at each startup.
+    def __init__(self, handler, http, executor):
+        self.http = http
+        self.executor = executor
         self.ids = {}
         self.by_type = {}
         self.names = {}
 
-        MAX_AGE = 604800  # 1 week
-
         cache_temp = handler.get_cache_handler()
         self.cache = cache_temp.get_plugin_data_manager("mc")
 
-        # Check validity of cache
-        if self.cache.exists("raw_data") and (time.time() - float(self.cache.get("last_fetch"))) < MAX_AGE:
-            log.info("Valid minecraft data found in DB.")
-            data = loads(self.cache.get("raw_data"))
-            loop.create_task(self._parse(data))
-
-        else:
+    async def load(self):
+        """
+        Loads the items from the cache or fetches a fresh copy (see MAX_AGE)
+        :return: self
+        """
+        if not await self.executor.run_io(self._load_cached):
             # Fetch and parse data
             log.info("No cache found.")
-            loop.create_task(self.request_data())
+            await self.request_data()
+
+        return self
+
+    def _load_cached(self) -> bool:
+        # Check validity of cache
+        if not self.cache.exists("raw_data") or (time.time() - float(self.cache.get("last_fetch"))) >= MAX_AGE:
+            return False
+
+        log.info("Valid minecraft data found in DB.")
+        self._parse(loads(self.cache.get("raw_data")))
+        return True
 
     async def request_data(self):
         log.info("Requesting JSON data from minecraft-ids.grahamedgecombe.com")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(McItems.url) as resp:
-                raw_data = await resp.text()
+        # Stored in redis, no need to keep it in the HTTP cache as well
+        resp = await self.http.get(McItems.url, cache=False)
+        raw_data = resp.text()
 
-                try:
-                    self.cache.set("raw_data", raw_data)
-                    self.cache.set("last_fetch", time.time())
-                    log.info("New mc dataset in cache")
+        try:
+            self.cache.set("raw_data", raw_data)
+            self.cache.set("last_fetch", time.time())
+            log.info("New mc dataset in cache")
 
-                    data = loads(raw_data)
-                    await self._parse(data)
-                except JSONDecodeError as e:
-                    log.critical("Could not load JSON: {}".format(e))
-                    raise RuntimeError
+            data = loads(raw_data)
+            self._parse(data)
+        except JSONDecodeError as e:
+            log.critical("Could not load JSON: {}".format(e))
+            raise RuntimeError
 
         log.info("Done")
 
-    async def _parse(self, data):
+    def _parse(self, data):
         for item in data:
             idmeta_string = "{}:{}".format(item["type"], item["meta"])
             name_string = str(item.get("name")).lower()
@@ -186,11 +198,12 @@ class Minecraft:
         self.loop = kwargs.get("loop")
         self.trans = kwargs.get("trans")
 
-        self.mc = McItems(self.handler, self.loop)
+        # Loaded after on_ready or by the first !mc
+        items = McItems(self.handler, kwargs.get("http"), kwargs.get("executor"))
+        self.mc = LazyResource("minecraft items", items.load)
 
     async def on_message(self, message, **kwargs):
         trans = self.trans
-        mc = self.mc
 
         prefix = kwargs.get("prefix")
         lang = kwargs.get("lang")
@@ -221,6 +234,8 @@ class Minecraft:
                 await message.channel.send(trans.get("MSG_MC_HELP", lang).format(prefix=prefix))
                 return
 
+            mc = await self.mc.get()
+
             # Argument is name
             if not is_number(argument.split(":")[0]):
                 # Check for groupings
@@ -273,7 +288,7 @@ class Minecraft:
 
 class NanoPlugin:
     name = "Minecraft Commands"
-    version = "14"
+    version = "16"
 
     handler = Minecraft
     events = {
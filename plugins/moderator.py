@@ -1,14 +1,18 @@
 # coding=utf-8
 import logging
 import re
+import time
 from enum import IntEnum
-from pickle import load
+
+import numpy as np
 
 from discord import Message, Embed, TextChannel
 
 from core.stats import SUPPRESS
 from core.utils import add_dots, get_valid_commands
 from core.confparser import PLUGINS_DIR
+from core.statestore import BoundedStore
+from core.wordfilter import WordFilter, MODE_WORD, MODE_SUBSTRING
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -17,20 +21,17 @@ logger.setLevel(logging.DEBUG)
 
 accepted_chars = "abcdefghijklmnopqrstuvwxyz "
 
+# How long (in seconds) a guild's custom word list is cached
+GUILD_WORDS_MAX_AGE = 300
+# Hard cap on guilds with a cached word list
+GUILD_WORDS_MAX_GUILDS = 20000
+# Matching mode of a guild's words (wordfilter:<guild_id>:mode), MODE_WORD if not set
+GUILD_WORDS_MODE_KEY = "{}:mode"
+FILTER_MODES = (MODE_WORD, MODE_SUBSTRING)
 
-def normalize(line):
-    # Ignores punctuation, new lines, etc...
-    accepted = "".join([char for char in line if char in accepted_chars])
-
-    return accepted
-
-
-def two_chars(line):
-    # Normalizes
-    norm = normalize(line)
-    # Yields two by two
-    for rn in range(0, len(norm) - 1):
-        yield norm[rn:rn + 1], norm[rn + 1:rn + 2]
+# Repeated message tracking: users that haven't posted in this many seconds are forgotten, hard cap on tracked users
+SPAM_STATE_TTL = 60 * 10
+SPAM_STATE_MAX_USERS = 50000
 
 
 class SpamType(IntEnum):
@@ -42,16 +43,18 @@ class SpamType(IntEnum):
 
 class ModBucket:
     """
-    A Bucket item: maintains a history of booleans. If "limit" is reached, notice(...) returns True
+    A Bucket item: maintains a fixed-size ring of booleans. If "limit" is reached, notice(...) returns True
     """
-    __slots__ = ("threshold", "max_history", "history", "position")
+    __slots__ = ("threshold", "max_history", "history", "position", "offenses")
 
     def __init__(self, limit: int=2, history: int=3):
         self.threshold = limit
         self.max_history = history
 
-        self.history = [False] * history
+        self.history = bytearray(history)
         self.position = 0
+        # Running count of offenses in history
+        self.offenses = 0
 
     def next_position(self) -> int:
         if self.position >= self.max_history-1:
@@ -62,67 +65,106 @@ class ModBucket:
             return self.position
 
     def threshold_reached(self) -> bool:
-        return self.history.count(True) >= self.threshold
+        return self.offenses >= self.threshold
 
+    def reset(self):
+        self.history[:] = bytes(self.max_history)
+        self.offenses = 0
 
     def notice(self, is_offense=False) -> bool:
         pos = self.next_position()
 
+        self.offenses += is_offense - self.history[pos]
         self.history[pos] = is_offense
 
         if self.threshold_reached():
             # Reset history and return True
-            self.history = [False] * self.max_history
+            self.reset()
             return True
 
 
 class GibberishDetector:
     """
     Detects "gibberish" (e.g. asdasdhadasda). Uses statistical occurences of two characters one after another.
+
+    spam_model.npy is a (27, 28) array: bigram occurrences for every pair of accepted_chars and, in the last column,
+    the threshold for each first character. Pairs below their threshold are "rare"; that comparison is done once
+    at load time, so scoring a message is a single lookup into the boolean matrix.
     """
-    __slots__ = ("data", "threshold", "char_positions", "chars2", "pos2")
+    __slots__ = ("rare", "char_index")
 
     def __init__(self):
-        # Gibberish detector
-        with open("{}/spam_model.pki".format(PLUGINS_DIR), "rb") as spam_model:
-            spam_model = load(spam_model)
+        # mmap-ed, no unpickling
+        model = np.load("{}/spam_model.npy".format(PLUGINS_DIR), mmap_mode="r")
+
+        size = len(accepted_chars)
+        data, threshold = model[:, :size], model[:, size]
 
-        self.data = spam_model["data"]
-        self.threshold = spam_model["threshold"]
-        self.char_positions = spam_model["positions"]
+        self.rare = np.asarray(data < threshold[:, None])
 
-        # Entropy calculator
-        self.chars2 = "abcdefghijklmnopqrstuvwxyz,.-!?_;:|1234567890*=)(/&%$#\"~<> "
-        self.pos2 = dict([(c, index) for index, c in enumerate(self.chars2)])
+        # Maps ASCII code points to indexes, -1 for ignored characters (punctuation, new lines, upper case, etc...)
+        self.char_index = np.full(128, -1, dtype=np.int8)
+        for index, char in enumerate(accepted_chars):
+            self.char_index[ord(char)] = index
 
+    def _to_indexes(self, message: str):
+        codes = np.frombuffer(message.encode("utf-32-le"), dtype=np.uint32)
+        # Anything outside ASCII lands on DEL (127), which is ignored as well
+        indexes = self.char_index[np.minimum(codes, 127)]
+
+        return indexes[indexes >= 0]
 
     def is_gibberish(self, message: str):
         """
-        Method: spam_model.pki is a pickle file with statistical occurrences of two characters one after another.
-
         :param message: string
         :return bool
         """
         if not message:
             return
 
-        th = len(message) / 1.8
-        c = float(0)
-        for ca, cb in two_chars(message):
+        indexes = self._to_indexes(message)
+        count = np.count_nonzero(self.rare[indexes[:-1], indexes[1:]])
+
+        return bool(count >= len(message) / 1.8)
 
-            if self.data[self.char_positions[ca]][self.char_positions[cb]] < self.threshold[self.char_positions[ca]]:
-                c += 1
+    def are_gibberish(self, messages: list) -> list:
+        """
+        Scores many messages at once
+
+        :param messages: list of strings
+        :return: list of bools
+        """
+        if not messages:
+            return []
 
-        return bool(c >= th)
+        all_indexes = [self._to_indexes(m) for m in messages]
+        lengths = np.array([len(a) for a in all_indexes])
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+
+        indexes = np.concatenate(all_indexes)
+        rare = self.rare[indexes[:-1], indexes[1:]]
+
+        # Pairs that straddle two messages don't count
+        boundaries = ends[:-1] - 1
+        rare[boundaries[(boundaries >= 0) & (boundaries < len(rare))]] = False
+
+        # Padded by one, so messages at the end with less than two characters still have an end index
+        cumulative = np.concatenate(([0], np.cumsum(rare), [np.count_nonzero(rare)]))
+        counts = cumulative[starts + np.maximum(lengths - 1, 0)] - cumulative[starts]
+
+        raw_lengths = np.array([len(m) for m in messages])
+        return ((raw_lengths > 0) & (counts >= raw_lengths / 1.8)).tolist()
 
 
 class SwearingDetector:
     """
     Detects blocked words from banned_words.txt. Makes some "permutations" to all words so detection quality is higher.
+    Guilds can have their own words on top of the global list.
     """
-    __slots__ = ("permutations", "word_list")
+    __slots__ = ("permutations", "word_list", "word_filter", "guild_filters")
 
-    def __init__(self):
+    def __init__(self, mode: str=MODE_WORD):
         self.permutations = [
             dict(a="4"),
             dict(s="$"),
@@ -131,54 +173,87 @@ class SwearingDetector:
         ]
 
         with open("{}/banned_words.txt".format(PLUGINS_DIR)) as banned:
-            self.word_list = [line.strip("\n") for line in banned.readlines()]
+            words = [line.strip("\n") for line in banned.readlines()]
+
+        self.word_list = self.permute(words)
+        logger.info("Processed word list: added {} entries ({} total)".format(len(self.word_list) - len(words), len(self.word_list)))
+
+        self.word_filter = WordFilter(self.word_list, mode=mode)
+
+        # guild_id: (WordFilter or None, time loaded)
+        self.guild_filters = BoundedStore("moderator.wordfilter", max_size=GUILD_WORDS_MAX_GUILDS, ttl=GUILD_WORDS_MAX_AGE)
+
+    def permute(self, words: list) -> list:
+        """
+        Builds a more sophisticated list
+        """
+        word_list = list(words)
 
-        # Builds a more sophisticated list
-        before = len(self.word_list)
-        for word in self.word_list:
+        for word in words:
             initial = str(word)
 
             for perm in self.permutations:
                 (k, v), = perm.items()
                 changed = initial.replace(k, v)
                 if initial != changed:
-                    self.word_list.append(changed)
+                    word_list.append(changed)
 
-        logger.info("Processed word list: added {} entries ({} total)".format(len(self.word_list) - before, len(self.word_list)))
+        return word_list
 
-    def has_swearing(self, message: str) -> bool:
+    def needs_guild_words(self, guild_id: int) -> bool:
+        loaded = self.guild_filters.get(guild_id)
+        return loaded is None or (time.time() - loaded[1]) > GUILD_WORDS_MAX_AGE
+
+    def set_guild_words(self, guild_id: int, words, mode: str=MODE_WORD):
+        words = [str(a).lower() for a in words] if words else None
+        word_filter = WordFilter(self.permute(words), mode=mode) if words else None
+
+        self.guild_filters.set(guild_id, (word_filter, time.time()))
+
+    def forget_guild_words(self, guild_id: int):
+        # Loaded again on the next message
+        self.guild_filters.delete(guild_id)
+
+    def has_swearing(self, message: str, guild_id: int=None) -> bool:
         """
         Returns True if there is a banned word
 
         :param message: Discord Message content
+        :param guild_id: also check the words of this guild
         """
-        res = [a for a in self.word_list if a in message.split(" ")]
-        return bool(res)
+        if self.word_filter.search(message):
+            return True
+
+        guild_filter, _ = self.guild_filters.get(guild_id, (None, None))
+        return guild_filter is not None and guild_filter.search(message)
+
+
+class RepeatState:
+    __slots__ = ("last_message", "bucket")
+
+    def __init__(self):
+        self.last_message = None
+        self.bucket = ModBucket()
 
 
 class RepeatingMessageDetector:
-    __slots__ = ("user_buckets", "last_from_user")
+    __slots__ = ("users", )
 
     def __init__(self):
-        self.last_from_user = {}
-        self.user_buckets = {}
+        self.users = BoundedStore("moderator.repeating", max_size=SPAM_STATE_MAX_USERS, ttl=SPAM_STATE_TTL)
 
     def is_repeating(self, user_id: int, message: str):
-        # Get bucket
-        bucket = self.user_buckets.get(user_id)
-        if not bucket:
-            bucket = ModBucket()
-            self.user_buckets[user_id] = bucket
+        state = self.users.get_or_create(user_id, RepeatState)
 
         # See if message repeats
-        last = self.last_from_user.get(user_id)
+        last = state.last_message
 
-        self.last_from_user[user_id] = message
+        state.last_message = message
         # If first message
         if not last:
             return False
 
-        return bucket.notice(message == last)
+        return state.bucket.notice(message == last)
 
 
 
@@ -191,14 +266,15 @@ class NanoModerator:
         self.invite_regex = re.compile(r'(http(s)?://)?discord.gg/\w+')
 
 
-    def check_swearing(self, message: str) -> bool:
+    def check_swearing(self, message: str, guild_id: int=None) -> bool:
         """
         Checks whether a message includes words that are not allowed.
 
         :param message: str
+        :param guild_id: int
         :return: bool
         """
-        return self.swearing_detect.has_swearing(message.lower())
+        return self.swearing_detect.has_swearing(message.lower(), guild_id)
 
 
     def check_spam(self, author_id: int, message: str, raw_message):
@@ -315,8 +391,38 @@ class Moderator:
         self.checker = NanoModerator()
         self.log = LogManager(self.client, self.nano, self.loop, self.handler, self.trans)
 
+        # Custom per-guild word lists (sets named by guild id)
+        self.guild_words = self.handler.get_plugin_data_manager("wordfilter")
+
         self.valid_commands = set()
 
+    # Custom word lists (changed with nano.wordfilter in the admin plugin)
+    async def get_guild_words(self, guild_id: int) -> set:
+        return {str(a) for a in await self.guild_words.aio.smembers(guild_id) or ()}
+
+    async def add_guild_words(self, guild_id: int, words) -> int:
+        added = await self.guild_words.aio.sadd(guild_id, *[a.lower() for a in words])
+        self.checker.swearing_detect.forget_guild_words(guild_id)
+
+        return added
+
+    async def remove_guild_words(self, guild_id: int, words) -> int:
+        removed = await self.guild_words.aio.srem(guild_id, *[a.lower() for a in words])
+        self.checker.swearing_detect.forget_guild_words(guild_id)
+
+        return removed
+
+    async def get_filter_mode(self, guild_id: int) -> str:
+        mode = await self.guild_words.aio.get(GUILD_WORDS_MODE_KEY.format(guild_id))
+        return mode if mode in FILTER_MODES else MODE_WORD
+
+    async def set_filter_mode(self, guild_id: int, mode: str):
+        if mode not in FILTER_MODES:
+            raise ValueError("unknown mode: {}".format(mode))
+
+        await self.guild_words.aio.set(GUILD_WORDS_MODE_KEY.format(guild_id), mode)
+        self.checker.swearing_detect.forget_guild_words(guild_id)
+
     async def on_plugins_loaded(self):
         # Collect all valid commands
         plugins = [a.plugin for a in self.nano.plugins.values() if a.plugin]
@@ -342,14 +448,14 @@ class Moderator:
             return "return"
 
         # Muting
-        if handler.is_muted(message.guild, message.author.id):
+        if await handler.aio.is_muted(message.guild, message.author.id):
             await message.delete()
 
             self.stats.add(SUPPRESS)
             return "return"
 
         # Channel blacklisting
-        if handler.is_blacklisted(message.guild.id, message.channel.id):
+        if await handler.aio.is_blacklisted(message.guild.id, message.channel.id):
             return "return"
 
         # Ignore the filter if user is executing a command
@@ -362,10 +468,14 @@ class Moderator:
         if np_text in self.valid_commands:
             return
 
+        # Same for commands without a prefix (nano.wordfilter remove <word> must not be filtered)
+        if message.content.split(" ", maxsplit=1)[0] in self.valid_commands:
+            return
+
         # Spam, swearing and invite filter
-        needs_spam_filter = handler.has_spam_filter(message.guild)
-        needs_swearing_filter = handler.has_word_filter(message.guild)
-        needs_invite_filter = handler.has_invite_filter(message.guild)
+        needs_spam_filter = await handler.aio.has_spam_filter(message.guild)
+        needs_swearing_filter = await handler.aio.has_word_filter(message.guild)
+        needs_invite_filter = await handler.aio.has_invite_filter(message.guild)
 
         if needs_spam_filter:
             spam_reason = self.checker.check_spam(message.author.id, message.content, message)
@@ -373,7 +483,12 @@ class Moderator:
             spam_reason = False
 
         if needs_swearing_filter:
-            swearing = self.checker.check_swearing(message.content)
+            if self.checker.swearing_detect.needs_guild_words(message.guild.id):
+                words = await self.guild_words.aio.smembers(message.guild.id)
+                mode = await self.get_filter_mode(message.guild.id)
+                self.checker.swearing_detect.set_guild_words(message.guild.id, words, mode)
+
+            swearing = self.checker.check_swearing(message.content, message.guild.id)
         else:
             swearing = False
 
@@ -395,7 +510,7 @@ class Moderator:
             logger.debug("Message filtered")
 
             # Check if current channel is the logging channel
-            log_channel_name = self.handler.get_log_channel(message.guild)
+            log_channel_name = await self.handler.aio.get_log_channel(message.guild)
             if log_channel_name == message.channel.name:
                 return
 
@@ -428,7 +543,7 @@ class Moderator:
 
 class NanoPlugin:
     name = "Moderator"
-    version = "31"
+    version = "34"
 
     handler = Moderator
     events = {
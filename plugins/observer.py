@@ -1,10 +1,12 @@
 # coding=utf-8
 import logging
 import time
+from array import array
 
 from discord import TextChannel
 
 from core.stats import SLEPT
+from core.statestore import BoundedStore
 from core.confparser import get_config_parser
 from core.utils import get_valid_commands
 
@@ -15,6 +17,10 @@ parser = get_config_parser()
 
 DEFAULT_PREFIX = parser.get("Servers", "defaultprefix")
 
+# Command rate limiting: buckets of users that have been quiet for this long are dropped, hard cap on tracked users
+RATELIMIT_TTL = 60
+RATELIMIT_MAX_USERS = 50000
+
 # Prefix getter plugin
 
 commands = {
@@ -26,32 +32,30 @@ valid_commands = commands.keys()
 
 
 class Bucket:
-    __slots__ = ("last_cooldown", "_size", "_cooldown", "current_bucket", "was_warned")
+    """
+    Sliding-window rate limit: a fixed-size ring of the last "limit" action times
+    """
+    __slots__ = ("_size", "_cooldown", "times", "position", "was_warned")
 
     def __init__(self, limit: int=2, per: int=5):
-        self.last_cooldown = time.time()
-
         self._size = limit
         self._cooldown = per
         self.was_warned = False
-        self.current_bucket = 0
 
-    def action(self):
-        current_time = time.time()
+        self.times = array("d", [float("-inf")] * limit)
+        self.position = 0
 
-        # If bucket cooldown is reached, reset the bucket
-        if current_time - self.last_cooldown > self._cooldown:
-            self.last_cooldown = current_time
-            self.current_bucket = 0
-            self.was_warned = False
-            return True
+    def action(self):
+        current_time = time.monotonic()
 
-        if self.current_bucket >= self._size:
+        # The oldest of the last "limit" actions is still inside the window
+        if current_time - self.times[self.position] < self._cooldown:
             return False
-        else:
-            self.current_bucket += 1
-            return True
 
+        self.times[self.position] = current_time
+        self.position = (self.position + 1) % self._size
+        self.was_warned = False
+        return True
 
 
 class Observer:
@@ -62,7 +66,7 @@ class Observer:
         self.trans = kwargs.get("trans")
         self.nano = kwargs.get("nano")
 
-        self.buckets = {}
+        self.buckets = BoundedStore("observer.ratelimit", max_size=RATELIMIT_MAX_USERS, ttl=RATELIMIT_TTL)
         self.valid_commands = set()
 
     async def on_plugins_loaded(self):
@@ -92,14 +96,14 @@ class Observer:
             return "return"
 
         # Add prefix to kwargs for future plugins
-        pref = self.handler.get_prefix(message.guild)
+        pref = await self.handler.aio.get_prefix(message.guild)
         if pref is None:
             pref = str(DEFAULT_PREFIX)
         else:
             pref = str(pref)
 
         # Parse language
-        lang = self.handler.get_lang(message.guild.id)
+        lang = await self.handler.aio.get_lang(message.guild.id)
         if not lang:
             lang = str(self.trans.default_lang)
 
@@ -112,26 +116,20 @@ class Observer:
         np_text = "_" + np_text.split(" ", maxsplit=1)[0]
         if np_text in self.valid_commands:
             # Check rate-limits
-            # If user was silent until now, create a new bucket
-            if message.author.id not in self.buckets.keys():
-                b = Bucket()
-                b.action()
-                self.buckets[message.author.id] = b
-            # Otherwise, check bucket size
-            else:
-                bucket = self.buckets[message.author.id]
-                # bucket.action() returns a bool indicating if the user can execute the requested command
-                if not bucket.action():
-                    if not bucket.was_warned:
-                        # Do not send additional warnings in the same time period
-                        bucket.was_warned = True
-                        await message.channel.send(trans.get("MSG_RATELIMIT", lang).format(message.author.mention))
-
-                    return "return"
+            # If user was silent until now, a new bucket is created
+            bucket = self.buckets.get_or_create(message.author.id, Bucket)
+            # bucket.action() returns a bool indicating if the user can execute the requested command
+            if not bucket.action():
+                if not bucket.was_warned:
+                    # Do not send additional warnings in the same time period
+                    bucket.was_warned = True
+                    await message.channel.send(trans.get("MSG_RATELIMIT", lang).format(message.author.mention))
+
+                return "return"
 
 
         # Set up the server if it is not present in redis db
-        if not self.handler.server_exists(message.guild.id):
+        if not await self.handler.aio.server_exists(message.guild.id):
             await self.handler.server_setup(message.guild)
 
         # Ah, the shortcuts
@@ -159,7 +157,7 @@ class Observer:
                 await message.channel.send(trans.get("PERM_ADMIN", lang))
                 return "return"
 
-            if not self.handler.is_sleeping(message.guild.id):
+            if not await self.handler.aio.is_sleeping(message.guild.id):
                 await message.channel.send(trans.get("MSG_NANO_WASNT_SLEEPING", lang))
                 return "return"
 
@@ -170,7 +168,7 @@ class Observer:
             return "return"
 
         # Quit if the bot is sleeping
-        if self.handler.is_sleeping(message.guild.id):
+        if await self.handler.aio.is_sleeping(message.guild.id):
             return "return"
 
         return "add_var", dict(prefix=pref, lang=lang)
@@ -232,6 +230,8 @@ class NanoPlugin:
     version = "23"
 
     handler = Observer
+    # Sets up prefix and language for every message
+    command_routing = False
     events = {
         "on_message": 4,
         "on_plugins_loaded": 4,
@@ -5,10 +5,12 @@ import time
 import traceback
 
 from typing import Union
-from discord import DiscordException
+from discord import DiscordException, NotFound
 
+from core.pagination import Pages, PaginationService
 from core.stats import MESSAGE, WRONG_ARG
-from core.utils import resolve_time, convert_to_seconds, is_valid_command, gen_id, IgnoredException, log_to_file, filter_text
+from core.utils import resolve_time, convert_to_seconds, is_valid_command, gen_id, IgnoredException, log_to_file, filter_text, \
+                       decode
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -16,7 +18,14 @@ log.setLevel(logging.INFO)
 # CONSTANTS
 
 DEFAULT_REMINDER_LIMIT = 3
-TICK_DURATION = 15
+# Timer queue name (see core/scheduler.py)
+REMINDER_QUEUE = "reminder"
+
+# Full key names, used in pipelines (which bypass the namespace)
+REMINDER_KEY = "reminder:{}:{}"
+INDEX_KEY = "reminder:idx:{}"
+# Set once the per-user index has been built from existing reminders
+INDEX_MARKER = "reminder:idx-built"
 
 REM_MIN_DURATION = 5
 REM_MAX_DURATION = 259200
@@ -55,16 +64,24 @@ class RedisReminderHandler:
                             author: author id
                             raw: raw content
 
+    Data type: Set
+
+    reminder:idx:<USER_ID> => REM_ID, ...
+
+    The index is updated in the same MULTI as the reminder hash itself.
+    Due times are kept in the "reminder" timer queue as <USER_ID>:<REM_ID>
     """
-    def __init__(self, client, handler, trans, loop=asyncio.get_event_loop()):
+    def __init__(self, client, handler, trans, scheduler, cluster, loop=asyncio.get_event_loop()):
         self.redis = handler.get_plugin_data_manager(namespace="reminder")
 
         self.loop = loop
         self.client = client
         self.trans = trans
+        self.scheduler = scheduler
+        self.cluster = cluster
 
     def get_reminder_amount(self):
-        return len(self.get_all_reminders())
+        return self.scheduler.pending(REMINDER_QUEUE)
 
     def _prepare_private(self, content, lang):
         return self.trans.get("MSG_REMINDER_PRIVATE", lang).format(filter_text(content, user_mention=False))
@@ -73,37 +90,72 @@ class RedisReminderHandler:
         return self.trans.get("MSG_REMINDER_CHANNEL", lang).format(filter_text(content, user_mention=False))
 
     def get_reminders(self, user_id) -> dict:
-        keys = [a for a in self.redis.scan_iter("{}:*".format(user_id))]
+        ids = self.redis.smembers(INDEX_KEY.format(user_id), use_namespace=False)
 
-        if not keys:
+        if not ids:
             return {}
 
-        reminders = {}
-        for r in keys:
-            r_id = int(r.rsplit(":", maxsplit=1)[1])
-            reminders[r_id] = self.redis.hgetall(r, use_namespace=False)
+        ids = list(ids)
+
+        pipe = self.redis.pipeline(transaction=False)
+        for r_id in ids:
+            pipe.hgetall(REMINDER_KEY.format(user_id, r_id))
 
-        return reminders
+        return {r_id: decode(rem) for r_id, rem in zip(ids, pipe.execute()) if rem}
 
     @staticmethod
-    def _extract_user_id(key_name: str) -> int:
-        # Dirty but fast
-        # How it works:
-        # Example: "reminder:DefaltSimon:328742938"
-        # Splits by the first and last : and returns the middle
-        # Safe even if user has : in his/her name
+    def _parse_key(key_name: str):
+        """
+        Returns (user_id, rem_id) from "reminder:<USER_ID>:<REM_ID>" or None for other keys in the namespace
+        """
+        parts = key_name.split(":")
+        if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+            return None
 
-        return int(key_name.split(":", maxsplit=1)[1].rsplit(":", maxsplit=1)[0])
+        return int(parts[1]), int(parts[2])
 
     def get_all_reminders(self) -> list:
         """
         Finds users and gets their reminders
         :return: list(user_reminder_dict, ...)
         """
-        users = set(self._extract_user_id(name) for name in self.redis.scan_iter("*"))
+        users = set(int(name.rsplit(":", maxsplit=1)[1]) for name in self.redis.scan_iter("idx:*")
+                    if name.rsplit(":", maxsplit=1)[1].isdigit())
 
         return [self.get_reminders(u) for u in users]
 
+    def build_index(self, force=False) -> int:
+        """
+        Migration: builds reminder:idx:<USER_ID> sets from existing reminder hashes
+        and schedules them in the timer queue. Only runs once unless forced.
+        :return: amount of reminders indexed
+        """
+        if not force and self.redis.exists(INDEX_MARKER, use_namespace=False):
+            return 0
+
+        amount = 0
+        pipe = self.redis.pipeline(transaction=False)
+
+        for name in self.redis.scan_iter("*"):
+            parsed = self._parse_key(name)
+            if parsed is None:
+                continue
+
+            user_id, rem_id = parsed
+            target = self.redis.hget(name, "time_target", use_namespace=False)
+            if target is None:
+                continue
+
+            pipe.sadd(INDEX_KEY.format(user_id), rem_id)
+            self.scheduler.schedule(REMINDER_QUEUE, "{}:{}".format(user_id, rem_id), int(target), only_new=True)
+            amount += 1
+
+        pipe.set(INDEX_MARKER, 1)
+        pipe.execute()
+
+        log.info("Indexed {} existing reminders".format(amount))
+        return amount
+
     def find_id_from_content(self, user_id, content):
         reminders = self.get_reminders(user_id)
 
@@ -117,15 +169,23 @@ class RedisReminderHandler:
         for r_id in self.get_reminders(user_id).keys():
             self.remove_reminder(user_id, r_id)
 
+    def _delete(self, user_id, rem_id):
+        pipe = self.redis.pipeline()
+        pipe.delete(REMINDER_KEY.format(user_id, rem_id))
+        pipe.srem(INDEX_KEY.format(user_id), rem_id)
+
+        return pipe.execute()[0]
+
     def remove_reminder(self, user_id, rem_id):
-        return self.redis.delete("{}:{}".format(user_id, rem_id))
+        self.scheduler.cancel(REMINDER_QUEUE, "{}:{}".format(user_id, rem_id))
+        return self._delete(user_id, rem_id)
 
     def can_add_reminders(self, user_id):
         """
         :param user_id: user id
         :return: True -> user can add more reminders
         """
-        return len(self.get_reminders(user_id)) < DEFAULT_REMINDER_LIMIT
+        return self.redis.scard(INDEX_KEY.format(user_id), use_namespace=False) < DEFAULT_REMINDER_LIMIT
 
     def set_reminder(self, channel, author, content: str, tim: int,
                      lang: str, reminder_type: Union[REMINDER_CHANNEL, REMINDER_PERSONAL]=REMINDER_PERSONAL):
@@ -160,33 +220,26 @@ class RedisReminderHandler:
                     "time_created": int(t), "time_target": int(tim + t), "raw": raw, "type": reminder_type}
 
         log.info("New reminder by {}".format(author.id))
-        hash_name = "{}:{}".format(author.id, rm_id)
-
-        return self.redis.hmset(hash_name, tree)
-
-    @staticmethod
-    async def tick(last_time):
-        """
-        Very simple implementation of a self-correcting tick system
-        :return: None
-        """
-        current_time = time.time()
-        delta = TICK_DURATION - (current_time - last_time)
 
-        # If previous loop took more than TICK_DURATION, do one right away
-        if delta <= 0:
-            return time.time()
+        pipe = self.redis.pipeline()
+        pipe.hset(REMINDER_KEY.format(author.id, rm_id), mapping=tree)
+        pipe.sadd(INDEX_KEY.format(author.id), rm_id)
+        pipe.execute()
 
-        await asyncio.sleep(delta)
+        self.scheduler.schedule(REMINDER_QUEUE, "{}:{}".format(author.id, rm_id), tree["time_target"])
 
-        return time.time()
+        return True
 
     async def dispatch(self, rem):
         if rem["type"] == REMINDER_CHANNEL:
             log.info("Dispatching channel reminder by {}".format(rem["receiver"]))
 
             guild = self.client.get_guild(int(rem["server"]))
-            channel = guild.get_channel(int(rem["receiver"]))
+            channel = guild.get_channel(int(rem["receiver"])) if guild else None
+
+            if not channel:
+                log.warning("Channel {} (guild {}) missing, ignoring...".format(rem["receiver"], rem["server"]))
+                return
 
             content = self._prepare_channel(rem["raw"], rem["lang"])
             await channel.send(content)
@@ -195,38 +248,44 @@ class RedisReminderHandler:
         else:
             log.info("Dispatching personal reminder by {}".format(rem["receiver"]))
 
+            # Users that don't share a guild with this cluster aren't cached, any cluster can DM them
             user = self.client.get_user(int(rem["receiver"]))
-
             if not user:
-                log.info("User missing, ignoring...")
-                return
+                try:
+                    user = await self.client.fetch_user(int(rem["receiver"]))
+                except NotFound:
+                    log.warning("User {} missing, ignoring...".format(rem["receiver"]))
+                    return
 
             content = self._prepare_private(rem["raw"], rem["lang"])
             await user.send(content)
 
-    async def monitor(self):
-        await self.client.wait_until_ready()
+    async def owns(self, job_id: str) -> bool:
+        # Channel reminders can only be sent by the cluster with the guild, DMs by anyone
+        guild_id = await self.redis.aio.hget(job_id, "server")
+        return guild_id is None or self.cluster.owns_guild(int(guild_id))
 
-        last_time = time.time()
+    async def fire(self, job_id: str):
+        user_id, rem_id = job_id.rsplit(":", maxsplit=1)
 
-        while True:
-            # Iterate through users and their reminders
-            a = self.get_all_reminders()
-            for user in a:
+        reminder = self.redis.hgetall(job_id)
+        # Removed in the meantime
+        if not reminder:
+            return
 
-                for id_, reminder in user.items():
-                    # If enough time has passed, send the reminder
-                    if int(reminder["time_target"]) <= last_time:
-                        try:
-                            await self.dispatch(reminder)
-                        except (DiscordException, KeyError):
-                            log.warning("ERROR in reminders, see bugs.txt")
-                            log_to_file(traceback.format_exc(), "bug")
+        try:
+            await self.dispatch(reminder)
+        except (DiscordException, KeyError):
+            log.warning("ERROR in reminders, see bugs.txt")
+            log_to_file(traceback.format_exc(), "bug")
 
-                        self.remove_reminder(reminder["author"], id_)
+        self._delete(user_id, rem_id)
 
-            # And tick.
-            last_time = await self.tick(last_time)
+    def start(self):
+        # Reminders set before the index and timer queue existed
+        self.build_index()
+
+        self.scheduler.register(REMINDER_QUEUE, self.fire, owner=self.owns)
 
 
 class Reminder:
@@ -238,11 +297,13 @@ class Reminder:
         self.stats = kwargs.get("stats")
         self.trans = kwargs.get("trans")
 
-        self.reminder = RedisReminderHandler(self.client, self.handler, self.trans, self.loop)
+        self.reminder = RedisReminderHandler(self.client, self.handler, self.trans, kwargs.get("scheduler"),
+                                             kwargs.get("cluster"), self.loop)
+        self.pages = PaginationService(self.client, self.handler)
 
         self.filter = None
 
-        self.loop.create_task(self.reminder.monitor())
+        self.reminder.start()
 
     async def on_plugins_loaded(self):
         self.filter = self.nano.get_plugin("commons").instance.at_everyone_filter
@@ -355,8 +416,6 @@ class Reminder:
                 return
 
             rem = []
-            rem_literal = trans.get("MSG_REMINDER_LIST_L", lang)
-
             for reminder in reminders.values():
                 # Gets the remaining time
                 ttl = int(reminder["time_target"]) - time.time()
@@ -369,9 +428,13 @@ class Reminder:
                 else:
                     when = resolve_time(ttl, lang)
 
-                rem.append(rem_literal.format(cont, when))
+                rem.append((cont, when))
 
-            await message.channel.send(trans.get("MSG_REMINDER_LIST", lang).format("\n\n".join(rem)))
+            pages = Pages(rem, trans.get("MSG_REMINDER_LIST_L", lang), separator="\n\n")
+            if len(pages) == 1:
+                await message.channel.send(trans.get("MSG_REMINDER_LIST", lang).format(pages.render(0)))
+            else:
+                await self.pages.send(message.channel, trans.get("MSG_REMINDER_LIST_PAGES", lang), pages)
 
         # !remind remove
         elif startswith(prefix + "remind remove"):
@@ -403,7 +466,7 @@ class Reminder:
 
 class NanoPlugin:
     name = "Reminder Commands"
-    version = "22"
+    version = "24"
 
     handler = Reminder
     events = {
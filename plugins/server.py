@@ -4,13 +4,18 @@ import gc
 import logging
 import os
 import time
+import traceback
 import psutil
 
 from discord import utils, Embed, Colour, __version__ as d_version, HTTPException
-from discord import Member, Guild, Status, VerificationLevel
+from discord import Status, VerificationLevel
 
 from core.stats import MESSAGE
-from core.utils import is_valid_command, log_to_file, is_disabled, IgnoredException
+from core.batching import get_batch_info
+from core.statestore import get_store_info
+from core.serverhandler import WARMUP_CHUNK_SIZE
+from core.template import render_event, get_cache_info
+from core.utils import is_valid_command, log_to_file, log_sink, is_disabled, IgnoredException
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -21,6 +26,11 @@ log.setLevel(logging.INFO)
 
 FAILPROOF_TIME_WAIT = 2.5
 
+# Log warm-up progress every this many guilds
+WARMUP_LOG_EVERY = 5000
+# Seconds after on_ready before data of guilds we're not in is removed (lets the shards settle first)
+WARMUP_SETTLE_TIME = 10
+
 commands = {
     "_debug": {"desc": "Displays EVEN MORE stats about Nano."},
     "_status": {"desc": "Displays current status: server, user and channel count.", "alias": "nano.status"},
@@ -42,6 +52,9 @@ class ServerManagement:
         self.nano = kwargs.get("nano")
         self.stats = kwargs.get("stats")
         self.trans = kwargs.get("trans")
+        self.cluster = kwargs.get("cluster")
+        self.executor = kwargs.get("executor")
+        self.http = kwargs.get("http")
 
         # Debug
         self.lt = time.time()
@@ -101,22 +114,7 @@ class ServerManagement:
         # Color: Nano's dark blue color
         return Embed(description="ID: {}".format(user.id), color=color).set_author(name="{} {}".format(user.name, action), icon_url=user.avatar_url)
 
-    @staticmethod
-    def parse_dynamic_response(text: str, member: Member, guild: Guild):
-        order = [":username", ":user", ":server"]
-        replacements = {
-            ":user": member.mention,
-            ":username": member.display_name,
-            ":server": guild.name
-        }
-
-        for t in order:
-            text = text.replace(t, replacements[t])
-
-        return text
-
     async def on_message(self, message, **kwargs):
-        client = self.client
         trans = self.trans
 
         prefix = kwargs.get("prefix")
@@ -137,16 +135,12 @@ class ServerManagement:
 
         # !status
         if startswith(prefix + "status"):
-            server_count = 0
-            members = 0
-            channels = 0
-
-            # Iterate though servers and add up things
-            for guild in client.guilds:
+            # Totals over all clusters
+            totals = await self.cluster.get_totals()
 
-                server_count += 1
-                members += int(guild.member_count)
-                channels += len(guild.channels)
+            server_count = totals["guilds"]
+            members = totals["members"]
+            channels = totals["channels"]
 
             embed = Embed(name=trans.get("MSG_STATUS_STATS", lang), colour=Colour.dark_blue())
 
@@ -201,7 +195,36 @@ class ServerManagement:
 
             additional = trans.get("MSG_DEBUG_MULTI_2", lang).format(total_shards, current_shard)
 
-            await message.channel.send(fields + "\n" + additional)
+            # In-memory per-user state (rate limits, spam tracking)
+            store_line = trans.get("MSG_DEBUG_STATE_L", lang)
+            stores = "\n".join([store_line.format(a["name"], a["size"], a["max_size"], round(a["memory"] / 1024, 1),
+                                                   a["evicted_ttl"], a["evicted_size"]) for a in get_store_info()])
+            # Executor queue depth
+            pool_line = trans.get("MSG_DEBUG_EXECUTOR_L", lang)
+            pools = [pool_line.format(name, a["workers"], a["pending"], a["submitted"] - a["pending"], a["avg_ms"], a["failed"])
+                     for name, a in self.executor.info().items()]
+
+            # Compiled response templates
+            tpl = get_cache_info()
+            templates = trans.get("MSG_DEBUG_TEMPLATES_L", lang).format(tpl["size"], tpl["max_size"], tpl["hits"], tpl["misses"])
+
+            # Redis batching
+            batch_line = trans.get("MSG_DEBUG_BATCH_L", lang)
+            batches = [batch_line.format(a["name"], a["calls"], a["round_trips"], a["saved"], a["shared"])
+                       for a in get_batch_info()]
+
+            # Log writer
+            sink = log_sink.info()
+            logs = trans.get("MSG_DEBUG_LOG_L", lang).format(sink["queued"], sink["written"], sink["dropped"], sink["rotations"])
+
+            # Shared HTTP client
+            web = self.http.info()
+            http = trans.get("MSG_DEBUG_HTTP_L", lang).format(web["requests"], web["retries"], web["failed"],
+                                                              web["cache_hits"], web["revalidated"], web["cached"])
+
+            state = trans.get("MSG_DEBUG_STATE", lang).format("\n".join(pools + batches + [stores, templates, logs, http]))
+
+            await message.channel.send(fields + "\n" + additional + "\n\n" + state)
 
         # !prefix
         elif startswith(prefix + "prefix"):
@@ -279,7 +302,7 @@ class ServerManagement:
         lang = kwargs.get("lang")
 
         raw_msg = str(self.handler.get_var(member.guild.id, "welcomemsg"))
-        welcome_msg = self.parse_dynamic_response(raw_msg, member, member.guild)
+        welcome_msg = render_event(raw_msg, member, member.guild)
 
         log_c = await self.handle_log_channel(member.guild)
         def_c = await self.default_channel(member.guild)
@@ -316,7 +339,7 @@ class ServerManagement:
 
 
         raw_msg = str(self.handler.get_var(member.guild.id, key))
-        leave_msg = self.parse_dynamic_response(raw_msg, member, member.guild)
+        leave_msg = render_event(raw_msg, member, member.guild)
 
         log_c = await self.handle_log_channel(member.guild)
         def_c = await self.default_channel(member.guild)
@@ -338,49 +361,70 @@ class ServerManagement:
         await self.send_message_failproof(d_chan, self.trans.get("EVENT_SERVER_JOIN", lang))
 
         # Create server settings
-        self.handler.server_setup(guild)
+        await self.handler.server_setup(guild)
 
         # Log
         log_to_file("Joined guild: {}".format(guild.name))
 
     async def on_guild_remove(self, guild, **_):
         # Deletes server data
-        self.handler.delete_server(guild.id)
+        await self.handler.aio.delete_server(guild.id)
 
         # Log
         log_to_file("Removed from guild: {}".format(guild.name))
 
-    async def on_ready(self):
-        await self.client.wait_until_ready()
+    async def warm_up(self):
+        """
+        Reconciles stored guild data with the guilds we're in (bulk, chunked)
+        Runs in the background, events are handled in the meantime
+        """
+        guilds = list(self.client.guilds)
+        started = time.monotonic()
+
+        def progress(done, total):
+            if done == total or done % WARMUP_LOG_EVERY < WARMUP_CHUNK_SIZE:
+                log.info("Checking guild vars: {}/{} ({:.1f} s)".format(done, total, time.monotonic() - started))
+
+        try:
+            result = await self.handler.aio.reconcile_guilds(guilds, progress=progress)
+            log.info("Checked {checked} guilds ({created} new, {updated} updated)".format(**result))
+
+            # Guilds that haven't arrived yet would look like guilds we left
+            await asyncio.sleep(max(0, WARMUP_SETTLE_TIME - (time.monotonic() - started)))
+            if not self.client.is_ready():
+                log.warning("Client is not ready, not removing old guilds")
+                return
 
-        # Delay in case servers are still being received
-        await asyncio.sleep(10)
+            current_ids = {g.id for g in self.client.guilds}
+            removed = await self.handler.aio.remove_old_guilds(current_ids, owns_guild=self.cluster.owns_guild)
+            log.info("Removed {} old guilds".format(removed))
+        except Exception:
+            log.critical("Guild warm-up failed, see bugs.txt")
+            log_to_file(traceback.format_exc(), "bug")
+            return
 
-        log.info("Checking guild vars...")
-        for guild in self.client.guilds:
-            if not self.handler.server_exists(guild.id):
-                self.handler.server_setup(guild)
+        took = time.monotonic() - started
+        log.info("Guild warm-up took {:.1f} s".format(took))
+        log_to_file("Guild warm-up: {} guilds in {:.1f} s".format(len(guilds), took))
 
-            self.handler.check_server_vars(guild)
-        log.info("Done.")
+    async def on_ready(self):
+        await self.client.wait_until_ready()
 
-        log.info("Checking for non-used guild data...")
-        server_ids = [s.id for s in self.client.guilds]
-        self.handler.check_old_servers(server_ids)
-        log.info("Done.")
+        # Not awaited: other on_ready handlers and events don't wait for it
+        self.loop.create_task(self.warm_up())
 
 
 class NanoPlugin:
     name = "Moderator"
-    version = "2"
+    version = "7"
 
     handler = ServerManagement
     events = {
         "on_message": 10,
         "on_ready": 11,
-        "on_member_join": 10,
-        "on_member_remove": 10,
-        "on_guild_join": 9,
+        "on_member_join": {"importance": 10, "independent": True},
+        "on_member_remove": {"importance": 10, "independent": True},
+        "on_guild_join": {"importance": 9, "independent": True},
         "on_guild_remove": 9,
         # type : importance
     }
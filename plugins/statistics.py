@@ -253,6 +253,8 @@ class NanoPlugin:
     version = "2"
 
     handler = Statistics
+    # Tracks users on every message
+    command_routing = False
     events = {
         "on_message": 10,
         "on_plugins_loaded": 5,
@@ -12,8 +12,6 @@ except ImportError:
 
 from json import JSONDecodeError
 
-import aiohttp
-
 from core.stats import MESSAGE, WRONG_ARG
 from core.utils import is_valid_command
 from core.confparser import get_config_parser, CACHE_DIR
@@ -24,6 +22,8 @@ from core.confparser import get_config_parser, CACHE_DIR
 #####
 
 TF2_CACHE = os.path.join(CACHE_DIR, "tf2_cache.temp")
+# The price list is big, downloading it can take a while (seconds)
+PRICES_TIMEOUT = 120
 
 logger = logging.getLogger(__name__)
 
@@ -168,8 +168,9 @@ class CommunityPrices:
     """
     Community (backpack.tf) price parser.
     """
-    def __init__(self, loop, api_key, max_age=2880, allow_cache=True):
+    def __init__(self, loop, http, api_key, max_age=2880, allow_cache=True):
         """
+        :param http: HttpService
         :param api_key: backpack.tf/developer key
         :param max_age: max cache age in s, if allow_local_cache is True (default)
         :param allow_cache: should CommunityPrices be allowed to use cache
@@ -180,6 +181,7 @@ class CommunityPrices:
         self.success = None
 
         self.loop = loop
+        self.http = http
 
         self.is_updating = True
         self.allow_cache = allow_cache
@@ -262,24 +264,24 @@ class CommunityPrices:
         if not params:
             params = self.parameters
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(address, params=params) as resp:
-                if resp.status != 200:
-                    if resp.status == 504:
-                        logger.warning("Got 504: Gateway Timeout, retrying in 5 min")
-                        await asyncio.sleep(60*5)
-                        return await self._request(address, params)
+        # Big response, kept in its own file cache (see _download_data)
+        resp = await self.http.get(address, params=params, timeout=PRICES_TIMEOUT, cache=False)
+        if resp.status != 200:
+            if resp.status == 504:
+                logger.warning("Got 504: Gateway Timeout, retrying in 5 min")
+                await asyncio.sleep(60*5)
+                return await self._request(address, params)
 
-                    elif resp.status == 429:
-                        logger.warning("Got 429: Too Many Requests - retrying in 120 s")
-                        await asyncio.sleep(60*2)
-                        return await self._request(address, params)
+            elif resp.status == 429:
+                logger.warning("Got 429: Too Many Requests - retrying in 120 s")
+                await asyncio.sleep(60*2)
+                return await self._request(address, params)
 
-                    else:
-                        logger.warning("Got {} in response".format(resp.status))
+            else:
+                logger.warning("Got {} in response".format(resp.status))
 
-                else:
-                    return (await resp.json()).get("response")
+        else:
+            return resp.json().get("response")
 
     async def _update_cache(self):
         if not self.is_updating:
@@ -333,7 +335,7 @@ class TeamFortress:
             if not key:
                 raise configparser.NoOptionError
 
-            self.tf = CommunityPrices(self.loop, api_key=key)
+            self.tf = CommunityPrices(self.loop, kwargs.get("http"), api_key=key)
         except (configparser.NoSectionError, configparser.NoOptionError):
             logger.critical("No api key for bp.tf, disabling")
             raise RuntimeError
@@ -388,7 +390,7 @@ class TeamFortress:
 
 class NanoPlugin:
     name = "Team Fortress 2"
-    version = "21"
+    version = "22"
 
     handler = TeamFortress
     events = {
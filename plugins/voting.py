@@ -1,6 +1,8 @@
 # coding=utf-8
 import asyncio
 import logging
+import time
+import traceback
 
 try:
     from rapidjson import loads, dumps
@@ -37,28 +39,126 @@ BLOCK_EMOJI = "📛"
 # QUESTION_EMOJI = "\U0000003F"
 QUESTION_EMOJI = "❔"
 
+# Reaction votes: 1️⃣ - 🔟 (keycaps without the variation selector, see _option_from_emoji)
+OPTION_EMOJIS = ["{}\u20e3".format(a) for a in range(1, 10)] + ["\U0001F51F"]
+
+# Reaction votes are counted in redis every FLUSH_INTERVAL seconds or as soon as FLUSH_SIZE are waiting
+FLUSH_INTERVAL = 2
+FLUSH_SIZE = 500
+# Live results on the poll message are edited at most this often (seconds)
+EDIT_INTERVAL = 5
+
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
 
 
+POLL_KEY = "voting:{}"
+VOTERS_KEY = "voting:{}:voters"
+VOTES_KEY = "voting:{}:votes"
+
+# KEYS: poll, voters, votes / ARGV: option index, user id
+# Returns 1 (counted), -1 (already voted), 0 (no poll or no such option)
+VOTE_SCRIPT = """
+local options = redis.call("HGET", KEYS[1], "options")
+if not options then
+    return 0
+end
+
+local index = tonumber(ARGV[1])
+if index == nil or index < 0 or index >= tonumber(options) then
+    return 0
+end
+
+if redis.call("SADD", KEYS[2], ARGV[2]) == 0 then
+    return -1
+end
+
+redis.call("HINCRBY", KEYS[3], ARGV[1], 1)
+return 1
+"""
+
+# KEYS: poll, voters, votes / ARGV: option index, user id, option index, user id, ...
+# Returns the amount of votes counted (voters that already voted and invalid options are skipped)
+BATCH_VOTE_SCRIPT = """
+local options = redis.call("HGET", KEYS[1], "options")
+if not options then
+    return 0
+end
+options = tonumber(options)
+
+local added = {}
+local counted = 0
+for i = 1, #ARGV, 2 do
+    local index = tonumber(ARGV[i])
+    if index ~= nil and index >= 0 and index < options and redis.call("SADD", KEYS[2], ARGV[i + 1]) == 1 then
+        added[index] = (added[index] or 0) + 1
+        counted = counted + 1
+    end
+end
+
+for index, amount in pairs(added) do
+    redis.call("HINCRBY", KEYS[3], index, amount)
+end
+return counted
+"""
+
+
 class RedisVoteHandler:
     """
-    Type: hash
     Namespace: voting:*
 
     Layout:
+        voting:<guild_id> (hash)
+            title: string
+            choices: json-encoded list(choices)
+            options: int (amount of choices)
+            author: int (author id)
+            message: int (id of the poll message, reactions on it are votes)
+
+        voting:<guild_id>:voters (set) - ids of everyone who voted
+        voting:<guild_id>:votes (hash) - option index: amount
 
-        voters: list(voter_ids)
-        title: string
-        votes: json-encoded dict(index: amount)
-        choices: json-encoded list(choices)
-        author: int (author id)
+    A vote is one atomic script (SADD + HINCRBY), so it costs the same no matter how many people voted.
     """
     def __init__(self, handler):
         self.redis = handler.get_plugin_data_manager(namespace="voting")
+        self._vote = self.redis.register_script(VOTE_SCRIPT, use_namespace=False)
+        self._batch_vote = self.redis.register_script(BATCH_VOTE_SCRIPT, use_namespace=False)
+
+        self._convert_old_polls()
+
+    @staticmethod
+    def _keys(server_id) -> tuple:
+        return POLL_KEY.format(server_id), VOTERS_KEY.format(server_id), VOTES_KEY.format(server_id)
+
+    def _get_polls(self) -> list:
+        # Only the poll hashes, not their voters/votes
+        return [a.split(":")[1] for a in self.redis.scan_iter("*") if a.count(":") == 1]
+
+    def _convert_old_polls(self):
+        """
+        Migration: polls started before voters and votes were native redis types kept them as json in the poll hash
+        """
+        for server_id in self._get_polls():
+            voters, votes, choices = self.redis.hmget(server_id, "voters", "votes", "choices")
+            if voters is None or votes is None:
+                continue
+
+            poll, voters_key, votes_key = self._keys(server_id)
+            voters, votes = loads(voters), loads(votes)
+
+            pipe = self.redis.pipeline()
+            if voters:
+                pipe.sadd(voters_key, *voters)
+            pipe.hset(votes_key, mapping={str(i): a for i, a in enumerate(votes)})
+            pipe.hset(poll, "options", len(loads(choices)))
+            pipe.hdel(poll, "voters", "votes")
+            pipe.execute()
+
+            log.info("Converted poll {} ({} voters)".format(server_id, len(voters)))
 
     def get_vote_amount(self) -> int:
-        return len(self.redis.scan_iter("*"))
+        return len(self._get_polls())
 
     def start_vote(self, author_id: int, server_id: int, title: str, choices: list):
         # Do not automatically overwrite
@@ -67,15 +167,20 @@ class RedisVoteHandler:
 
         payload = {
             "author": author_id,
-            "votes": dumps([0 for _ in range(len(choices))]),
-            # Can safely be [] without using dumps()
-            "voters": "[]",
             "title": str(title),
             "choices": dumps(choices),
-            # no more inprogress, is pointless
+            "options": len(choices),
         }
 
-        return self.redis.hmset(server_id, payload)
+        poll, voters_key, votes_key = self._keys(server_id)
+
+        pipe = self.redis.pipeline()
+        # Leftovers of an earlier poll must not count towards this one
+        pipe.delete(voters_key, votes_key)
+        pipe.hset(poll, mapping=payload)
+        pipe.execute()
+
+        return True
 
     def in_progress(self, server_id):
         return self.redis.exists(server_id)
@@ -85,57 +190,227 @@ class RedisVoteHandler:
         Adds a vote
         :return:
             -1 -> person already voted
-            False -> no such option
+            False -> no such option (or no poll)
             True -> everything is ok
         """
-        if not self.in_progress(server_id):
-            return False
-
-        data = decode(self.redis.hgetall(server_id))
-        voters, vote_counts, options = loads(data.get("voters")), loads(data.get("votes")), loads(data.get("choices"))
-
-        # Missing option
-        if o_index > len(options) -1:
-            return False
         # Negative number
         if o_index < 0:
             return False
 
-        # Add the voter to the list
-        if user_id in voters:
+        res = self._vote(keys=self._keys(server_id), args=(o_index, user_id))
+
+        if res == -1:
             # Error: That person has already voted
             return -1
-        else:
-            voters.append(user_id)
 
-        # Add +1 to option at index
-        vote_counts[o_index] += 1
+        return res == 1
 
-        # Choice list doesn't change
-        payload = {
-            "votes": dumps(vote_counts),
-            "voters": dumps(voters),
-        }
+    def add_votes(self, server_id: int, ballots: list) -> int:
+        """
+        Adds many votes at once (one round trip)
+        :param ballots: list((option index, user_id))
+        :return: amount of votes counted
+        """
+        args = []
+        for o_index, user_id in ballots:
+            args.extend((o_index, user_id))
+
+        return self._batch_vote(keys=self._keys(server_id), args=args)
 
-        return self.redis.hmset(server_id, payload)
+    def set_poll_message(self, server_id: int, message_id: int):
+        return self.redis.hset(server_id, "message", message_id)
+
+    def get_poll_message(self, server_id: int):
+        message_id = self.redis.hget(server_id, "message")
+        return int(message_id) if message_id else None
 
     def get_votes(self, server_id) -> dict:
         """
         :return dict(vote_text: amount)
         """
-        by_index = loads(self.redis.hget(server_id, "votes"))
-        names = loads(self.redis.hget(server_id, "choices"))
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hget(POLL_KEY.format(server_id), "choices")
+        pipe.hgetall(VOTES_KEY.format(server_id))
+        names, by_index = pipe.execute()
 
-        return {names[c]: amount for c, amount in enumerate(by_index)}
+        by_index = decode(by_index)
+        return {name: int(by_index.get(str(c), 0)) for c, name in enumerate(loads(names))}
 
     def get_title(self, server_id):
         return self.redis.hget(server_id, "title")
 
+    def get_results(self, server_id) -> tuple:
+        """
+        :return tuple(title, dict(vote_text: amount))
+        """
+        return self.get_title(server_id), self.get_votes(server_id)
+
     def get_choices(self, server_id: int) -> list:
         return loads(self.redis.hget(server_id, "choices"))
 
     def end_voting(self, server_id: int):
-        return bool(self.redis.delete(server_id))
+        pipe = self.redis.pipeline()
+        pipe.delete(*self._keys(server_id))
+        return bool(pipe.execute()[0])
+
+
+class LivePoll:
+    __slots__ = ("server_id", "message", "lang", "dirty", "edited")
+
+    def __init__(self, server_id: int, message, lang: str):
+        self.server_id = server_id
+        self.message = message
+        self.lang = lang
+
+        # Has votes the message doesn't show yet
+        self.dirty = False
+        self.edited = 0
+
+
+class ReactionTally:
+    """
+    Reaction votes on poll messages
+
+    Reactions are only collected here (a user's first reaction counts), a background task
+    counts them in redis in batches and edits the poll messages with the results.
+    """
+    def __init__(self, vote: RedisVoteHandler, trans, executor, loop):
+        self.vote = vote
+        self.trans = trans
+        self.executor = executor
+        self.loop = loop
+
+        # message_id: LivePoll
+        self.polls = {}
+        # server_id: dict(user_id: option index)
+        self.pending = {}
+        self.pending_amount = 0
+
+        self.counted = 0
+        self.flushes = 0
+
+        self._wake = asyncio.Event()
+        self._task = None
+        # One flush at a time: a guild's votes can't be on their way to redis while its poll ends
+        self._flush_lock = asyncio.Lock()
+
+    def track(self, server_id: int, message, lang: str) -> LivePoll:
+        poll = self.polls[message.id] = LivePoll(server_id, message, lang)
+
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self.run())
+
+        return poll
+
+    def forget(self, server_id: int):
+        self.polls = {m_id: poll for m_id, poll in self.polls.items() if poll.server_id != server_id}
+        self.pending_amount -= len(self.pending.pop(server_id, {}))
+
+    def add(self, poll: LivePoll, user_id: int, o_index: int):
+        ballots = self.pending.setdefault(poll.server_id, {})
+        if user_id in ballots:
+            return
+
+        ballots[user_id] = o_index
+        self.pending_amount += 1
+
+        if self.pending_amount >= FLUSH_SIZE:
+            self._wake.set()
+
+    async def flush(self, server_id: int=None):
+        """
+        Counts waiting reaction votes (of one guild or all of them)
+        When it returns, every vote of the guild that was collected before the call is counted
+        """
+        async with self._flush_lock:
+            if server_id is not None:
+                batches = {server_id: self.pending.pop(server_id)} if server_id in self.pending else {}
+            else:
+                batches, self.pending = self.pending, {}
+
+            self.pending_amount -= sum(len(ballots) for ballots in batches.values())
+
+            for s_id in list(batches):
+                try:
+                    await self._count(s_id, batches[s_id])
+                except Exception:
+                    self._restore(batches)
+                    raise
+
+                del batches[s_id]
+
+    def _restore(self, batches: dict):
+        # Back to pending for the next flush (the voters set keeps anyone from being counted twice)
+        for s_id, ballots in batches.items():
+            waiting = self.pending.setdefault(s_id, {})
+            for user_id, o_index in ballots.items():
+                if user_id not in waiting:
+                    waiting[user_id] = o_index
+                    self.pending_amount += 1
+
+    async def _count(self, s_id: int, ballots: dict):
+        counted = await self.executor.run_io(self.vote.add_votes, s_id, [(o, u) for u, o in ballots.items()])
+        self.counted += counted
+        self.flushes += 1
+
+        if counted:
+            for poll in self.polls.values():
+                if poll.server_id == s_id:
+                    poll.dirty = True
+
+    async def run(self):
+        while self.polls:
+            try:
+                await asyncio.wait_for(self._wake.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+            try:
+                await self.flush()
+                await self._update_messages()
+            except Exception:
+                log.warning("Could not count reaction votes: {}".format(traceback.format_exc()))
+
+    async def _update_messages(self):
+        now = time.monotonic()
+
+        for poll in list(self.polls.values()):
+            if not poll.dirty or now - poll.edited < EDIT_INTERVAL:
+                continue
+
+            poll.dirty = False
+            poll.edited = now
+
+            title, votes = await self.executor.run_io(self.vote.get_results, poll.server_id)
+            try:
+                await poll.message.edit(embed=make_results_embed(self.trans, poll.lang, title, votes))
+            except errors.NotFound:
+                self.polls.pop(poll.message.id, None)
+            except errors.HTTPException as e:
+                log.warning("Could not update poll results: {}".format(e))
+
+
+def make_results_embed(trans, lang: str, title: str, votes: dict) -> Embed:
+    embed = Embed(title="**{}**".format(title), colour=Colour(0x303F9F),
+                  description=trans.get("MSG_VOTING_AMOUNT", lang).format(sum(votes.values())))
+
+    for name, val in votes.items():
+        # Zero-width space
+        dotted = add_dots(name, max_len=240) or "\u200B"
+        embed.add_field(name=dotted, value=trans.get("MSG_VOTING_AMOUNT2", lang).format(val))
+
+    return embed
+
+
+def _option_from_emoji(emoji) -> int:
+    """
+    :return: option index or -1 if the emoji isn't one of OPTION_EMOJIS
+    """
+    try:
+        return OPTION_EMOJIS.index(str(emoji).replace("\ufe0f", ""))
+    except ValueError:
+        return -1
 
 
 class Vote:
@@ -145,8 +420,11 @@ class Vote:
         self.client = kwargs.get("client")
         self.stats = kwargs.get("stats")
         self.trans = kwargs.get("trans")
+        self.loop = kwargs.get("loop")
+        self.executor = kwargs.get("executor")
 
         self.vote = RedisVoteHandler(self.handler)
+        self.tally = ReactionTally(self.vote, self.trans, self.executor, self.loop)
 
     async def on_message(self, message, **kwargs):
         trans = self.trans
@@ -236,7 +514,18 @@ class Vote:
             choices = "\n\n".join(["[{}]\n{}".format(en + 1, ch) for en, ch in
                                    enumerate(self.vote.get_choices(message.guild.id))])
 
-            await message.channel.send(trans.get("MSG_VOTING_STARTED", lang).format(title, choices))
+            poll = await message.channel.send(trans.get("MSG_VOTING_STARTED", lang).format(title, choices) + "\n" +
+                                              trans.get("MSG_VOTING_REACT_HINT", lang).format(prefix))
+
+            # Reactions on the poll message are votes
+            self.vote.set_poll_message(message.guild.id, poll.id)
+            self.tally.track(message.guild.id, poll, lang)
+
+            try:
+                for emoji in OPTION_EMOJIS[:len(items)]:
+                    await poll.add_reaction(emoji)
+            except errors.Forbidden:
+                pass
 
         # !poll end
         elif startswith(prefix + "poll end"):
@@ -264,19 +553,16 @@ class Vote:
 
             await msg.delete()
 
+            # Count reaction votes that are still waiting
+            await self.tally.flush(message.guild.id)
+
             votes = self.vote.get_votes(message.guild.id)
             title = self.vote.get_title(message.guild.id)
 
-            total_votes = sum(votes.values())
-
-            embed = Embed(title="**{}**".format(title), colour=Colour(0x303F9F), description=trans.get("MSG_VOTING_AMOUNT", lang).format(total_votes))
-
-            for name, val in votes.items():
-                # Zero-width space
-                dotted = add_dots(name, max_len=240) or "\u200B"
-                embed.add_field(name=dotted, value=trans.get("MSG_VOTING_AMOUNT2", lang).format(val))
+            embed = make_results_embed(trans, lang, title, votes)
 
             # Actually end the voting
+            self.tally.forget(message.guild.id)
             self.vote.end_voting(message.guild.id)
 
             try:
@@ -291,6 +577,8 @@ class Vote:
                 await message.channel.send(trans.get("MSG_VOTING_NO_PROGRESS", lang))
                 return
 
+            await self.tally.flush(message.guild.id)
+
             header = filter_text(self.vote.get_title(message.guild.id))
             votes = sum(self.vote.get_votes(message.guild.id).values())
 
@@ -351,13 +639,53 @@ class Vote:
 
             self.stats.add(VOTE)
 
+    async def on_raw_reaction_add(self, payload, **_):
+        # Raw: polls started before a restart aren't in the message cache, on_reaction_add never fires for them
+        if payload.guild_id is None or payload.user_id == self.client.user.id:
+            return
+        if payload.member is not None and payload.member.bot:
+            return
+
+        o_index = _option_from_emoji(payload.emoji)
+        if o_index == -1:
+            return
+
+        poll = self.tally.polls.get(payload.message_id)
+        if poll is None:
+            # Polls started before a restart (the poll hash keeps the id of its message)
+            if await self.executor.run_io(self.vote.get_poll_message, payload.guild_id) != payload.message_id:
+                return
+
+            channel = self.client.get_channel(payload.channel_id)
+            if channel is None:
+                return
+
+            try:
+                message = await channel.fetch_message(payload.message_id)
+            except errors.HTTPException:
+                return
+
+            lang = await self.handler.aio.get_lang(payload.guild_id)
+            poll = self.tally.polls.get(payload.message_id) or self.tally.track(payload.guild_id, message, lang)
+
+        self.tally.add(poll, payload.user_id, o_index)
+        self.stats.add(VOTE)
+
+    async def on_shutdown(self):
+        # Count the reaction votes that are still waiting (also runs when the plugin is reloaded)
+        await self.tally.flush()
+
 
 class NanoPlugin:
     name = "Voting"
-    version = "28"
+    version = "34"
 
     handler = Vote
     events = {
         "on_message": 10,
+        # Only queues the vote, the tally is counted in batches
+        "on_raw_reaction_add": {"importance": 10, "independent": True},
+        # Before developer.py makes redis save
+        "on_shutdown": 5,
         # type : importance
     }
@@ -1,15 +1,9 @@
 # coding=utf-8
 import logging
-import aiohttp
 
 from typing import Union
 from discord import Message
 
-try:
-    from rapidjson import loads
-except ImportError:
-    from json import loads
-
 from core.stats import MESSAGE
 from core.utils import is_valid_command, add_dots, filter_text
 from core.confparser import get_config_parser
@@ -32,17 +26,9 @@ commands = {
 valid_commands = commands.keys()
 
 
-def build_url(url, **fields):
-    if not url.endswith("?"):
-        url += "?"
-
-    field_list = ["{}={}".format(key, value) for key, value in fields.items()]
-    return str(url) + "&".join(field_list)
-
-
 class WikipediaParser:
-    def __init__(self, loop):
-        self.session = aiohttp.ClientSession(loop=loop)
+    def __init__(self, http):
+        self.http = http
         self.endpoint = "https://en.wikipedia.org/w/api.php"
 
     async def get_definition(self, query: str) -> Union[str, None]:
@@ -71,18 +57,18 @@ class WikipediaParser:
             "exlimit": 1
         }
 
-        async with self.session.get(build_url(self.endpoint, **payload)) as resp:
-            if 200 < resp.status <= 300:
-                # Anything other than 200 is not good
-                raise ConnectionError("WikipediaParser status code: {}".format(resp.status))
+        resp = await self.http.get(self.endpoint, params=payload)
+        if 200 < resp.status <= 300:
+            # Anything other than 200 is not good
+            raise ConnectionError("WikipediaParser status code: {}".format(resp.status))
 
-            # Converts to json format
-            return await resp.json(loads=loads, content_type=None)
+        # Converts to json format
+        return resp.json()
 
 
 class UrbanDictionary:
-    def __init__(self, loop):
-        self.session = aiohttp.ClientSession(loop=loop)
+    def __init__(self, http):
+        self.http = http
         self.endpoint = "http://api.urbandictionary.com/v0/define"
 
     async def urban_dictionary(self, query: str) -> Union[str, None]:
@@ -99,13 +85,13 @@ class UrbanDictionary:
             "term": query
         }
 
-        async with self.session.get(build_url(self.endpoint, **payload)) as resp:
-            if 200 < resp.status <= 300:
-                # Anything other than 200 is not good
-                raise ConnectionError("UrbanDictionary status code: {}".format(resp.status))
+        resp = await self.http.get(self.endpoint, params=payload)
+        if 200 < resp.status <= 300:
+            # Anything other than 200 is not good
+            raise ConnectionError("UrbanDictionary status code: {}".format(resp.status))
 
-            # Converts to json format
-            return await resp.json(loads=loads, content_type=None)
+        # Converts to json format
+        return resp.json()
 
 
 class Definitions:
@@ -116,8 +102,10 @@ class Definitions:
         self.trans = kwargs.get("trans")
         self.loop = kwargs.get("loop")
 
-        self.wiki = WikipediaParser(self.loop)
-        self.urban = UrbanDictionary(self.loop)
+        self.http = kwargs.get("http")
+
+        self.wiki = WikipediaParser(self.http)
+        self.urban = UrbanDictionary(self.http)
 
     async def on_message(self, message, **kwargs):
         assert isinstance(message, Message)
@@ -188,7 +176,7 @@ class Definitions:
 
 class NanoPlugin:
     name = "Wiki/Urban Commands"
-    version = "10"
+    version = "11"
 
     handler = Definitions
     events = {
@@ -0,0 +1,42 @@
+# coding=utf-8
+
+# Change current directory to the root
+import os
+import sys
+os.chdir("..")
+
+from pickle import load
+
+import numpy as np
+
+#########################################
+# Spam model converter
+# Converts a pickled gibberish model (data/positions/threshold) into plugins/spam_model.npy
+#
+# Layout of the .npy file: float64 array of shape (N, N + 1)
+#   [:, :N] - bigram occurrences, rows/columns ordered like accepted_chars in plugins/moderator.py
+#   [:, N]  - threshold for every first character
+#########################################
+
+ACCEPTED_CHARS = "abcdefghijklmnopqrstuvwxyz "
+
+source = sys.argv[1] if len(sys.argv) > 1 else "plugins/spam_model.pki"
+target = "plugins/spam_model.npy"
+
+with open(source, "rb") as model_file:
+    model = load(model_file)
+
+size = len(ACCEPTED_CHARS)
+positions = model["positions"]
+
+out = np.zeros((size, size + 1), dtype=np.float64)
+
+for a, char_a in enumerate(ACCEPTED_CHARS):
+    row = positions[char_a]
+    for b, char_b in enumerate(ACCEPTED_CHARS):
+        out[a, b] = model["data"][row][positions[char_b]]
+
+    out[a, size] = model["threshold"][row]
+
+np.save(target, out)
+print("Saved {} ({}x{})".format(target, *out.shape))
@@ -0,0 +1,120 @@
+# coding=utf-8
+
+# Change current directory to the root
+import os
+import sys
+os.chdir("..")
+sys.path.append(os.getcwd())
+
+import time
+import random
+import string
+
+from core.router import CustomCommandIndex
+
+#########################################
+# Custom command lookup benchmark
+# Compares the old HKEYS + startswith loop of Commons.on_message with CustomCommandIndex
+# for guilds at the custom command limit (see CMD_LIMIT and CMD_LIMIT_T in plugins/admin.py).
+#
+# The in-memory part runs everywhere, the redis part only if redis-py is installed
+# and a server is listening on localhost:6379 (uses db 15, key "commands:benchmark").
+#########################################
+
+CMD_LIMIT = 40
+CMD_LIMIT_T = 40
+
+GUILD_AMOUNT = 200
+MESSAGE_AMOUNT = 20000
+
+random.seed(11)
+
+
+def random_text(min_len, max_len, alphabet=string.ascii_lowercase + " "):
+    return "".join(random.choice(alphabet) for _ in range(random.randint(min_len, max_len)))
+
+
+def make_commands():
+    commands = {}
+    while len(commands) < CMD_LIMIT:
+        commands[random.choice("!?.") + random_text(2, CMD_LIMIT_T - 2, string.ascii_lowercase)] = random_text(5, 200)
+
+    return commands
+
+
+def old_lookup(keys, commands, content):
+    # Same as the old loop: keys from HKEYS, then HGET for the match
+    for k in keys:
+        k = str(k)
+
+        if content.startswith(k):
+            return commands[k]
+
+    return None
+
+
+def measure(name, fn, messages):
+    start = time.perf_counter()
+    hits = sum(1 for guild, m in messages if fn(guild, m) is not None)
+    took = time.perf_counter() - start
+
+    print("{:<32} {:>8.1f} ms  ({:.2f} us/message, {} hits)".format(name, took * 1000, took / len(messages) * 1e6, hits))
+
+
+print("------------------------")
+print("Custom command benchmark")
+print("------------------------")
+
+guilds = [make_commands() for _ in range(GUILD_AMOUNT)]
+
+messages = []
+for _ in range(MESSAGE_AMOUNT):
+    guild = random.randrange(GUILD_AMOUNT)
+    # Roughly every twentieth message triggers a custom command
+    if random.random() < 0.05:
+        content = random.choice(list(guilds[guild].keys())) + random_text(0, 20)
+    else:
+        content = random.choice(["!", "", "", "hey "]) + random_text(5, 120)
+
+    messages.append((guild, content))
+
+print("{} guilds with {} commands each, {} messages\n".format(GUILD_AMOUNT, CMD_LIMIT, MESSAGE_AMOUNT))
+
+start = time.perf_counter()
+indexes = [CustomCommandIndex(c) for c in guilds]
+print("Building the indexes took {:.1f} ms\n".format((time.perf_counter() - start) * 1000))
+
+key_lists = [list(c.keys()) for c in guilds]
+
+measure("HKEYS loop (old, no redis)", lambda g, m: old_lookup(key_lists[g], guilds[g], m), messages)
+measure("CustomCommandIndex", lambda g, m: indexes[g].match(m), messages)
+
+# With a real redis server: the old path needs one round trip per message (two on a match)
+try:
+    import redis
+    r = redis.StrictRedis(db=15)
+    r.ping()
+except Exception:
+    print("\nredis not available, skipping the round trip comparison")
+    sys.exit(0)
+
+print()
+r.delete("commands:benchmark")
+r.hset("commands:benchmark", mapping=guilds[0])
+
+
+def old_redis_lookup(_, content):
+    for k in r.hkeys("commands:benchmark"):
+        k = k.decode()
+
+        if content.startswith(k):
+            return r.hget("commands:benchmark", k)
+
+    return None
+
+
+redis_messages = [(0, m) for _, m in messages[:2000]]
+measure("HKEYS loop (old, redis)", old_redis_lookup, redis_messages)
+measure("CustomCommandIndex", lambda g, m: indexes[0].match(m), redis_messages)
+
+r.delete("commands:benchmark")
@@ -0,0 +1,138 @@
+# coding=utf-8
+
+# Change current directory to the root
+import os
+import sys
+os.chdir("..")
+sys.path.append(os.getcwd())
+
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+
+from core.httpclient import HttpService
+
+#########################################
+# HttpService check and benchmark
+# Runs against a local stub server (no internet needed):
+#   1. connection reuse: a new ClientSession per request (old tf2.py / minecraft.py) vs the shared service
+#   2. caching: Cache-Control max-age, ETag revalidation (304) and no-store
+#   3. retries: 503 responses followed by a 200
+#########################################
+
+HOST = "127.0.0.1"
+PORT = 18321
+BASE = "http://{}:{}".format(HOST, PORT)
+
+REQUESTS = 500
+
+
+class StubServer:
+    def __init__(self):
+        self.hits = {}
+        # Transports seen = TCP connections used
+        self.transports = set()
+        self.flaky_left = 0
+
+    def _hit(self, name, request):
+        self.hits[name] = self.hits.get(name, 0) + 1
+        self.transports.add(id(request.transport))
+
+    async def plain(self, request):
+        self._hit("plain", request)
+        return web.json_response({"ok": True}, headers={"Cache-Control": "no-store"})
+
+    async def fresh(self, request):
+        self._hit("fresh", request)
+        return web.json_response({"fresh": True}, headers={"Cache-Control": "max-age=60"})
+
+    async def etag(self, request):
+        self._hit("etag", request)
+        if request.headers.get("If-None-Match") == "\"v1\"":
+            return web.Response(status=304, headers={"ETag": "\"v1\""})
+
+        return web.json_response({"etag": True}, headers={"ETag": "\"v1\"", "Cache-Control": "no-cache"})
+
+    async def flaky(self, request):
+        self._hit("flaky", request)
+        if self.flaky_left > 0:
+            self.flaky_left -= 1
+            return web.Response(status=503, headers={"Retry-After": "0"})
+
+        return web.json_response({"flaky": "recovered"})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/plain", self.plain)
+        app.router.add_get("/fresh", self.fresh)
+        app.router.add_get("/etag", self.etag)
+        app.router.add_get("/flaky", self.flaky)
+
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, HOST, PORT).start()
+
+        return runner
+
+
+async def per_request_sessions():
+    for _ in range(REQUESTS):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(BASE + "/plain") as resp:
+                await resp.read()
+
+
+async def shared_service(http):
+    for _ in range(REQUESTS):
+        await http.get(BASE + "/plain")
+
+
+async def main():
+    stub = StubServer()
+    runner = await stub.start()
+
+    http = HttpService(asyncio.get_event_loop())
+
+    try:
+        # 1. Connection reuse
+        print("Connection reuse ({} sequential GETs)".format(REQUESTS))
+        for name, fn in (("session per request", per_request_sessions), ("HttpService", lambda: shared_service(http))):
+            stub.transports.clear()
+            start = time.perf_counter()
+            await fn()
+            took = time.perf_counter() - start
+            print("  {:<20} {:>7.1f} ms total, {:>6.3f} ms/request, {} TCP connections".format(
+                name, took * 1000, took / REQUESTS * 1000, len(stub.transports)))
+
+        # 2. Caching
+        print("\nCaching (10 GETs each)")
+        for path in ("/fresh", "/etag", "/plain"):
+            stub.hits.clear()
+            for _ in range(10):
+                resp = await http.get(BASE + path)
+                assert resp.status == 200 and resp.json()
+
+            print("  {:<8} server saw {} requests".format(path, stub.hits.get(path[1:], 0)))
+
+        info = http.info()
+        print("  cache hits: {}, revalidated (304): {}".format(info["cache_hits"], info["revalidated"]))
+
+        # 3. Retries
+        stub.hits.clear()
+        stub.flaky_left = 2
+        resp = await http.get(BASE + "/flaky", cache=False)
+        print("\nRetries: status {} after {} requests ({})".format(resp.status, stub.hits["flaky"], resp.json()["flaky"]))
+
+        stub.flaky_left = 5
+        resp = await http.get(BASE + "/flaky", cache=False)
+        print("Retries exhausted: status {} (retries={})".format(resp.status, http.info()["retries"]))
+
+    finally:
+        await http.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
@@ -0,0 +1,90 @@
+# coding=utf-8
+
+# Change current directory to the root
+import os
+import sys
+os.chdir("..")
+sys.path.append(os.getcwd())
+
+import random
+import string
+import time
+
+from core.pagination import Pages, PAGE_LENGTH
+
+#########################################
+# Pagination benchmark
+# The old make_pages_from_dict (sums the page for every line, formats every line) vs Pages
+# (running length, lines formatted only for the page that is shown), for custom command lists.
+#
+#   build: split all commands into pages
+#   page 40: build + render the page `!cmd list 40` shows (or the last one)
+#########################################
+
+SIZES = (100, 1000, 10000)
+REPEAT = 5
+
+random.seed(24)
+
+
+def old_make_pages_from_dict(item_dict: dict):
+    cmd_list = {0: []}
+    c_page = 0
+
+    for trigger, value in item_dict.items():
+        fm = "{} : {}".format(trigger, value)
+
+        if not cmd_list.get(c_page):
+            cmd_list[c_page] = []
+
+        if (sum([len(a) for a in cmd_list[c_page]]) + len(fm)) > PAGE_LENGTH:
+            c_page += 1
+            cmd_list[c_page] = []
+
+        cmd_list[c_page].append(fm)
+
+    return cmd_list, c_page
+
+
+def random_text(min_len, max_len):
+    return "".join(random.choice(string.ascii_letters) for _ in range(random.randint(min_len, max_len)))
+
+
+def best_of(fn):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return min(times) * 1000
+
+
+def main():
+    print("{:>6} {:>7} | {:>10} {:>10} | {:>10} {:>10}".format("cmds", "pages", "old build", "new build",
+                                                             "old pg 40", "new pg 40"))
+
+    for size in SIZES:
+        commands = {random_text(3, 20): random_text(5, 60) for _ in range(size)}
+
+        pages = Pages(commands.items(), "{} : {}")
+        page = min(39, len(pages) - 1)
+
+        # Both split the same way (the old one doesn't count the newlines)
+        old_pages, _ = old_make_pages_from_dict(commands)
+
+        def old_page():
+            cmd_list, _ = old_make_pages_from_dict(commands)
+            return "\n".join(cmd_list[min(page, len(cmd_list) - 1)])
+
+        def new_page():
+            return Pages(commands.items(), "{} : {}").render(page)
+
+        print("{:>6} {:>3}/{:<3} | {:>7.2f} ms {:>7.2f} ms | {:>7.2f} ms {:>7.2f} ms".format(
+            size, len(old_pages), len(pages),
+            best_of(lambda: old_make_pages_from_dict(commands)), best_of(lambda: Pages(commands.items(), "{} : {}")),
+            best_of(old_page), best_of(new_page)))
+
+
+if __name__ == "__main__":
+    main()
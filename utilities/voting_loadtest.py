@@ -0,0 +1,172 @@
+# coding=utf-8
+
+# Change current directory to the root
+import os
+import sys
+os.chdir("..")
+sys.path.append(os.getcwd())
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+
+try:
+    from rapidjson import loads, dumps
+except ImportError:
+    from json import loads, dumps
+
+from core.serverhandler import RedisPluginDataManager
+from core.utils import decode
+from plugins.voting import RedisVoteHandler, FLUSH_SIZE
+
+#########################################
+# Voting load test
+# Many voters voting at the same time in one poll, old json tally (HGETALL + HMSET) vs the atomic script.
+# Needs a redis server on localhost:6379, uses db 15 (flushed at the start and the end).
+#
+#   1. concurrency: VOTERS voters through THREADS connections, counts votes that got lost
+#   2. cost per vote: time of one vote with an empty poll and with PREFILLED voters
+#   3. reaction votes: one script call per vote (the !vote path) vs batches of FLUSH_SIZE (ReactionTally)
+#      Only the redis side, the !vote path also costs a gateway message, the plugin chain and a reaction per vote.
+#########################################
+
+REDIS_HOST = "localhost"
+REDIS_PORT = 6379
+REDIS_DB = 15
+
+VOTERS = 5000
+THREADS = 64
+OPTIONS = 5
+PREFILLED = 50000
+
+GUILD_ID = 1
+
+random.seed(21)
+
+
+class LoadTestHandler:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def get_plugin_data_manager(self, namespace):
+        return RedisPluginDataManager(self.pool, namespace)
+
+
+# The old RedisVoteHandler layout and plus_one (voters and votes as json in the poll hash)
+def old_start_vote(r, server_id, choices):
+    r.hset("voting:{}".format(server_id), mapping={"author": 0, "votes": dumps([0] * len(choices)), "voters": "[]",
+                                                    "title": "test", "choices": dumps(choices)})
+
+
+def old_plus_one(r, o_index, user_id, server_id):
+    data = decode(r.hgetall("voting:{}".format(server_id)))
+    voters, vote_counts = loads(data.get("voters")), loads(data.get("votes"))
+
+    if user_id in voters:
+        return -1
+    voters.append(user_id)
+    vote_counts[o_index] += 1
+
+    return r.hset("voting:{}".format(server_id), mapping={"votes": dumps(vote_counts), "voters": dumps(voters)})
+
+
+def old_count(r, server_id):
+    return sum(loads(decode(r.hget("voting:{}".format(server_id), "votes"))))
+
+
+def run_concurrently(fn, voters):
+    ballots = [(random.randrange(OPTIONS), user_id) for user_id in voters]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(lambda b: fn(b[0], b[1]), ballots))
+
+    return time.perf_counter() - start
+
+
+def time_one_vote(fn, amount=200, first_id=10 ** 9):
+    start = time.perf_counter()
+    for user_id in range(first_id, first_id + amount):
+        fn(random.randrange(OPTIONS), user_id)
+
+    return (time.perf_counter() - start) / amount * 1000
+
+
+def main():
+    pool = redis.ConnectionPool(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, max_connections=THREADS + 4)
+    r = redis.StrictRedis(connection_pool=pool)
+    r.flushdb()
+
+    votes = RedisVoteHandler(LoadTestHandler(pool))
+    choices = ["option {}".format(i) for i in range(OPTIONS)]
+    voters = list(range(1, VOTERS + 1))
+
+    try:
+        print("1. {} voters, {} threads".format(VOTERS, THREADS))
+
+        old_start_vote(r, GUILD_ID, choices)
+        took = run_concurrently(lambda o, u: old_plus_one(r, o, u, GUILD_ID), voters)
+        counted = old_count(r, GUILD_ID)
+        print("  json tally:    {:>7.0f} votes/s, {} of {} votes counted ({} lost)".format(
+            VOTERS / took, counted, VOTERS, VOTERS - counted))
+        r.flushdb()
+
+        votes.start_vote(0, GUILD_ID, "test", choices)
+        took = run_concurrently(lambda o, u: votes.plus_one(o, u, GUILD_ID), voters)
+        counted = sum(votes.get_votes(GUILD_ID).values())
+        print("  atomic script: {:>7.0f} votes/s, {} of {} votes counted ({} lost)".format(
+            VOTERS / took, counted, VOTERS, VOTERS - counted))
+
+        # Everyone votes again, nothing may be counted twice
+        run_concurrently(lambda o, u: votes.plus_one(o, u, GUILD_ID), voters)
+        print("  after everyone voted twice: {} votes".format(sum(votes.get_votes(GUILD_ID).values())))
+        r.flushdb()
+
+        print("\n2. Time per vote (ms)")
+        for prefilled in (0, PREFILLED):
+            old_start_vote(r, GUILD_ID, choices)
+            if prefilled:
+                r.hset("voting:{}".format(GUILD_ID), mapping={"voters": dumps(list(range(prefilled))),
+                                                              "votes": dumps([prefilled // OPTIONS] * OPTIONS)})
+            old = time_one_vote(lambda o, u: old_plus_one(r, o, u, GUILD_ID))
+            r.flushdb()
+
+            votes.start_vote(0, GUILD_ID, "test", choices)
+            if prefilled:
+                for start in range(0, prefilled, 10000):
+                    r.sadd("voting:{}:voters".format(GUILD_ID), *range(start, min(prefilled, start + 10000)))
+            new = time_one_vote(lambda o, u: votes.plus_one(o, u, GUILD_ID))
+            r.flushdb()
+
+            print("  {:>6} voters: json tally {:>7.3f}, atomic script {:>7.3f}".format(prefilled, old, new))
+
+        print("\n3. {} reaction votes, per vote vs batches of {}".format(VOTERS, FLUSH_SIZE))
+        ballots = [(random.randrange(OPTIONS), user_id) for user_id in voters]
+
+        votes.start_vote(0, GUILD_ID, "test", choices)
+        start = time.perf_counter()
+        for o_index, user_id in ballots:
+            votes.plus_one(o_index, user_id, GUILD_ID)
+        single = time.perf_counter() - start
+        single_counted = sum(votes.get_votes(GUILD_ID).values())
+        r.flushdb()
+
+        votes.start_vote(0, GUILD_ID, "test", choices)
+        start = time.perf_counter()
+        for first in range(0, VOTERS, FLUSH_SIZE):
+            votes.add_votes(GUILD_ID, ballots[first:first + FLUSH_SIZE])
+        batched = time.perf_counter() - start
+        batched_counted = sum(votes.get_votes(GUILD_ID).values())
+
+        print("  per vote: {:>8.0f} votes/s, {} round trips, {} counted".format(VOTERS / single, VOTERS, single_counted))
+        print("  batched:  {:>8.0f} votes/s, {} round trips, {} counted".format(
+            VOTERS / batched, -(-VOTERS // FLUSH_SIZE), batched_counted))
+
+    finally:
+        r.flushdb()
+
+
+if __name__ == "__main__":
+    main()
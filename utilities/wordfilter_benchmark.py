@@ -0,0 +1,66 @@
+# coding=utf-8
+
+# Change current directory to the root
+import os
+import sys
+os.chdir("..")
+sys.path.append(os.getcwd())
+
+import time
+import random
+import string
+
+from core.wordfilter import WordFilter, MODE_WORD, MODE_SUBSTRING
+
+#########################################
+# Word filter benchmark
+# Compares the old per-word split check of SwearingDetector with the compiled WordFilter
+#########################################
+
+WORD_AMOUNT = 10000
+MESSAGE_AMOUNT = 2000
+
+random.seed(4)
+
+
+def random_word(min_len=3, max_len=10):
+    return "".join(random.choice(string.ascii_lowercase) for _ in range(random.randint(min_len, max_len)))
+
+
+def old_has_swearing(word_list, message):
+    return bool([a for a in word_list if a in message.split(" ")])
+
+
+def measure(name, fn, messages):
+    start = time.perf_counter()
+    hits = sum(1 for m in messages if fn(m))
+    took = time.perf_counter() - start
+
+    print("{:<28} {:>8.1f} ms  ({:.1f} us/message, {} hits)".format(name, took * 1000, took / len(messages) * 1e6, hits))
+
+
+print("------------------------")
+print("Word filter benchmark")
+print("------------------------")
+
+words = [random_word() for _ in range(WORD_AMOUNT)]
+
+messages = []
+for _ in range(MESSAGE_AMOUNT):
+    tokens = [random_word(2, 8) for _ in range(random.randint(5, 30))]
+    # Roughly every tenth message contains a listed word
+    if random.random() < 0.1:
+        tokens[random.randrange(len(tokens))] = random.choice(words) + random.choice(["", ".", "!"])
+
+    messages.append(" ".join(tokens))
+
+print("{} words, {} messages\n".format(WORD_AMOUNT, MESSAGE_AMOUNT))
+
+start = time.perf_counter()
+word_filter = WordFilter(words, mode=MODE_WORD)
+substring_filter = WordFilter(words, mode=MODE_SUBSTRING)
+print("Compiling both filters took {:.1f} ms\n".format((time.perf_counter() - start) * 1000))
+
+measure("list + split (old)", lambda m: old_has_swearing(words, m), messages)
+measure("WordFilter (word)", word_filter.search, messages)
+measure("WordFilter (substring)", substring_filter.search, messages)